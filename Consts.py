@@ -1,19 +1,23 @@
 import random
 
-_random = None
-
 # The number of simulation runs to do
 NUM_RUNS = 1
 
 DEBUG_MODE = False
 
+# Whether to calculate the driver model for a whole lane at once using numpy
+# arrays, rather than for each vehicle individually. Gives the same results,
+# faster the more vehicles there are in each lane
+VECTORISED_MODEL = False
+
 # Seed used in this simulation - used to generate IDs of various things
 SIMULATION_SEED = random.getrandbits(128)
 # Need a 32 bit seed to use for the numpy random generators
 SIMULATION_SHORT_SEED = SIMULATION_SEED >> (128 - 32)
 
-# Whether force the simulation to update at the same frequency as the display
-FORCE_DISPLAY_FREQ = True
+# Most frames per second of wall time to send to the display, which draws
+# the newest frame it has rather than holding the simulation back
+DISPLAY_FPS = 60
 
 # How often the simulation updates
 SIMULATION_FREQUENCY = 0.001
@@ -92,71 +96,185 @@ PLATOON_ADJUSTMENT = True
 BASE_OUTPUT_DIR = None
 ROAD_DETECTOR_INTERVAL = 30
 
-
-def configure_random():
-    global _random
-    _random = random.Random(SIMULATION_SEED)
-
-
-def generate_seed():
-    global SIMULATION_SEED, SIMULATION_SHORT_SEED, _random
-
-    if not _random:
-        print('_random has not been configured. Calling configure_random before generating a new seed')
-        configure_random()
-
-    # Seed used in this simulation - used to generate IDs of various things
-    SIMULATION_SEED = _random.getrandbits(128)
-    # Need a 32 bit seed to use for the numpy random generators
-    SIMULATION_SHORT_SEED = SIMULATION_SEED >> (128 - 32)
-
-
-def load_from_json(conf):
-    global DEBUG_MODE
-    params = {
-        'Seed': 'SIMULATION_SEED',
-        'Short Seed': 'SIMULATION_SHORT_SEED',
-        'Simulation Update Frequency': 'SIMULATION_FREQUENCY',
-        'Simulation Length': 'SIMULATION_LENGTH',
-        'Simulation Time Step': 'TIME_STEP',
-        'Minimum Injection Gap': 'MINIMUM_INJECTION_GAP',
-        'Road Length': 'ROAD_LENGTH',
-        'Road Detector Aggregation Interval': 'ROAD_DETECTOR_INTERVAL',
-        'Safetime Headway': 'SAFETIME_HEADWAY',
-        'Multi Lane Traffic': 'MULTI_LANE',
-        'Number of Lanes': 'BRIDGE_LANES',
-        'Inflow Rate': 'INFLOW_RATE',
-        'Truck Percentage': 'TRUCK_PCT',
-        'Car Percentage': 'CAR_PCT',
-        'Car Length': 'CAR_LENGTH',
-        'Truck Length': 'TRUCK_LENGTH',
-        'Car v0': 'CAR_SPEED',
-        'Truck v0': 'TRUCK_SPEED',
-        'Car Speed Variance': 'CAR_SPEED_VARIANCE',
-        'Truck Speed Variance': 'TRUCK_SPEED_VARIANCE',
-        'Car Speed Distribution': 'CAR_SPEED_DISTRIBUTION',
-        'Truck Speed Distribution': 'TRUCK_SPEED_DISTRIBUTION',
-        'Truck Unloaded Weight': 'TRUCK_UNLOADED_WEIGHT',
-        'Truck Loaded Weight': 'TRUCK_LOADED_WEIGHT',
-        'Truck Unloaded Weight Variance': 'TRUCK_UNLOADED_WEIGHT_VARIANCE',
-        'Truck Loaded Weight Variance': 'TRUCK_LOADED_WEIGHT_VARIANCE',
-        'Platoon Percentage': 'PLATOON_CHANCE',
-        'Minimum Platoon Length': 'MIN_PLATOON_LENGTH',
-        'Maximum Platoon Length': 'MAX_PLATOON_LENGTH',
-        'Minimum Platoon Gap': 'MIN_PLATOON_GAP',
-        'Maximum Platoon Gap': 'MAX_PLATOON_GAP',
-        'Number of Runs': 'NUM_RUNS',
-        'Car Minimum Gap': 'CAR_MINIMUM_GAP',
-        'Truck Minimum Gap': 'TRUCK_MINIMUM_GAP',
-        'Car Minimum Gap Variance': 'CAR_GAP_VARIANCE',
-        'Truck Minimum Gap Variance': 'TRUCK_GAP_VARIANCE',
-        'Car Minimum Gap Distribution': 'CAR_GAP_DISTRIBUTION',
-        'Truck Minimum Gap Distribution': 'TRUCK_GAP_DISTRIBUTION',
-    }
-    print('Loading configuration from file')
-    for param in conf:
-        if param in params:
-            if DEBUG_MODE:
-                print('Setting {} to {}'.format(params[param], conf[param]))
-            exec('{} = {}'.format(params[param], conf[param]), globals())
-    print('Loaded configuration from file')
+# Write vehicle UUIDs rather than vehicle numbers to the detector output
+EXPORT_UUIDS = False
+
+# Format to write detector output in, one of csv, jsonl or npy
+DETECTOR_OUTPUT_FORMAT = 'csv'
+
+# Record the state of every vehicle at every step to trajectories/, also
+# turned on by DEBUG_MODE
+RECORD_TRAJECTORIES = False
+
+# How vehicles arrive at the inflow rate, constant or poisson. A demand
+# section in the configuration file replaces the inflow rate with a demand
+# profile for each lane
+INFLOW_DISTRIBUTION = 'constant'
+
+# Simulated seconds between frames rendered to frames/ without a window, 0 to
+# not export frames. Frames are written as png images or a raw frame file,
+# see FrameExport
+FRAME_EXPORT_INTERVAL = 0
+FRAME_EXPORT_FORMAT = 'png'
+
+# Name of the run's folder in output/BASE_OUTPUT_DIR and of its replay,
+# trajectory and frame files. None names them after the seed, adding :N to
+# the folder name for repeated runs of the same seed
+RUN_NAME = None
+
+
+# Settings that make up a SimulationConfig, defaulting to the values above
+SETTINGS = (
+    'NUM_RUNS', 'DEBUG_MODE', 'VECTORISED_MODEL', 'SIMULATION_SEED',
+    'SIMULATION_SHORT_SEED', 'DISPLAY_FPS', 'SIMULATION_FREQUENCY',
+    'SIMULATION_LENGTH', 'TIME_STEP', 'CAR_PCT', 'TRUCK_PCT', 'PLATOON_CHANCE',
+    'CAR_LENGTH', 'TRUCK_LENGTH', 'CAR_MINIMUM_GAP', 'TRUCK_MINIMUM_GAP',
+    'CAR_GAP_VARIANCE', 'TRUCK_GAP_VARIANCE', 'CAR_GAP_DISTRIBUTION',
+    'TRUCK_GAP_DISTRIBUTION', 'ROAD_LENGTH', 'MULTI_LANE', 'BRIDGE_LANES',
+    'SAFETIME_HEADWAY', 'INFLOW_RATE', 'CAR_SPEED', 'TRUCK_SPEED',
+    'CAR_SPEED_VARIANCE', 'TRUCK_SPEED_VARIANCE', 'CAR_SPEED_DISTRIBUTION',
+    'TRUCK_SPEED_DISTRIBUTION', 'TRUCK_UNLOADED_WEIGHT', 'TRUCK_LOADED_WEIGHT',
+    'TRUCK_UNLOADED_WEIGHT_VARIANCE', 'TRUCK_LOADED_WEIGHT_VARIANCE',
+    'MIN_PLATOON_LENGTH', 'MAX_PLATOON_LENGTH', 'MIN_PLATOON_GAP',
+    'MAX_PLATOON_GAP', 'MINIMUM_INJECTION_GAP', 'PLATOON_ADJUSTMENT',
+    'BASE_OUTPUT_DIR', 'ROAD_DETECTOR_INTERVAL', 'EXPORT_UUIDS',
+    'DETECTOR_OUTPUT_FORMAT', 'RECORD_TRAJECTORIES', 'INFLOW_DISTRIBUTION',
+    'FRAME_EXPORT_INTERVAL', 'FRAME_EXPORT_FORMAT', 'RUN_NAME',
+)
+
+# Names used for settings in configuration files
+JSON_PARAMS = {
+    'Seed': 'SIMULATION_SEED',
+    'Short Seed': 'SIMULATION_SHORT_SEED',
+    'Simulation Update Frequency': 'SIMULATION_FREQUENCY',
+    'Display FPS': 'DISPLAY_FPS',
+    'Simulation Length': 'SIMULATION_LENGTH',
+    'Simulation Time Step': 'TIME_STEP',
+    'Minimum Injection Gap': 'MINIMUM_INJECTION_GAP',
+    'Road Length': 'ROAD_LENGTH',
+    'Road Detector Aggregation Interval': 'ROAD_DETECTOR_INTERVAL',
+    'Safetime Headway': 'SAFETIME_HEADWAY',
+    'Multi Lane Traffic': 'MULTI_LANE',
+    'Number of Lanes': 'BRIDGE_LANES',
+    'Inflow Rate': 'INFLOW_RATE',
+    'Inflow Distribution': 'INFLOW_DISTRIBUTION',
+    'Truck Percentage': 'TRUCK_PCT',
+    'Car Percentage': 'CAR_PCT',
+    'Car Length': 'CAR_LENGTH',
+    'Truck Length': 'TRUCK_LENGTH',
+    'Car v0': 'CAR_SPEED',
+    'Truck v0': 'TRUCK_SPEED',
+    'Car Speed Variance': 'CAR_SPEED_VARIANCE',
+    'Truck Speed Variance': 'TRUCK_SPEED_VARIANCE',
+    'Car Speed Distribution': 'CAR_SPEED_DISTRIBUTION',
+    'Truck Speed Distribution': 'TRUCK_SPEED_DISTRIBUTION',
+    'Truck Unloaded Weight': 'TRUCK_UNLOADED_WEIGHT',
+    'Truck Loaded Weight': 'TRUCK_LOADED_WEIGHT',
+    'Truck Unloaded Weight Variance': 'TRUCK_UNLOADED_WEIGHT_VARIANCE',
+    'Truck Loaded Weight Variance': 'TRUCK_LOADED_WEIGHT_VARIANCE',
+    'Platoon Percentage': 'PLATOON_CHANCE',
+    'Minimum Platoon Length': 'MIN_PLATOON_LENGTH',
+    'Maximum Platoon Length': 'MAX_PLATOON_LENGTH',
+    'Minimum Platoon Gap': 'MIN_PLATOON_GAP',
+    'Maximum Platoon Gap': 'MAX_PLATOON_GAP',
+    'Number of Runs': 'NUM_RUNS',
+    'Car Minimum Gap': 'CAR_MINIMUM_GAP',
+    'Truck Minimum Gap': 'TRUCK_MINIMUM_GAP',
+    'Car Minimum Gap Variance': 'CAR_GAP_VARIANCE',
+    'Truck Minimum Gap Variance': 'TRUCK_GAP_VARIANCE',
+    'Car Minimum Gap Distribution': 'CAR_GAP_DISTRIBUTION',
+    'Truck Minimum Gap Distribution': 'TRUCK_GAP_DISTRIBUTION',
+    'Vectorised Model': 'VECTORISED_MODEL',
+    'Export UUIDs': 'EXPORT_UUIDS',
+    'Detector Output Format': 'DETECTOR_OUTPUT_FORMAT',
+    'Record Trajectories': 'RECORD_TRAJECTORIES',
+    'Frame Export Interval': 'FRAME_EXPORT_INTERVAL',
+    'Frame Export Format': 'FRAME_EXPORT_FORMAT',
+}
+
+
+def _make_config(settings):
+    return SimulationConfig(**settings)
+
+
+class SimulationConfig(object):
+    """
+    Settings for a single simulation run, with an attribute for each of the
+    SETTINGS above in lower case (e.g. config.road_length).
+
+    Configs are immutable, so one can be shared between threads and
+    processes, and passed between runs without changes made for one run
+    leaking into the next. Use replace to derive a config with different
+    settings.
+    """
+    __slots__ = tuple(setting.lower() for setting in SETTINGS)
+
+    def __init__(self, **settings):
+        for setting in SETTINGS:
+            name = setting.lower()
+            object.__setattr__(self, name,
+                               settings.pop(name, globals()[setting]))
+        if settings:
+            raise TypeError('Unknown settings: {}'.format(
+                ', '.join(settings)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('SimulationConfig is immutable, use replace '
+                             'to change {}'.format(name))
+
+    def __delattr__(self, name):
+        raise AttributeError('SimulationConfig is immutable')
+
+    def __reduce__(self):
+        return _make_config, (self.as_dict(),)
+
+    def __repr__(self):
+        return 'SimulationConfig({})'.format(', '.join(
+            '{}={!r}'.format(name, value)
+            for name, value in self.as_dict().items()))
+
+    @property
+    def run_file_name(self):
+        """
+        Name for the run's replay, trajectory and frame files
+        """
+        if self.run_name is None:
+            return str(self.simulation_seed)
+        return self.run_name
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def replace(self, **changes):
+        settings = self.as_dict()
+        settings.update(changes)
+        return SimulationConfig(**settings)
+
+    @staticmethod
+    def from_json(conf, **overrides):
+        print('Loading configuration from file')
+        settings = {}
+        for param in conf:
+            if param in JSON_PARAMS:
+                settings[JSON_PARAMS[param].lower()] = conf[param]
+        settings.update(overrides)
+        config = SimulationConfig(**settings)
+        if config.debug_mode:
+            for param in conf:
+                if param in JSON_PARAMS:
+                    print('Setting {} to {}'.format(JSON_PARAMS[param],
+                                                    conf[param]))
+        print('Loaded configuration from file')
+        return config
+
+
+def generate_seeds(seed, short_seed, num_runs):
+    # Seeds for every run of a configuration. Extra runs take their seeds from
+    # a generator seeded with the configuration's own seed
+    seeds = [(seed, short_seed)]
+    seed_random = random.Random(seed)
+    for _ in range(num_runs - 1):
+        new_seed = seed_random.getrandbits(128)
+        # Need a 32 bit seed to use for the numpy random generators
+        seeds.append((new_seed, new_seed >> (128 - 32)))
+    return seeds
@@ -0,0 +1,231 @@
+"""
+Schedules of when vehicles arrive at the road.
+
+A schedule hands out the ticks, counting simulation steps from 1, on which
+vehicles arrive, so each step only needs to compare next_tick with the
+current tick and call advance once a vehicle has arrived. Available demand:
+    * ConstantDemand: a vehicle every fixed number of steps
+    * ArrivalStream: arrivals generated up front for the whole run, by
+      PoissonArrivals for a constant rate or ProfileArrivals for a rate that
+      changes piecewise linearly over time
+When several random arrivals land on the same step the extra arrivals are
+taken on the following steps.
+"""
+from decimal import Decimal
+import math
+
+import numpy as np
+
+# Tick used for arrivals that never come, e.g. once the demand drops to zero
+NEVER = 2 ** 62
+
+
+def _ticks_between(interval, time_step):
+    # Steps from one arrival to the next, counted the way the inflow used to
+    # count the interval down by the time step each step
+    remaining = Decimal(interval)
+    step = Decimal(time_step)
+    ticks = 1
+    while remaining > step:
+        remaining -= step
+        ticks += 1
+    return ticks
+
+
+class Demand(object):
+    def __init__(self):
+        self.next_tick = 1
+
+    def advance(self):
+        """
+        Moves next_tick on to the tick of the next arrival
+        """
+        raise NotImplementedError
+
+
+class ConstantDemand(Demand):
+    def __init__(self, rate, time_step):
+        super().__init__()
+        self.interval = _ticks_between((60 * 60) / rate, time_step)
+
+    def advance(self):
+        self.next_tick += self.interval
+
+
+class ArrivalStream(Demand):
+    def __init__(self, ticks):
+        super().__init__()
+        self._ticks = ticks.tolist()
+        self._index = 0
+        self.advance()
+
+    def __len__(self):
+        return len(self._ticks)
+
+    def advance(self):
+        if self._index < len(self._ticks):
+            self.next_tick = self._ticks[self._index]
+            self._index += 1
+        else:
+            self.next_tick = NEVER
+
+
+class RandomArrivals(object):
+    """
+    Arrivals of a Poisson process, found by mapping the arrivals of a process
+    with a rate of 1 through the expected number of vehicles by each time
+    """
+    block_size = 1024
+
+    def __init__(self, time_step, seed):
+        self.time_step = time_step
+        self._random = np.random.RandomState(seed=seed)
+        self._expected = 0.0
+
+    def _arrival_times(self, expected):
+        """
+        Returns the times in seconds by which the given (sorted) numbers of
+        vehicles are expected to have arrived
+        """
+        raise NotImplementedError
+
+    def _next_block(self):
+        expected = self._expected + np.cumsum(
+            self._random.exponential(size=self.block_size))
+        self._expected = expected[-1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ticks = self._arrival_times(expected) / self.time_step
+        ticks = np.ceil(np.fmin(ticks, NEVER))
+        return np.maximum(ticks, 1).astype(np.int64)
+
+    def generate(self, last_tick):
+        """
+        Returns an ArrivalStream of every arrival up to last_tick
+        """
+        blocks = [self._next_block()]
+        while blocks[-1][-1] <= last_tick:
+            blocks.append(self._next_block())
+        ticks = np.concatenate(blocks)
+        return ArrivalStream(ticks[:np.searchsorted(ticks, last_tick,
+                                                    side='right')])
+
+
+class PoissonArrivals(RandomArrivals):
+    def __init__(self, rate, time_step, seed):
+        super().__init__(time_step, seed)
+        self.rate = rate
+
+    def _arrival_times(self, expected):
+        return expected * ((60 * 60) / self.rate)
+
+
+class ProfileArrivals(RandomArrivals):
+    """
+    profile is a list of [time (s), rate (veh/h)] points. The rate is linear
+    between points, and holds the first and last rates before and after them.
+    """
+    def __init__(self, profile, time_step, seed):
+        super().__init__(time_step, seed)
+        points = sorted((float(time), float(rate) / (60 * 60))
+                        for time, rate in profile)
+        if not points:
+            raise ValueError('Demand profile has no points')
+        if any(rate < 0 for _, rate in points):
+            raise ValueError('Demand profile rates cannot be negative')
+        if points[0][0] > 0:
+            points.insert(0, (0.0, points[0][1]))
+        times = np.array([time for time, _ in points])
+        rates = np.array([rate for _, rate in points])
+        durations = np.diff(times)
+
+        # Segments between the points, then one holding the last rate
+        self._starts = times
+        self._rates = rates
+        self._slopes = np.zeros(len(points))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self._slopes[:-1] = np.where(durations > 0,
+                                         np.diff(rates) / durations, 0)
+        self._expected_at = np.zeros(len(points))
+        self._expected_at[1:] = np.cumsum((rates[:-1] + rates[1:]) / 2 *
+                                          durations)
+
+    def _arrival_times(self, expected):
+        i = np.searchsorted(self._expected_at, expected, side='right') - 1
+        rate = self._rates[i]
+        slope = self._slopes[i]
+        remaining = expected - self._expected_at[i]
+        # Solves rate * t + slope * t^2 / 2 = remaining for the time t into
+        # the segment, in a form that also holds when slope is 0
+        return self._starts[i] + (2 * remaining / (
+            rate + np.sqrt(np.maximum(rate * rate + 2 * slope * remaining,
+                                      0))))
+
+
+def _last_tick(config):
+    return int(math.ceil(config.simulation_length / config.time_step)) + 1
+
+
+def make_demand(config):
+    """
+    Returns the arrival schedule for the inflow rate set in the config, for
+    vehicles going into any lane
+    """
+    # The inflow rate is given per lane when there are multiple lanes
+    rate = config.inflow_rate
+    if config.multi_lane:
+        rate = rate * config.bridge_lanes * 2
+    if config.inflow_distribution == 'constant':
+        return ConstantDemand(rate, config.time_step)
+    if config.inflow_distribution == 'poisson':
+        return PoissonArrivals(rate, config.time_step,
+                               config.simulation_short_seed).generate(
+            _last_tick(config))
+    raise ValueError('Unknown inflow distribution: {}, expected constant or '
+                     'poisson'.format(config.inflow_distribution))
+
+
+def make_lane_demands(config, demand):
+    """
+    Returns a list of (lane, arrival schedule) for the demand section of a
+    configuration file. Each entry of the section gives a profile of
+    [time (s), inflow rate (veh/h)] points for a lane, which is a lane
+    number, forward, reverse or all, raising a ValueError for any other lane.
+    Negative lane numbers count back from the last lane, as they do for the
+    zones and detectors added to the Road.
+    Later entries replace earlier ones, and lanes without an entry have no
+    arrivals. Every lane gets its own stream of arrivals, seeded from the
+    short seed and the lane.
+    """
+    lanes = config.bridge_lanes * 2 if config.multi_lane else 1
+    profiles = {}
+    for entry in demand:
+        lane = entry['lane']
+        if lane == 'all':
+            selected = range(lanes)
+        elif lane == 'forward':
+            selected = range(min(config.bridge_lanes, lanes))
+        elif lane == 'reverse':
+            selected = range(config.bridge_lanes, lanes)
+        elif (type(lane) is not int or
+              lane not in range(-config.bridge_lanes * 2,
+                                config.bridge_lanes * 2)):
+            raise ValueError('Unknown lane in demand: {!r}, expected a lane '
+                             'number from {} to {}, forward, reverse or '
+                             'all'.format(lane, -config.bridge_lanes * 2,
+                                          config.bridge_lanes * 2 - 1))
+        elif not config.multi_lane and lane != 0:
+            print('Single lane traffic only, ignoring demand for lane '
+                  '{}'.format(lane))
+            continue
+        elif lane < 0:
+            selected = [lane + config.bridge_lanes * 2]
+        else:
+            selected = [lane]
+        for i in selected:
+            profiles[i] = entry['profile']
+
+    last_tick = _last_tick(config)
+    return [(lane, ProfileArrivals(
+        profiles[lane], config.time_step,
+        [config.simulation_short_seed, lane]).generate(last_tick))
+        for lane in sorted(profiles)]
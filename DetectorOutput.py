@@ -0,0 +1,190 @@
+"""
+Streaming writers for detector output.
+
+Detectors write each row as it is recorded. Rows are buffered and appended to
+the file every FLUSH_ROWS rows, so memory use stays flat however long the run
+is, and a run that crashes keeps everything up to the last flush.
+
+Each sink is given its columns as (name, numpy dtype) pairs. Available
+formats:
+    * csv: a header row then one row per record
+    * jsonl: one JSON object per record
+    * npy: a NumPy structured array, with the header rewritten on every flush
+      so the file can be loaded with np.load at any point
+"""
+import csv
+import json
+import os
+import struct
+
+import numpy as np
+
+# Rows to buffer before appending them to the file
+FLUSH_ROWS = 512
+
+
+class Sink(object):
+    extension = None
+
+    def __init__(self, path, fields):
+        self.path = '{}.{}'.format(path, self.extension)
+        self.fields = fields
+        self.names = [name for name, _ in fields]
+        self.rows = 0
+        self._buffer = []
+        self._file = None
+
+    def write(self, row):
+        self._buffer.append(row)
+        if len(self._buffer) >= FLUSH_ROWS:
+            self.flush()
+
+    def flush(self):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = self._open()
+        if self._buffer:
+            rows = self._buffer
+            self._buffer = []
+            self.rows += len(rows)
+            self._write_rows(rows)
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None and self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+    def read(self):
+        """
+        Returns a dict of column name to the list of values written, reading
+        back from the file
+        """
+        if self._file is None or not self._file.closed:
+            self.flush()
+        return self._columns()
+
+    def _columns(self):
+        columns = {name: [] for name in self.names}
+        for row in self._read_rows():
+            for name, value in zip(self.names, row):
+                columns[name].append(value)
+        return columns
+
+    def _open(self):
+        raise NotImplementedError
+
+    def _write_rows(self, rows):
+        raise NotImplementedError
+
+    def _read_rows(self):
+        raise NotImplementedError
+
+
+class CSVSink(Sink):
+    extension = 'csv'
+
+    def _open(self):
+        _file = open(self.path, 'w')
+        self._writer = csv.writer(_file)
+        # Only written with the first rows, so a detector that recorded
+        # nothing leaves an empty file
+        self._header_pending = True
+        return _file
+
+    def _write_rows(self, rows):
+        if self._header_pending:
+            self._writer.writerow(self.names)
+            self._header_pending = False
+        self._writer.writerows(rows)
+
+    def _read_rows(self):
+        types = [np.dtype(dtype).type for _, dtype in self.fields]
+        with open(self.path) as _file:
+            reader = csv.reader(_file)
+            next(reader, None)
+            for row in reader:
+                yield [_type(value).item()
+                       for _type, value in zip(types, row)]
+
+
+class JSONLinesSink(Sink):
+    extension = 'jsonl'
+
+    def _open(self):
+        return open(self.path, 'w')
+
+    def _write_rows(self, rows):
+        self._file.write(''.join('{}\n'.format(json.dumps(dict(zip(
+            self.names, row)))) for row in rows))
+
+    def _read_rows(self):
+        with open(self.path) as _file:
+            for line in _file:
+                record = json.loads(line)
+                yield [record[name] for name in self.names]
+
+
+class NpySink(Sink):
+    extension = 'npy'
+
+    def __init__(self, path, fields):
+        super().__init__(path, fields)
+        self.dtype = np.dtype(list(fields))
+        # Leave room in the header for any number of rows, so it can be
+        # rewritten in place as the file grows. With the 10 bytes before it
+        # and the newline after it the header is padded to a multiple of 64
+        self._header_length = len(self._header(10 ** 18)) + 1
+        self._header_length += -(self._header_length + 10) % 64
+
+    def _header(self, rows):
+        return "{{'descr': {!r}, 'fortran_order': False, 'shape': ({},), }}".format(
+            np.lib.format.dtype_to_descr(self.dtype), rows)
+
+    def _write_header(self):
+        header = self._header(self.rows).ljust(self._header_length - 1) + '\n'
+        self._file.seek(0)
+        self._file.write(b'\x93NUMPY\x01\x00')
+        self._file.write(struct.pack('<H', len(header)))
+        self._file.write(header.encode('latin1'))
+        self._file.seek(0, 2)
+
+    def _open(self):
+        self._file = open(self.path, 'wb')
+        self._write_header()
+        return self._file
+
+    def _write_rows(self, rows):
+        self._file.write(np.array(rows, dtype=self.dtype).tobytes())
+        self._write_header()
+
+    def _read_rows(self):
+        return np.load(self.path).tolist()
+
+
+SINKS = {
+    'csv': CSVSink,
+    'jsonl': JSONLinesSink,
+    'npy': NpySink,
+}
+
+
+def open_sink(output_format, path, fields):
+    if output_format not in SINKS:
+        raise ValueError('Unknown detector output format: {}, expected one '
+                         'of {}'.format(output_format, ', '.join(SINKS)))
+    return SINKS[output_format](path, fields)
+
+
+def read_output(path, fields):
+    """
+    Returns a dict of column name to the list of values in an output file
+    written by a sink with the given fields, in the format given by the file
+    extension
+    """
+    path, extension = os.path.splitext(path)
+    if extension[1:] not in SINKS:
+        raise ValueError('Unknown detector output format: {}, expected one '
+                         'of {}'.format(extension[1:], ', '.join(SINKS)))
+    return SINKS[extension[1:]](path, fields)._columns()
@@ -1,34 +1,41 @@
-from collections import defaultdict
-import csv
-import json
 import os
 
-import Consts
+from DetectorOutput import open_sink
 
 
 class Detector(object):
-    def __init__(self, lane, time_interval):
+    # Columns of the microscopic (per vehicle) and macroscopic (per interval)
+    # output, as (name, numpy dtype)
+    micro_fields = ()
+    macro_fields = ()
+    # Axis label for each of the macro_fields, for plotting
+    plot_labels = {}
+
+    def __init__(self, config, lane, time_interval, uuids=None):
         self.lane = lane
         self.time_interval = time_interval
         self.next_macro_update = self.time_interval
-        self.microscopic_data = defaultdict(dict)
-        self.macroscopic_data = defaultdict(dict)
+        self._output_format = config.detector_output_format
+        self._uuids = uuids
+        self._micro = None
+        self._macro = None
 
+        base_output_dir = config.base_output_dir
+        seed = config.simulation_seed
         path = 'output/{}/{}{}/detectors/{}'
 
-        if os.path.isdir(path.format(Consts.BASE_OUTPUT_DIR,
-                                     Consts.SIMULATION_SEED, '', self.lane)):
+        if config.run_name is not None:
+            self.path = path.format(base_output_dir, config.run_name, '',
+                                    self.lane)
+        elif os.path.isdir(path.format(base_output_dir, seed, '', self.lane)):
             counter = 0
-            while os.path.isdir(path.format(Consts.BASE_OUTPUT_DIR,
-                                            Consts.SIMULATION_SEED,
+            while os.path.isdir(path.format(base_output_dir, seed,
                                             ':{}'.format(counter), self.lane)):
                 counter += 1
-            self.path = path.format(Consts.BASE_OUTPUT_DIR,
-                                    Consts.SIMULATION_SEED,
+            self.path = path.format(base_output_dir, seed,
                                     ':{}'.format(counter), self.lane)
         else:
-            self.path = path.format(Consts.BASE_OUTPUT_DIR,
-                                    Consts.SIMULATION_SEED, '', self.lane)
+            self.path = path.format(base_output_dir, seed, '', self.lane)
 
     def get_name(self):
         raise NotImplementedError
@@ -36,68 +43,47 @@ class Detector(object):
     def tick(self, time_step, simulated_time, vehicles):
         raise NotImplementedError
 
-    def get_plot_labels(self):
-        raise NotImplementedError
+    def records_macro(self, time_step):
+        """
+        Returns whether the next tick records the macroscopic output
+        """
+        return self.next_macro_update <= time_step
+
+    @classmethod
+    def macro_columns(cls):
+        return cls.macro_fields + (('timestamp', '<f8'),)
+
+    def _open_output(self):
+        # Opened on first use rather than in __init__, as the file names need
+        # the subclass to have been set up
+        name = '{}/{}'.format(self.path, self.get_name())
+        if self.micro_fields:
+            id_dtype = 'U36' if self._uuids else '<i8'
+            self._micro = open_sink(self._output_format, name + '_micro',
+                                    (('id', id_dtype),) + self.micro_fields)
+        self._macro = open_sink(self._output_format, name + '_macro',
+                                self.macro_columns())
+
+    def record_micro(self, _id, values):
+        if self._macro is None:
+            self._open_output()
+        if self._uuids:
+            _id = self._uuids.get(_id)
+        self._micro.write((_id,) + values)
+
+    def record_macro(self, simulated_time, values):
+        if self._macro is None:
+            self._open_output()
+        self._macro.write(values + (simulated_time,))
 
     def write_results(self):
-        # JSON output
-        os.makedirs(self.path, exist_ok=True)
-        _file = open('{}/{}.json'.format(self.path, self.get_name()), 'w')
-        results = {
-            'micro': self.microscopic_data,
-            'macro': self.macroscopic_data
-        }
-        _file.write(json.dumps(results))
-        _file.close()
-
-        # CSV output macroscopic
-        _file = open('{}/{}_macro.csv'.format(self.path, self.get_name()), 'w')
-        csvwriter = csv.writer(_file)
-        count = 0
-        for d in self.macroscopic_data:
-            data = self.macroscopic_data[d]
-            data['timestamp'] = d
-            if count == 0:
-                header = data.keys()
-                csvwriter.writerow(header)
-                count += 1
-            csvwriter.writerow(data.values())
-            del data['timestamp']
-        _file.close()
-
-    def plot(self):
-        os.makedirs(self.path, exist_ok=True)
-        import matplotlib.pyplot as plt
-        from matplotlib import rcParams
-        rcParams['axes.titlepad'] = 40
-
-        if not list(self.macroscopic_data.keys()):
-            return
-
-        k = list(self.macroscopic_data.keys())[0]
-        timestamps = []
-        data_points = defaultdict(list)
-
-        for d in self.macroscopic_data:
-            timestamps.append(d)
-            for key in self.macroscopic_data[d]:
-                data_points[key].append(self.macroscopic_data[d][key])
-
-        for plot in data_points:
-            f, axarr = plt.subplots(1)
-
-            axarr.plot(timestamps, data_points[plot])
-            axarr.set_xlabel('Time (s)')
-            axarr.set_ylabel(self.get_plot_labels()[plot])
-            axarr.grid(False)
-
-            plt.subplots_adjust(top=0.85)
-            plt.tight_layout()
-            f.set_size_inches(16, 9)
-            plt.rcParams.update({'font.size': 16})
-            plt.savefig('{}/{}-{}.png'.format(self.path, self.get_name(), plot),
-                        dpi=300, bbox_inches='tight', pad_inches=0.15)
-            plt.close(f)
+        # Results are written out as they are recorded, so this only needs to
+        # write what is still buffered
+        if self._macro is None:
+            self._open_output()
+        if self._micro:
+            self._micro.close()
+        self._macro.close()
 
 
 def calc_harmonic_mean(data):
@@ -114,8 +100,18 @@ def calc_harmonic_mean(data):
 
 
 class PointDetector(Detector):
-    def __init__(self, lane, position, time_interval):
-        super().__init__(lane, time_interval)
+    micro_fields = (('timestamp', '<f8'), ('velocity', '<f8'),
+                    ('time_headway', '<f8'))
+    macro_fields = (('time_mean_velocity', '<f8'),
+                    ('space_mean_velocity', '<f8'), ('flow', '<i8'))
+    plot_labels = {
+        'time_mean_velocity': 'Time Mean Velocity (m/s)',
+        'space_mean_velocity': 'Space Mean Velocity (m/s)',
+        'flow': 'Flow (veh/h)'
+    }
+
+    def __init__(self, config, lane, position, time_interval, uuids=None):
+        super().__init__(config, lane, time_interval, uuids)
         self.position = position
         self.speeds = []
         self.vehicle_count = 0
@@ -124,161 +120,140 @@ class PointDetector(Detector):
         return 'Point Detector: {}'.format(self.position)
 
     def tick(self, time_step, simulated_time, vehicles):
+        """
+        vehicles are the vehicles that passed the detector in this step, as
+        found by the road's PointDetectorIndex for the lane
+        """
         for vehicle in vehicles:
-            if vehicle.position >= self.position > vehicle.prev_position:
-                self.microscopic_data[vehicle._id] = {
-                    'timestamp': simulated_time,
-                    'velocity': vehicle.velocity,
-                    'time_headway': vehicle.get_safetime_headway()
-                }
-                self.speeds.append(vehicle.velocity)
-                self.vehicle_count += 1
+            self.record_micro(vehicle._id, (simulated_time, vehicle.velocity,
+                                            vehicle.get_safetime_headway()))
+            self.speeds.append(vehicle.velocity)
+            self.vehicle_count += 1
 
         if self.next_macro_update <= time_step:
-            self.macroscopic_data[simulated_time] = {
-                'time_mean_velocity': ((sum(self.speeds) / len(self.speeds))
-                                       if self.speeds else 0),
-                'space_mean_velocity': calc_harmonic_mean(self.speeds),
-                'flow': int((3600 / self.time_interval) * self.vehicle_count)
-            }
+            self.record_macro(simulated_time, (
+                ((sum(self.speeds) / len(self.speeds))
+                 if self.speeds else 0),
+                calc_harmonic_mean(self.speeds),
+                int((3600 / self.time_interval) * self.vehicle_count)))
             self.speeds = []
             self.vehicle_count = 0
             self.next_macro_update = self.time_interval
         else:
             self.next_macro_update -= time_step
 
-    def get_plot_labels(self):
-        return {
-            'time_mean_velocity': 'Time Mean Velocity (m/s)',
-            'space_mean_velocity': 'Space Mean Velocity (m/s)',
-            'flow': 'Flow (veh/h)'
-        }
-
 
 class SpaceDetector(Detector):
-    def __init__(self, lane, start, end, time_interval):
-        super().__init__(lane, time_interval)
+    micro_fields = (('space_mean_velocity', '<f8'),
+                    ('average_space_headway', '<f8'))
+    macro_fields = (('space_mean_velocity', '<f8'), ('density', '<f8'),
+                    ('weight_load', '<f8'))
+    plot_labels = {
+        'space_mean_velocity': 'Space Mean Velocity (m/s)',
+        'density': 'Flow (veh/km)',
+        'weight_load': 'Weight Load (kg)'
+    }
+
+    def __init__(self, config, lane, start, end, time_interval, uuids=None):
+        super().__init__(config, lane, time_interval, uuids)
         self.start = start
         self.end = end
         self.vehicle_count = 0
-        self.in_progress_vehicles = defaultdict(lambda: defaultdict(list))
+        # Vehicles currently in the zone, in the order they entered it, as
+        # [vehicle, velocity sum, space headway sum, ticks in the zone]
+        self.in_progress_vehicles = {}
 
     def get_name(self):
         return 'Space Detector: {}-{}'.format(self.start, self.end)
 
+    @staticmethod
+    def _first_before(vehicles, position):
+        # Index of the first vehicle in the lane (ordered from the front)
+        # that is before position
+        low, high = 0, len(vehicles)
+        while low < high:
+            mid = (low + high) // 2
+            if vehicles[mid].position >= position:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
     def tick(self, time_step, simulated_time, vehicles):
-        for vehicle in vehicles:
-            if self.end > vehicle.position >= self.start:
-                self.in_progress_vehicles[vehicle._id]['velocity'].append(
-                    vehicle.velocity)
-                self.in_progress_vehicles[vehicle._id]['space_headway'].append(
-                    vehicle.gap)
-            elif vehicle._id in self.in_progress_vehicles:
-                vehicle_data = self.in_progress_vehicles.pop(vehicle._id)
-
-                velocities = vehicle_data['velocity']
-                gaps = vehicle_data['space_headway']
-
-                self.microscopic_data[vehicle._id] = {
-                    'space_mean_velocity': ((sum(velocities) / len(velocities))
-                                            if velocities else 0),
-                    'average_space_headway': ((sum(gaps) / len(gaps))
-                                              if gaps else 0)
-                }
+        in_zone = self.in_progress_vehicles
+
+        # Vehicles can only leave through the end of the zone, so they leave
+        # in the order they entered it
+        while in_zone:
+            _id, (vehicle, velocity_sum, gap_sum, ticks) = next(
+                iter(in_zone.items()))
+            if vehicle.position < self.end:
+                break
+            del in_zone[_id]
+            self.record_micro(_id, (velocity_sum / ticks, gap_sum / ticks))
+
+        for vehicle in vehicles[self._first_before(vehicles, self.end):
+                                self._first_before(vehicles, self.start)]:
+            vehicle_data = in_zone.get(vehicle._id)
+            if vehicle_data is None:
+                vehicle_data = in_zone[vehicle._id] = [vehicle, 0, 0, 0]
+            vehicle_data[1] += vehicle.velocity
+            vehicle_data[2] += vehicle.gap
+            vehicle_data[3] += 1
 
         if self.next_macro_update <= time_step:
-            velocities = []
-            weights = []
-            num_vehicles = 0
-            for vehicle in vehicles:
-                if vehicle._id in self.in_progress_vehicles:
-                    velocities.append(vehicle.velocity)
-                    weights.append(vehicle.weight)
-                    num_vehicles += 1
-
-            assert(num_vehicles == len(self.in_progress_vehicles))
-
-            self.macroscopic_data[simulated_time] = {
-                'space_mean_velocity': ((sum(velocities) / len(velocities))
-                                       if velocities else 0),
-                'density': ((len(self.in_progress_vehicles) / ((self.end - self.start) / 1000))
-                            if self.in_progress_vehicles else 0),
-                'weight_load': sum(weights)
-            }
+            velocities = [vehicle_data[0].velocity
+                          for vehicle_data in in_zone.values()]
+            weights = [vehicle_data[0].weight
+                       for vehicle_data in in_zone.values()]
+
+            self.record_macro(simulated_time, (
+                ((sum(velocities) / len(velocities)) if velocities else 0),
+                ((len(in_zone) / ((self.end - self.start) / 1000))
+                 if in_zone else 0),
+                sum(weights)))
 
             self.next_macro_update = self.time_interval
         else:
             self.next_macro_update -= time_step
 
-    def get_plot_labels(self):
-        return {
-            'space_mean_velocity': 'Space Mean Velocity (m/s)',
-            'density': 'Flow (veh/km)',
-            'weight_load': 'Weight Load (kg)'
-        }
-
 
 class RoadDetector(Detector):
-    def __init__(self, time_interval):
-        super().__init__('road', time_interval)
+    macro_fields = (('space_mean_velocity', '<f8'), ('weight_load', '<f8'))
+    plot_labels = {
+        'space_mean_velocity': 'Space Mean Velocity (m/s)',
+        'weight_load': 'Weight Load (kg)'
+    }
+
+    def __init__(self, config, time_interval):
+        super().__init__(config, 'road', time_interval)
+        self._weight_load_total = 0
+        self._weight_load_count = 0
 
     def get_name(self):
         return 'Bridge Detector'
 
     def average_weight(self):
-        weights = []
-        for k in self.macroscopic_data:
-            weights.append(self.macroscopic_data[k]['weight_load'])
-        if weights:
-            return sum(weights) / len(weights)
+        if self._weight_load_count:
+            return self._weight_load_total / self._weight_load_count
         else:
             return 0
 
-    def tick(self, time_step, simulated_time, vehicles):
+    def tick(self, time_step, simulated_time, lanes):
+        # Only reads the vehicles on the steps it records on, going through
+        # each lane in turn
         if self.next_macro_update <= time_step:
-            weight_load = []
-            velocities = []
-            for vehicle in vehicles:
-                weight_load.append(vehicle.weight)
-                velocities.append(vehicle.velocity)
-
-            self.macroscopic_data[simulated_time] = {
-                'space_mean_velocity': ((sum(velocities) / len(velocities))
-                                       if velocities else 0),
-                'weight_load': sum(weight_load)
-            }
+            vehicle_count = sum(len(lane) for lane in lanes)
+            velocity_sum = sum(vehicle.velocity
+                               for lane in lanes for vehicle in lane)
+            weight_load = sum(vehicle.weight
+                              for lane in lanes for vehicle in lane)
+            self.record_macro(simulated_time, (
+                ((velocity_sum / vehicle_count) if vehicle_count else 0),
+                weight_load))
+            self._weight_load_total += weight_load
+            self._weight_load_count += 1
 
             self.next_macro_update = self.time_interval
         else:
             self.next_macro_update -= time_step
-
-    def get_plot_labels(self):
-        return {
-            'space_mean_velocity': 'Space Mean Velocity (m/s)',
-            'weight_load': 'Weight Load (kg)'
-        }
-
-    def write_results(self):
-        # JSON output
-        os.makedirs(self.path, exist_ok=True)
-        _file = open('{}/{}.json'.format(self.path, self.get_name()), 'w')
-        results = {
-            'macro': self.macroscopic_data
-        }
-        _file.write(json.dumps(results))
-        _file.close()
-
-        # CSV output macroscopic
-        _file = open('{}/{}_macro.csv'.format(self.path, self.get_name()), 'w')
-        csvwriter = csv.writer(_file)
-        count = 0
-        for d in self.macroscopic_data:
-            data = self.macroscopic_data[d]
-            data['timestamp'] = d
-            if count == 0:
-                header = data.keys()
-                csvwriter.writerow(header)
-                count += 1
-            csvwriter.writerow(data.values())
-            del data['timestamp']
-        _file.close()
@@ -1,17 +1,45 @@
+import bisect
 import math
 import os
 import contextlib
 import time
-import Consts
+
+import numpy as np
 
 with contextlib.redirect_stdout(None):
     import pygame
     from pygame.locals import DOUBLEBUF
 
+# Upper edges (in seconds) of the buckets frame times are counted in
+FRAME_TIME_BUCKETS = (0.004, 0.008, 0.016, 0.033, 0.066)
+
+# Roads on which cars would be drawn narrower than this (in pixels) to fit the
+# window are drawn as heat strips of the traffic, and can be zoomed in on
+LOD_MIN_SPRITE_WIDTH = 6
+# Length of road (m) each heat strip segment covers
+LOD_SEGMENT_LENGTH = 100
+# Density (veh/km) and speed (m/s) at the red and green ends of the strips
+LOD_JAM_DENSITY = 150
+LOD_FREE_SPEED = 30
+# Colour of segments with no vehicles in them
+LOD_EMPTY_COLOUR = (90, 90, 90)
+# Pixels to scroll by for each step of a horizontal mouse wheel
+LOD_SCROLL_PIXELS = 40
+
+
+def _heat(values):
+    """
+    Maps values from 0 to 1 onto colours from green through yellow to red
+    """
+    red = np.minimum(values * 2, 1) * 230
+    green = np.minimum((1 - values) * 2, 1) * 200
+    return np.stack([red, green, np.zeros_like(values)],
+                    axis=-1).astype(np.uint8)
+
 
 class Display(object):
 
-    def __init__(self, W, H, road_length, num_lanes):
+    def __init__(self, W, H, road_length, num_lanes, max_width=None):
         pygame.init()
 
         self.road_length = road_length
@@ -42,11 +70,19 @@ class Display(object):
         self.truck_platoon = pygame.image.load(os.path.join(base_path, 'resources', "truck_platoon.png"))
         self.truck_platoon = pygame.transform.scale(self.truck_platoon, (int(self.truck_platoon.get_size()[0] >> 1), int(self.truck_platoon.get_size()[1] >> 1)))
 
-        disp_info = pygame.display.Info()
+        native_tiles = (self.road, self.road_top, self.road_bottom,
+                        self.road_single)
+        native_sprites = (('Car', self.car), ('Truck', self.truck),
+                          ('Platooned Truck', self.truck_platoon))
+
+        # Fit the road to the screen, or to max_width if given (e.g. when
+        # there is no real screen to fit to)
+        if max_width is None:
+            max_width = pygame.display.Info().current_w
         desired_width = max(W, math.ceil(road_length / self.road_tile_length) * self.road.get_size()[0])
         scale_factor = 1
-        if desired_width > disp_info.current_w:
-            scale_factor = math.ceil(desired_width / disp_info.current_w)
+        if desired_width > max_width:
+            scale_factor = math.ceil(desired_width / max_width)
 
         self.road = pygame.transform.scale(self.road, (int((self.road.get_size()[0] / scale_factor)), int((self.road.get_size()[1] / scale_factor))))
         self.road_top = pygame.transform.scale(self.road_top, (int((self.road_top.get_size()[0] / scale_factor)), int((self.road_top.get_size()[1] / scale_factor))))
@@ -61,6 +97,13 @@ class Display(object):
         H = (self.road_lanes * self.road.get_size()[1]) + 20
         self.road_pixels = math.ceil(road_length / self.road_tile_length) * self.road.get_size()[0]
 
+        # Vehicles would be too small to make out, so keep the window the
+        # width of the whole road but draw the lanes at full size
+        self.lod = self.car.get_size()[0] < LOD_MIN_SPRITE_WIDTH
+        if self.lod:
+            self.road, self.road_top, self.road_bottom, self.road_single = native_tiles
+            H = (self.road_lanes * self.road.get_size()[1]) + 20
+
         self.lane_positions = []
         for lane_num in range(self.road_lanes):
             self.lane_positions.append(int(10 + (lane_num * self.road.get_size()[1]) + (self.road.get_size()[1] / 4)))
@@ -76,6 +119,16 @@ class Display(object):
         self.truck = self.truck.convert_alpha()
         self.truck_platoon = self.truck_platoon.convert_alpha()
 
+        # Sprites for each kind of vehicle, as drawn in the forward lanes and
+        # flipped for the reverse lanes
+        self.sprites = {}
+        for label, sprite in (('Car', self.car), ('Truck', self.truck),
+                              ('Platooned Truck', self.truck_platoon)):
+            self.sprites[label] = (sprite,
+                                   pygame.transform.flip(sprite, True, False))
+        if self.lod:
+            self._setup_view(scale_factor, native_sprites)
+
         self.background = pygame.Surface((W + 20, H))
         self.road_surface = pygame.Surface((W + 20, self.road_lanes * self.road.get_size()[1]))
         self.background.fill((0, 128, 0))
@@ -104,70 +157,247 @@ class Display(object):
         Display.Vehicle.containers = self.all
         self.remaining_time = 0
         self.simulated_time = 0
-
-    def paint(self, vehicle_data, conn):
+        self.frame_times = [0] * (len(FRAME_TIME_BUCKETS) + 1)
+
+    def _setup_view(self, scale_factor, sprites):
+        """
+        Sets up the zoom levels of the view of a long road, from the whole
+        road down to full size, halving the length of road shown each level.
+        Levels where cars would be too small to make out show heat strips of
+        the density and speed in each lane rather than the vehicles.
+        """
+        sprites = [(label, sprite.convert_alpha()) for label, sprite in sprites]
+        self.view_scales = []
+        scale = scale_factor
+        while scale > 1:
+            self.view_scales.append(scale)
+            scale /= 2
+        self.view_scales.append(1)
+
+        self.view_sprites = []
+        for scale in self.view_scales:
+            if sprites[0][1].get_size()[0] / scale < LOD_MIN_SPRITE_WIDTH:
+                self.view_sprites.append(None)
+                continue
+            level = {}
+            for label, sprite in sprites:
+                sprite = pygame.transform.scale(sprite, (max(1, int(sprite.get_size()[0] / scale)), max(1, int(sprite.get_size()[1] / scale))))
+                level[label] = (sprite,
+                                pygame.transform.flip(sprite, True, False))
+            self.view_sprites.append(level)
+
+        self.view_level = 0
+        self.view_start = 0
+        self.segments = max(1, math.ceil(self.road_length / LOD_SEGMENT_LENGTH))
+        self.strip_height = max(1, (self.road.get_size()[1] // 2) - 12)
+        self._last_frame = None
+
+    def pixels_per_metre(self, level=None):
+        if level is None:
+            level = self.view_level
+        return (self.road_pixels / self.road_length) * (
+                self.view_scales[0] / self.view_scales[level])
+
+    def _set_view(self, level, start):
+        visible = self.road_pixels / self.pixels_per_metre(level)
+        start = min(max(start, 0), max(self.road_length - visible, 0))
+        changed = (level, start) != (self.view_level, self.view_start)
+        self.view_level = level
+        self.view_start = start
+        return changed
+
+    def handle_event(self, event):
+        """
+        Zooms and scrolls the view of a long road. The mouse wheel zooms in and
+        out around the pointer, and dragging or a horizontal wheel scrolls
+        along the road. Returns whether the view changed.
+        """
+        if not self.lod:
+            return False
+        ppm = self.pixels_per_metre()
+        if event.type == pygame.MOUSEWHEEL:
+            if event.y:
+                level = self.view_level + (1 if event.y > 0 else -1)
+                level = min(max(level, 0), len(self.view_scales) - 1)
+                x = pygame.mouse.get_pos()[0] - 10
+                return self._set_view(level, self.view_start + (x / ppm) -
+                                      (x / self.pixels_per_metre(level)))
+            return self._set_view(self.view_level, self.view_start + (
+                    event.x * LOD_SCROLL_PIXELS / ppm))
+        if event.type == pygame.MOUSEMOTION and event.buttons[0]:
+            return self._set_view(self.view_level,
+                                  self.view_start - (event.rel[0] / ppm))
+        return False
+
+    def paint(self, vehicle_data):
         t = time.time()
-        for _ in pygame.event.get():
-            pass
-
+        for event in pygame.event.get():
+            self.handle_event(event)
+
+        if self.lod:
+            self._paint_view(vehicle_data)
+        else:
+            self._paint_vehicles(vehicle_data)
+
+        frame_time = time.time() - t
+        self.frame_times[bisect.bisect(FRAME_TIME_BUCKETS, frame_time)] += 1
+        caption = 'Traffic Simulation Tool | {:.5f} | {:.5f} s | {:.5f} s | {}'.format(frame_time, self.remaining_time, self.simulated_time, self.frame_time_histogram())
+        if self.lod:
+            caption += ' | {:.0f} - {:.0f} m'.format(self.view_start, self.view_start + (self.road_pixels / self.pixels_per_metre()))
+        pygame.display.set_caption(caption)
+
+    def _paint_vehicles(self, vehicle_data):
         self.all.clear(self.screen, self.background)
 
-        v_keys = []
+        seen = set()
         for i, lane in enumerate(vehicle_data):
-            for vehicle in lane:
-                v_keys.append(vehicle[2])
-                l = i if i < self.road_lanes else (i * -1) + (self.road_lanes - 1)
-                if l >= 0:
-                    x_position = int((vehicle[1] / self.road_length) * self.road_pixels) + 10
+            forward = i < self.road_lanes
+            lane_position = self.lane_positions[i]
+            for label, position, _id in lane:
+                seen.add(_id)
+                vehicle = self.vehicles.get(_id)
+                if vehicle is None:
+                    vehicle = Display.Vehicle(self.sprites[label][not forward])
+                    self.vehicles[_id] = vehicle
+                if forward:
+                    x_position = int((position / self.road_length) * self.road_pixels) + 10 - vehicle.rect.width
                 else:
-                    x_position = int(((self.road_length - vehicle[1]) / self.road_length) * self.road_pixels) - 10
-                if vehicle[0] == 'Car':
-                    if l >= 0:
-                        sprite = self.car
-                        x_position = x_position - sprite.get_size()[0]
-                    else:
-                        sprite = pygame.transform.flip(self.car, True, False)
-                elif vehicle[0] == 'Truck':
-                    if l >= 0:
-                        sprite = self.truck
-                        x_position = x_position - sprite.get_size()[0]
-                    else:
-                        sprite = pygame.transform.flip(self.truck, True, False)
-                elif vehicle[0] == 'Platooned Truck':
-                    if l >= 0:
-                        sprite = self.truck_platoon
-                        x_position = x_position - sprite.get_size()[0]
-                    else:
-                        sprite = pygame.transform.flip(self.truck_platoon, True, False)
-                y_position = int(self.lane_positions[i] - (sprite.get_size()[1] / 2))
-                if vehicle[2] not in self.vehicles:
-                    self.vehicles[vehicle[2]] = Display.Vehicle(sprite)
-
-                self.vehicles[vehicle[2]].update_position(x_position, y_position)
-
-        remove_keys = []
-        for k in self.vehicles:
-            if k not in v_keys:
-                remove_keys.append(k)
-        for k in remove_keys:
-            obj = self.vehicles.pop(k)
-            obj.kill()
+                    x_position = int(((self.road_length - position) / self.road_length) * self.road_pixels) - 10
+                vehicle.update_position(x_position, int(lane_position - (vehicle.rect.height / 2)))
+
+        for k in self.vehicles.keys() - seen:
+            self.vehicles.pop(k).kill()
 
         updates = self.all.draw(self.screen)
         pygame.display.update(updates)
 
-        if Consts.FORCE_DISPLAY_FREQ:
-            if conn:
-                conn.send(time.time() - t)
+    @staticmethod
+    def _frame_arrays(vehicle_data):
+        """
+        Returns the lane, position and ID of every vehicle in a frame
+        """
+        counts = [len(lane) for lane in vehicle_data]
+        total = sum(counts)
+        lanes = np.repeat(np.arange(len(counts)), counts)
+        positions = np.fromiter((vehicle[1] for lane in vehicle_data
+                                 for vehicle in lane), np.float64, total)
+        ids = np.fromiter((vehicle[2] for lane in vehicle_data
+                           for vehicle in lane), np.int64, total)
+        return lanes, positions, ids
+
+    def set_last_frame(self, simulated_time, vehicle_data):
+        """
+        Sets the frame painted before the next one, which the speeds in the
+        heat strips are measured from, for when frames are painted out of order
+        """
+        if self.lod:
+            _, positions, ids = self._frame_arrays(vehicle_data)
+            order = np.argsort(ids)
+            self._last_frame = (simulated_time, ids[order], positions[order])
+
+    def _paint_view(self, vehicle_data):
+        lanes, positions, ids = self._frame_arrays(vehicle_data)
+        speeds = self._speeds(positions, ids)
+        # Distance from the left of the window, reverse lanes run right to left
+        forward = lanes < self.road_lanes
+        x = np.where(forward, positions, self.road_length - positions)
 
-        while conn.poll():
-            data = conn.recv()
-            self.remaining_time = data[0]
-            self.simulated_time = data[1]
+        self.screen.blit(self.background, (0, 0))
+        self.screen.set_clip(pygame.Rect(10, 0, self.road_pixels, self.screen.get_size()[1]))
+        sprites = self.view_sprites[self.view_level]
+        if sprites is None:
+            self._paint_heat_strips(lanes, x, speeds)
+        else:
+            ppm = self.pixels_per_metre()
+            pixels = np.floor((x - self.view_start) * ppm).astype(np.int64)
+            margin = max(sprite.get_size()[0] for sprite, _ in sprites.values()) + 10
+            labels = [vehicle[0] for lane in vehicle_data for vehicle in lane]
+            blits = []
+            for i in np.flatnonzero((pixels > -margin) & (pixels < self.road_pixels + margin)).tolist():
+                if forward[i]:
+                    sprite = sprites[labels[i]][0]
+                    x_position = pixels[i] + 10 - sprite.get_size()[0]
+                else:
+                    sprite = sprites[labels[i]][1]
+                    x_position = pixels[i] - 10
+                y_position = int(self.lane_positions[lanes[i]] - (sprite.get_size()[1] / 2))
+                blits.append((sprite, (x_position, y_position)))
+            self.screen.blits(blits, doreturn=False)
+        self.screen.set_clip(None)
+        pygame.display.update()
 
-        pygame.display.set_caption('Traffic Simulation Tool | {:.5f} | {:.5f} s | {:.5f} s'.format(time.time() - t, self.remaining_time, self.simulated_time))
+    def _speeds(self, positions, ids):
+        """
+        Returns the speed of each vehicle since the last frame, or NaN for
+        vehicles that were not in it
+        """
+        speeds = np.full(len(ids), np.nan)
+        if self._last_frame is not None and len(ids):
+            last_time, last_ids, last_positions = self._last_frame
+            elapsed = self.simulated_time - last_time
+            if elapsed > 0 and len(last_ids):
+                i = np.minimum(np.searchsorted(last_ids, ids),
+                               len(last_ids) - 1)
+                matched = last_ids[i] == ids
+                speeds[matched] = (positions[matched] -
+                                   last_positions[i[matched]]) / elapsed
+        order = np.argsort(ids)
+        self._last_frame = (self.simulated_time, ids[order], positions[order])
+        return speeds
+
+    def _paint_heat_strips(self, lanes, x, speeds):
+        """
+        Draws the density (upper half) and mean speed (lower half) of the
+        vehicles in each segment of each lane
+        """
+        num_lanes = len(self.lane_positions)
+        segments = self.segments
+        segment = np.clip((x // LOD_SEGMENT_LENGTH).astype(np.int64), 0,
+                          segments - 1)
+        bins = (lanes * segments) + segment
+        size = num_lanes * segments
+        known = ~np.isnan(speeds)
+        counts = np.bincount(bins, minlength=size)
+        speed_counts = np.bincount(bins[known], minlength=size)
+        speed_sums = np.bincount(bins[known], speeds[known], minlength=size)
+
+        density = counts / (LOD_SEGMENT_LENGTH / 1000)
+        density_colours = _heat(np.minimum(density / LOD_JAM_DENSITY, 1))
+        density_colours[counts == 0] = LOD_EMPTY_COLOUR
+        with np.errstate(divide='ignore', invalid='ignore'):
+            speed = speed_sums / speed_counts
+        speed_colours = _heat(1 - np.clip(np.nan_to_num(speed) / LOD_FREE_SPEED, 0, 1))
+        speed_colours[speed_counts == 0] = LOD_EMPTY_COLOUR
+        strips = np.stack([density_colours.reshape(num_lanes, segments, 3),
+                           speed_colours.reshape(num_lanes, segments, 3)],
+                          axis=2)
+
+        ppm = self.pixels_per_metre()
+        visible = self.road_pixels / ppm
+        first = int(self.view_start // LOD_SEGMENT_LENGTH)
+        last = min(segments, math.ceil((self.view_start + visible) / LOD_SEGMENT_LENGTH))
+        width = max(1, int(round((last - first) * LOD_SEGMENT_LENGTH * ppm)))
+        x_position = 10 + int(((first * LOD_SEGMENT_LENGTH) - self.view_start) * ppm)
+        for i, y in enumerate(self.lane_positions):
+            strip = pygame.surfarray.make_surface(strips[i, first:last])
+            strip = pygame.transform.scale(strip, (width, self.strip_height))
+            self.screen.blit(strip, (x_position, y - (self.strip_height // 2)))
+
+    def frame_time_histogram(self):
+        """
+        Returns the percentage of frames painted in each frame time bucket,
+        e.g. '<4ms 80% | <8ms 15% | ... | >66ms 0%'
+        """
+        total = max(sum(self.frame_times), 1)
+        labels = ['<{:g}ms'.format(edge * 1000) for edge in FRAME_TIME_BUCKETS]
+        labels.append('>{:g}ms'.format(FRAME_TIME_BUCKETS[-1] * 1000))
+        return ' | '.join('{} {:.0f}%'.format(label, (count / total) * 100)
+                          for label, count in zip(labels, self.frame_times))
 
     def cleanup(self):
+        if sum(self.frame_times):
+            print('Frame times over {} frames: {}'.format(
+                sum(self.frame_times), self.frame_time_histogram()))
         pygame.quit()
 
     class Vehicle(pygame.sprite.Sprite):
@@ -0,0 +1,178 @@
+"""
+Shared memory channel for passing frames from the simulation to the display.
+
+The simulation publishes the latest frame at most max_fps times per second
+of wall time, overwriting whatever was there, and the display reads whatever
+frame is newest when it is ready to draw. Neither side ever waits for the
+other, so a slow display drops frames rather than holding the simulation
+back.
+
+The shared block is made up of:
+    * A header: sequence number, frame number, simulated time, remaining
+      time and whether the run has finished
+    * The number of vehicles in each lane (uint32)
+    * For each vehicle its ID (uint32), label (uint8, an index into LABELS)
+      and position (float32), one lane after another
+The sequence number is odd while a frame is being written, so the reader can
+tell when it has read a partly written frame and try again. Vehicles beyond
+the capacity of the block are left out of the frame, with a warning the first
+time it happens.
+"""
+import struct
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+LABELS = ('Car', 'Truck', 'Platooned Truck')
+_LABEL_CODES = {label: code for code, label in enumerate(LABELS)}
+
+_HEADER = struct.Struct('<QQddQ')
+
+# Times the display tries to read a frame the simulation is part way through
+# writing, before giving up until its next frame
+_READ_ATTEMPTS = 100
+
+
+class DisplayChannel(object):
+    def __init__(self, lanes, capacity, max_fps, name=None):
+        self.lanes = lanes
+        self.capacity = capacity
+        self.max_fps = max_fps
+        size = _HEADER.size + (lanes * 4) + (capacity * 9)
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self.name = self._shm.name
+        buf = self._shm.buf
+        offset = _HEADER.size
+        self._counts = np.ndarray(lanes, '<u4', buf, offset)
+        offset += self._counts.nbytes
+        self._ids = np.ndarray(capacity, '<u4', buf, offset)
+        offset += self._ids.nbytes
+        self._positions = np.ndarray(capacity, '<f4', buf, offset)
+        offset += self._positions.nbytes
+        self._labels = np.ndarray(capacity, '<u1', buf, offset)
+        self._sequence = 0
+        self._frame = 0
+        self._last_publish = 0
+        self._warned_truncated = False
+        if name is None:
+            self._write_header(0, 0, 0, False)
+
+    @staticmethod
+    def for_config(config, max_fps):
+        """
+        Creates a channel with room for as many vehicles as can fit on the
+        road set in the config
+        """
+        lanes = config.bridge_lanes * 2
+        shortest = max(1, min(config.car_length, config.truck_length))
+        per_lane = int(config.road_length // shortest) + 16
+        return DisplayChannel(lanes, lanes * per_lane, max_fps)
+
+    def __reduce__(self):
+        # Other processes attach to the same block by name
+        return (DisplayChannel, (self.lanes, self.capacity, self.max_fps,
+                                 self.name))
+
+    def _write_header(self, frame, simulated_time, remaining_time, finished):
+        _HEADER.pack_into(self._shm.buf, 0, self._sequence, frame,
+                          simulated_time, remaining_time, finished)
+
+    def publish(self, simulated_time, remaining_time, vehicle_data):
+        """
+        Writes a frame for the display, unless one was written less than
+        1 / max_fps seconds ago. Returns whether the frame was written.
+        """
+        now = time.perf_counter()
+        if now - self._last_publish < 1 / self.max_fps:
+            return False
+        self._last_publish = now
+
+        ids = []
+        labels = []
+        positions = []
+        counts = []
+        for lane in vehicle_data:
+            if len(lane) > self.capacity - len(ids):
+                self._warn_truncated(vehicle_data)
+                lane = lane[:self.capacity - len(ids)]
+            counts.append(len(lane))
+            for label, position, _id in lane:
+                labels.append(_LABEL_CODES[label])
+                positions.append(position)
+                ids.append(_id)
+
+        total = len(ids)
+        self._frame += 1
+        self._sequence += 1
+        self._write_header(self._frame, simulated_time, remaining_time,
+                           False)
+        self._counts[:] = counts
+        self._ids[:total] = ids
+        self._labels[:total] = labels
+        self._positions[:total] = positions
+        self._sequence += 1
+        self._write_header(self._frame, simulated_time, remaining_time,
+                           False)
+        return True
+
+    def _warn_truncated(self, vehicle_data):
+        if self._warned_truncated:
+            return
+        self._warned_truncated = True
+        print('\nWarning: {} vehicles on the road but the display channel '
+              'only has room for {}, the rest are not drawn'.format(
+                  sum(len(lane) for lane in vehicle_data), self.capacity))
+
+    def finish(self):
+        self._sequence += 2
+        self._write_header(self._frame, 0, 0, True)
+
+    def read(self, last_frame=0):
+        """
+        Returns (frame, simulated_time, remaining_time, vehicle_data) for the
+        newest frame, or None if there is no frame newer than last_frame. Also
+        returns None if the frame is still being written after a few
+        attempts, rather than holding up the display.
+        """
+        for attempt in range(_READ_ATTEMPTS):
+            if attempt:
+                # Let the simulation get on with writing the frame
+                time.sleep(0)
+            sequence, frame, simulated_time, remaining_time, _ = \
+                _HEADER.unpack_from(self._shm.buf, 0)
+            if frame <= last_frame:
+                return None
+            if sequence % 2:
+                continue
+            counts = self._counts.tolist()
+            total = sum(counts)
+            ids = self._ids[:total].tolist()
+            labels = self._labels[:total].tolist()
+            positions = self._positions[:total].tolist()
+            if _HEADER.unpack_from(self._shm.buf, 0)[0] != sequence:
+                continue
+
+            vehicle_data = []
+            i = 0
+            for count in counts:
+                vehicle_data.append([(LABELS[labels[j]], positions[j], ids[j])
+                                     for j in range(i, i + count)])
+                i += count
+            return frame, simulated_time, remaining_time, vehicle_data
+        return None
+
+    @property
+    def finished(self):
+        return bool(_HEADER.unpack_from(self._shm.buf, 0)[4])
+
+    def close(self):
+        # Views into the block have to go before it can be closed
+        self._counts = self._ids = self._positions = self._labels = None
+        self._shm.close()
+
+    def unlink(self):
+        self._shm.unlink()
@@ -1,38 +1,71 @@
 import math
 
 
-import Consts
-
-
 class DriverModel(object):
+    def __init__(self, config):
+        # Read on every step, so kept as plain attributes on the model
+        self.time_step = config.time_step
+        self.no_lead_gap = float(config.road_length + 100)
 
-    @staticmethod
-    def calc_acceleration(vehicle):
+    def calc_acceleration(self, vehicle):
         raise NotImplementedError()
 
-    @staticmethod
-    def calc_velocity(vehicle):
+    def calc_velocity(self, vehicle):
         raise NotImplementedError()
 
-    @staticmethod
-    def calc_position(vehicle):
+    def calc_position(self, vehicle):
         raise NotImplementedError()
 
-    @staticmethod
-    def calc_gap(vehicle):
+    def calc_gap(self, vehicle):
         raise NotImplementedError()
 
+    def _gap(self, vehicle, new_position):
+        if vehicle.lead_vehicle:
+            return float(vehicle.lead_vehicle.position - new_position -
+                         vehicle.lead_vehicle.length)
+        else:
+            return self.no_lead_gap
+
+    def calc_step(self, vehicle):
+        """
+        Returns the new (acceleration, velocity, position, gap) of the vehicle.
+        Models should override this to avoid repeating work between the
+        individual calculations.
+        """
+        return (self.calc_acceleration(vehicle), self.calc_velocity(vehicle),
+                self.calc_position(vehicle), self.calc_gap(vehicle))
+
+    def calc_gap_and_step(self, vehicle):
+        """
+        Returns the gap of the vehicle to its lead vehicle, as calc_gap, and
+        then the new (acceleration, velocity, position, gap) of the vehicle
+        once its gap has been updated. Models should override this to share
+        work between the two.
+        """
+        vehicle.gap = self.calc_gap(vehicle)
+        vehicle._step_cache = None
+        return vehicle.gap, self.calc_step(vehicle)
+
 
 class IDM(DriverModel):
 
-    @staticmethod
-    def calc_acceleration(vehicle):
+    def calc_acceleration(self, vehicle):
         """
         dv(t)/dt = [1 - (v(t)/v0)^4  - (s*(t)/s(t))^2]
         """
-        acceleration = math.pow(
-            (vehicle.velocity / vehicle.get_desired_velocity()), 4)
-        deceleration = math.pow(IDM.calc_desired_gap(vehicle) / vehicle.gap, 2)
+        return self._acceleration(vehicle, self._acceleration_terms(vehicle),
+                                  vehicle.gap)
+
+    def _acceleration_terms(self, vehicle):
+        # The parts of the acceleration that do not depend on the gap
+        return (math.pow((vehicle.velocity / vehicle.get_desired_velocity()),
+                         4),
+                self.calc_desired_gap(vehicle))
+
+    @staticmethod
+    def _acceleration(vehicle, terms, gap):
+        acceleration, desired_gap = terms
+        deceleration = math.pow(desired_gap / gap, 2)
         return float(vehicle.max_acceleration * (1 - acceleration - deceleration))
 
     @staticmethod
@@ -48,67 +81,113 @@ class IDM(DriverModel):
         ret = float(vehicle.minimum_distance + max(0, c))
         return ret
 
-    @staticmethod
-    def calc_velocity(vehicle):
-        new_velocity = IDM.calc_raw_velocity(vehicle)
+    def calc_velocity(self, vehicle):
+        return self._velocity(vehicle, self.calc_acceleration(vehicle))
+
+    def _velocity(self, vehicle, acceleration):
+        new_velocity = self._raw_velocity(vehicle, acceleration)
         return float(max(0, new_velocity))
 
-    @staticmethod
-    def calc_raw_velocity(vehicle):
-        return float(vehicle.velocity + (IDM.calc_acceleration(vehicle) *
-                                         Consts.TIME_STEP))
+    def calc_raw_velocity(self, vehicle):
+        return self._raw_velocity(vehicle, self.calc_acceleration(vehicle))
 
-    @staticmethod
-    def calc_position(vehicle):
-        if IDM.calc_raw_velocity(vehicle) < 0:
+    def _raw_velocity(self, vehicle, acceleration):
+        return float(vehicle.velocity + (acceleration * self.time_step))
+
+    def calc_position(self, vehicle):
+        return self._position(vehicle, self.calc_acceleration(vehicle))
+
+    def _position(self, vehicle, acceleration):
+        time_step = self.time_step
+        if self._raw_velocity(vehicle, acceleration) < 0:
             new_position = (vehicle.position -
                             (0.5 * (math.pow(vehicle.velocity, 2) /
-                                    IDM.calc_acceleration(vehicle))))
+                                    acceleration)))
         else:
             new_position = (vehicle.position +
-                            (vehicle.velocity * Consts.TIME_STEP) +
-                            (0.5 * IDM.calc_acceleration(vehicle) *
-                             math.pow(Consts.TIME_STEP, 2)))
+                            (vehicle.velocity * time_step) +
+                            (0.5 * acceleration * math.pow(time_step, 2)))
         return float(new_position)
 
-    @staticmethod
-    def calc_gap(vehicle):
+    def calc_gap(self, vehicle):
+        if not vehicle.lead_vehicle:
+            return self.no_lead_gap
+        return self._gap(vehicle, self.calc_position(vehicle))
+
+    def calc_step(self, vehicle):
+        acceleration = self.calc_acceleration(vehicle)
+        position = self._position(vehicle, acceleration)
+        return (acceleration, self._velocity(vehicle, acceleration), position,
+                self._gap(vehicle, position))
+
+    def calc_gap_and_step(self, vehicle):
+        # Only the deceleration term changes with the gap, so the rest of the
+        # acceleration is shared between the two calculations
+        terms = self._acceleration_terms(vehicle)
         if vehicle.lead_vehicle:
-            return float(vehicle.lead_vehicle.position -
-                         IDM.calc_position(vehicle) -
-                         vehicle.lead_vehicle.length)
+            gap = self._gap(vehicle, self._position(
+                vehicle, self._acceleration(vehicle, terms, vehicle.gap)))
         else:
-            return float(Consts.ROAD_LENGTH + 100)
+            gap = self.no_lead_gap
+        acceleration = self._acceleration(vehicle, terms, gap)
+        position = self._position(vehicle, acceleration)
+        return gap, (acceleration, self._velocity(vehicle, acceleration),
+                     position, self._gap(vehicle, position))
 
 
 class TruckPlatoon(DriverModel):
-    @staticmethod
-    def calc_acceleration(vehicle):
-        if vehicle.is_leader:
-            return float(IDM.calc_acceleration(vehicle))
-        else:
-            return float(TruckPlatoon.calc_acceleration(vehicle.lead_vehicle))
-
-    @staticmethod
-    def calc_velocity(vehicle):
-        if vehicle.is_leader:
-            return float(IDM.calc_velocity(vehicle))
-        else:
-            return float(TruckPlatoon.calc_velocity(vehicle.lead_vehicle))
+    def __init__(self, config):
+        super().__init__(config)
+        # Platoon leaders drive using the IDM
+        self._idm = IDM(config)
 
-    @staticmethod
-    def calc_position(vehicle):
+    def calc_platoon_step(self, vehicle):
+        """
+        Returns the new (acceleration, velocity, position) of a platooned
+        truck. The leader is calculated once and the followers derived from
+        it in a single pass forward along the platoon, caching the result on
+        each truck until its state next changes. A follower then only needs
+        the truck in front of it rather than recursing back to the leader.
+        """
+        chain = []
+        while vehicle._step_cache is None and not vehicle.is_leader:
+            chain.append(vehicle)
+            vehicle = vehicle.lead_vehicle
+        if vehicle._step_cache is None:
+            acceleration, velocity, position, _ = self._idm.calc_step(vehicle)
+            vehicle._step_cache = (acceleration, velocity, position)
+        acceleration, velocity, position = vehicle._step_cache
+        for follower in reversed(chain):
+            position = float(position - follower.lead_vehicle.length -
+                             follower.follow_distance)
+            follower._step_cache = (acceleration, velocity, position)
+        return acceleration, velocity, position
+
+    def calc_acceleration(self, vehicle):
+        return self.calc_platoon_step(vehicle)[0]
+
+    def calc_velocity(self, vehicle):
+        return self.calc_platoon_step(vehicle)[1]
+
+    def calc_position(self, vehicle):
+        return self.calc_platoon_step(vehicle)[2]
+
+    def calc_gap(self, vehicle):
+        if not vehicle.lead_vehicle:
+            return self.no_lead_gap
+        return self._gap(vehicle, self.calc_position(vehicle))
+
+    def calc_step(self, vehicle):
+        acceleration, velocity, position = self.calc_platoon_step(vehicle)
+        return (acceleration, velocity, position,
+                self._gap(vehicle, position))
+
+    def calc_gap_and_step(self, vehicle):
         if vehicle.is_leader:
-            return float(IDM.calc_position(vehicle))
-        else:
-            return float(TruckPlatoon.calc_position(vehicle.lead_vehicle) -
-                         vehicle.lead_vehicle.length - vehicle.follow_distance)
-
-    @staticmethod
-    def calc_gap(vehicle):
-        if vehicle.lead_vehicle:
-            return float(vehicle.lead_vehicle.position -
-                         TruckPlatoon.calc_position(vehicle) -
-                         vehicle.lead_vehicle.length)
-        else:
-            return float(Consts.ROAD_LENGTH + 100)
+            gap, step = self._idm.calc_gap_and_step(vehicle)
+            vehicle._step_cache = step[:3]
+            return gap, step
+        # A follower's step does not depend on its own gap, so its updated
+        # gap is the same as the new gap from the step
+        step = self.calc_step(vehicle)
+        return step[3], step
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Renders frames of a run without a window, for machines with no display.
+
+Frames are painted by the usual Display on SDL's dummy video driver, in a
+pool of worker processes that each hold their own display, and written as
+either:
+    * png: a directory of numbered PNG images, frame-000000.png onwards
+    * raw: a single file of uncompressed frames, made up of a header (magic,
+      format version, width and height) followed by each frame's simulated
+      time (float64) and RGB pixels (height x width x 3 uint8). Read it with
+      RawFrameReader.
+Frames can be exported from a replay, see __main__, or live from a run by
+setting "Frame Export Interval" in the configuration file.
+"""
+import argparse
+import os
+import struct
+from multiprocessing import Pool, current_process
+
+import numpy as np
+
+import Display
+from Display import pygame
+from Replay import ReplayReader
+
+MAGIC = b'TSFRAME\x00'
+VERSION = 1
+
+FORMATS = ('png', 'raw')
+
+# Width of the screen frames are laid out for, as the window would be
+DEFAULT_WIDTH = 1920
+
+_HEADER = struct.Struct('<8sHII')
+_TIME = struct.Struct('<d')
+
+# Display of this process, set up by _start_renderer
+_display = None
+
+
+def _start_renderer(road_length, lanes, width):
+    global _display
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    # SDL otherwise swallows SIGTERM, so a pool this process is a worker of
+    # could never terminate it
+    os.environ['SDL_NO_SIGNAL_HANDLERS'] = '1'
+    _display = Display.Display(1600, 900, road_length, lanes,
+                               max_width=width)
+
+
+def _render(task):
+    path, simulated_time, vehicle_data, previous = task
+    if previous:
+        _display.set_last_frame(*previous)
+    _display.simulated_time = simulated_time
+    _display.paint(vehicle_data)
+    if path:
+        pygame.image.save(_display.screen, path)
+        return None
+    width, height = _display.screen.get_size()
+    return width, height, pygame.image.tostring(_display.screen, 'RGB')
+
+
+class FrameExporter(object):
+    """
+    Renders the frames given to add_frame in the background and writes them
+    to path, a directory for png or a file for raw, in the order they were
+    added. workers is the number of rendering processes (0 for one per CPU
+    core), or 1 to render in this process.
+    """
+    def __init__(self, path, road_length, lanes, frame_format='png',
+                 workers=0, width=DEFAULT_WIDTH):
+        if frame_format not in FORMATS:
+            raise ValueError('Unknown frame format: {}, expected one of '
+                             '{}'.format(frame_format, ', '.join(FORMATS)))
+        self.path = path
+        self.frame_format = frame_format
+        self.frames = 0
+        self._previous = None
+        self._pending = []
+        self._file = None
+        self._size = None
+
+        if frame_format == 'png':
+            os.makedirs(path, exist_ok=True)
+        else:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._file = open(path, 'wb')
+            self._file.write(_HEADER.pack(MAGIC, VERSION, 0, 0))
+
+        # Pool workers cannot start processes of their own
+        if workers != 1 and current_process().daemon:
+            workers = 1
+        self.workers = workers or os.cpu_count()
+        args = (road_length, lanes, width)
+        if self.workers == 1:
+            self._pool = None
+            _start_renderer(*args)
+        else:
+            self._pool = Pool(workers or None, initializer=_start_renderer,
+                              initargs=args)
+
+    def add_frame(self, simulated_time, vehicle_data):
+        path = None
+        if self.frame_format == 'png':
+            path = os.path.join(self.path,
+                                'frame-{:06d}.png'.format(self.frames))
+        # Each frame carries the one before it, as the heat strips of long
+        # roads measure speeds from it and it may have gone to another worker
+        task = (path, simulated_time, vehicle_data, self._previous)
+        self._previous = (simulated_time, vehicle_data)
+        self.frames += 1
+
+        if self._pool is None:
+            self._write(simulated_time, _render(task))
+            return
+        self._pending.append((simulated_time,
+                              self._pool.apply_async(_render, (task,))))
+        # Write out finished frames, and wait for the oldest if too many are
+        # still being rendered
+        while self._pending and (self._pending[0][1].ready() or
+                                 len(self._pending) > self.workers * 4):
+            simulated_time, result = self._pending.pop(0)
+            self._write(simulated_time, result.get())
+
+    def _write(self, simulated_time, frame):
+        if frame is None:
+            return
+        width, height, pixels = frame
+        self._size = (width, height)
+        self._file.write(_TIME.pack(simulated_time))
+        self._file.write(pixels)
+
+    def close(self):
+        for simulated_time, result in self._pending:
+            self._write(simulated_time, result.get())
+        self._pending = []
+        if self._pool:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        elif _display:
+            _display.cleanup()
+        if self._file:
+            if self._size:
+                self._file.seek(0)
+                self._file.write(_HEADER.pack(MAGIC, VERSION, *self._size))
+            self._file.close()
+            self._file = None
+
+
+class RawFrameReader(object):
+    """
+    Memory maps the frames of a raw frame file, e.g. reader['pixels'][i] is
+    the (height, width, 3) image of frame i and reader['time'][i] its
+    simulated time
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as _file:
+            magic, version, self.width, self.height = _HEADER.unpack(
+                _file.read(_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError('{} is not a raw frame file'.format(path))
+        if version != VERSION:
+            raise ValueError('Unsupported frame file version: {}'.format(
+                version))
+        dtype = np.dtype([('time', '<f8'),
+                          ('pixels', 'u1', (self.height, self.width, 3))])
+        frames = (os.path.getsize(path) - _HEADER.size) // dtype.itemsize
+        if frames:
+            self.frames = np.memmap(path, dtype=dtype, mode='r',
+                                    offset=_HEADER.size, shape=(frames,))
+        else:
+            self.frames = np.empty(0, dtype=dtype)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, name):
+        return self.frames[name]
+
+
+def export_replay(reader, exporter, interval, start_time, end_time):
+    """
+    Exports a frame every interval simulated seconds of a replay, from
+    start_time to end_time
+    """
+    first_time = reader.get_frame(0)[0]
+    last_time = reader.get_frame(len(reader) - 1)[0]
+    start_time = max(start_time, first_time)
+    if end_time is None:
+        end_time = last_time
+    end_time = min(end_time, last_time)
+    frame = 0
+    while start_time + (frame * interval) <= end_time:
+        frame_time, vehicle_data = reader.get_frame(
+            reader.find_frame(start_time + (frame * interval)))
+        exporter.add_frame(frame_time, vehicle_data)
+        frame += 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Export frames of a recorded simulation run')
+    parser.add_argument('replay', help='Replay file to export, from replays/')
+    parser.add_argument('output', help='Directory (png) or file (raw) to '
+                                       'write the frames to')
+    parser.add_argument('--interval', type=float, default=1,
+                        help='Simulated seconds between frames')
+    parser.add_argument('--format', choices=FORMATS, default='png',
+                        help='Format to write the frames in')
+    parser.add_argument('--start', type=float, default=0,
+                        help='Simulated time to export from (s)')
+    parser.add_argument('--end', type=float, default=None,
+                        help='Simulated time to export until (s)')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Rendering processes, 0 for one per CPU core')
+    parser.add_argument('--width', type=int, default=DEFAULT_WIDTH,
+                        help='Width of the screen to lay the frames out for')
+    args = parser.parse_args()
+
+    replay = ReplayReader(args.replay)
+    if not len(replay):
+        print('Replay {} has no frames to export'.format(args.replay))
+    else:
+        exporter = FrameExporter(args.output, replay.road_length,
+                                 replay.lanes // 2, args.format, args.workers,
+                                 args.width)
+        export_replay(replay, exporter, args.interval, args.start, args.end)
+        exporter.close()
+        print('Exported {} frames to {}'.format(exporter.frames, args.output))
+    replay.close()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Times how long the entry points take to import, and checks it stays within
+its startup budget.
+
+Each module is imported in a fresh interpreter several times, and fails the
+check if the median import time is over its budget or if importing it loads
+any of the heavy packages it should only load when a feature needs them (e.g.
+pygame for the display, matplotlib for plotting). The headless entry points
+that sweeps launch have tight budgets, while the replay player and frame
+export load pygame by design and so get looser ones. Exits with status 1 if
+any check fails, so it can guard a batch setup or CI job:
+
+    ./ImportBenchmark.py --runs 5
+
+On a slower machine, --scale multiplies every budget, e.g. --scale 2.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Modules to time, with the most milliseconds importing them may take and
+# the packages importing them must not load
+CHECKS = (
+    ('Simulation', 250, ('pygame', 'matplotlib', 'scipy.stats')),
+    ('Plotting', 200, ('pygame', 'matplotlib', 'scipy.stats')),
+    ('ReplayPlayer', 400, ('matplotlib', 'scipy.stats')),
+    ('FrameExport', 400, ('matplotlib', 'scipy.stats')),
+)
+
+_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, [name for name in {heavy!r} if name in sys.modules]]))
+"""
+
+
+def time_import(module, heavy):
+    """
+    Returns (seconds, heavy packages loaded) for importing module in a fresh
+    interpreter
+    """
+    result = subprocess.run(
+        [sys.executable, '-c', _SCRIPT.format(module=module, heavy=heavy)],
+        cwd=os.path.abspath(os.path.dirname(__file__)),
+        stdout=subprocess.PIPE, check=True, universal_newlines=True)
+    elapsed, loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    return elapsed, loaded
+
+
+def slowest_imports(module, count):
+    """
+    Returns the count slowest modules (by their own import time in
+    microseconds) imported along with module, from python -X importtime
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+        cwd=os.path.abspath(os.path.dirname(__file__)),
+        stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, check=True,
+        universal_newlines=True)
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, _, name = line[len('import time:'):].split('|')
+        times.append((int(own), name.strip()))
+    return sorted(times, reverse=True)[:count]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Check the import time of the entry points')
+    parser.add_argument('--scale', type=float, default=1,
+                        help='Factor to multiply the budget of each import '
+                             'by')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='Imports to take the median time of')
+    parser.add_argument('--top', type=int, default=0,
+                        help='Also list this many of the slowest modules '
+                             'each entry point imports')
+    args = parser.parse_args()
+
+    failed = False
+    for module, budget, heavy in CHECKS:
+        budget *= args.scale
+        times = []
+        loaded = []
+        for _ in range(args.runs):
+            elapsed, loaded = time_import(module, heavy)
+            times.append(elapsed * 1000)
+        median = statistics.median(times)
+        problems = []
+        if median > budget:
+            problems.append('over budget of {:.0f} ms'.format(budget))
+        if loaded:
+            problems.append('loads {}'.format(', '.join(loaded)))
+        failed = failed or bool(problems)
+        print('{:<14} {:8.1f} ms  {}'.format(module, median,
+                                             '; '.join(problems) or 'ok'))
+        for own, name in slowest_imports(module, args.top):
+            print('    {:8.1f} ms  {}'.format(own / 1000, name))
+
+    sys.exit(1 if failed else 0)
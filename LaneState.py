@@ -0,0 +1,336 @@
+import math
+
+import numpy as np
+
+from Vehicle import PlatoonedTruck
+
+
+class LaneState(object):
+    """
+    Structure-of-arrays store of the vehicles in one lane, ordered from the
+    front of the lane to the back. Allows the IDM update for the whole lane
+    to be done as a handful of array operations instead of calling the
+    DriverModel for every Vehicle object.
+
+    The arrays hold the state of the vehicles from one step to the next. The
+    Vehicle objects are only brought up to date with sync for the vehicles
+    something reads them for, i.e. detectors, trajectories and new vehicles
+    joining the back of the lane, and the frames for the display and replay
+    are built straight from the arrays.
+    """
+    _PARAMS = ('desired_velocity', 'max_acceleration', 'minimum_distance',
+               'length', 'follow_distance', 'comfort_factor')
+    _STATE = ('position', 'velocity', 'acceleration', 'gap',
+              'prev_position', 'prev_velocity', 'prev_acceleration',
+              'prev_gap')
+    # Parameters for the next step, calculated ahead of time
+    _NEW = ('new_acceleration', 'new_velocity', 'new_position', 'new_gap')
+
+    def __init__(self, road, lane, capacity=64):
+        self._road = road
+        self.time_step = road.config.time_step
+        self.no_lead_gap = float(road.length + 100)
+        self.lane = lane
+        self._head = 0
+        self._tail = 0
+        for param in LaneState._PARAMS + LaneState._STATE + LaneState._NEW:
+            setattr(self, param, np.zeros(capacity))
+        # Platooned trucks following another truck, rather than leading
+        self.follower = np.zeros(capacity, dtype=bool)
+        self.followers = 0
+        # Labels and IDs of the vehicles, for building frames
+        self.labels = []
+        self.ids = []
+        # Number of vehicles, from the front, that have their parameters for
+        # the next step in the new_ arrays
+        self._calculated = 0
+
+    def __len__(self):
+        return self._tail - self._head
+
+    def _resize(self):
+        size = len(self)
+        capacity = len(self.follower)
+        if size * 2 > capacity:
+            capacity *= 2
+        for param in (LaneState._PARAMS + LaneState._STATE + LaneState._NEW +
+                      ('follower',)):
+            old = getattr(self, param)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:size] = old[self._head:self._tail]
+            setattr(self, param, new)
+        self._head = 0
+        self._tail = size
+
+    def append(self, vehicle):
+        if self._tail == len(self.follower):
+            self._resize()
+        i = self._tail
+        self.desired_velocity[i] = vehicle.desired_velocity
+        self.max_acceleration[i] = vehicle.max_acceleration
+        self.minimum_distance[i] = vehicle.minimum_distance
+        self.length[i] = vehicle.length
+        self.comfort_factor[i] = 2 * math.sqrt(vehicle.max_acceleration *
+                                               vehicle.max_deceleration)
+        if type(vehicle) is PlatoonedTruck:
+            self.follower[i] = not vehicle.is_leader
+            self.followers += int(self.follower[i])
+            self.follow_distance[i] = vehicle.follow_distance
+        else:
+            self.follower[i] = False
+            self.follow_distance[i] = 0
+        self._tail += 1
+        self.labels.append(vehicle._label)
+        self.ids.append(vehicle._id)
+        self.load_last(vehicle)
+
+    def load_last(self, vehicle):
+        """
+        Takes the state of the vehicle at the back of the lane from the
+        Vehicle object, after it has been placed on the road
+        """
+        i = self._tail - 1
+        for name in LaneState._STATE:
+            getattr(self, name)[i] = getattr(vehicle, name)
+
+    def drop_front(self, count):
+        """
+        Removes the count vehicles at the front of the lane. The new front
+        vehicle has no lead vehicle, so leads its platoon if it is in one.
+        """
+        self.followers -= int(np.count_nonzero(
+            self.follower[self._head:self._head + count]))
+        self._head += count
+        assert(self._head <= self._tail)
+        self._calculated = max(0, self._calculated - count)
+        del self.labels[:count]
+        del self.ids[:count]
+        if self._head == self._tail:
+            self._head = self._tail = 0
+        else:
+            self.gap[self._head] = self.no_lead_gap
+            if self.follower[self._head]:
+                self.follower[self._head] = False
+                self.followers -= 1
+
+    def sync(self, vehicles, indices):
+        """
+        Brings the Vehicle objects at the given positions in the lane up to
+        date with the arrays
+        """
+        s = self._head
+        for i in indices:
+            vehicle = vehicles[i]
+            vehicle.position = float(self.position[s + i])
+            vehicle.velocity = float(self.velocity[s + i])
+            vehicle.acceleration = float(self.acceleration[s + i])
+            vehicle.gap = float(self.gap[s + i])
+            vehicle.prev_position = float(self.prev_position[s + i])
+            vehicle.prev_velocity = float(self.prev_velocity[s + i])
+            vehicle.prev_acceleration = float(self.prev_acceleration[s + i])
+            vehicle.prev_gap = float(self.prev_gap[s + i])
+
+    def sync_all(self, vehicles):
+        self.sync(vehicles, range(len(self)))
+
+    def sync_last(self, vehicles):
+        if len(self):
+            self.sync(vehicles, [len(self) - 1])
+
+    def frame(self):
+        """
+        Returns the (label, position, id) of each vehicle, as Road.update
+        builds for the display
+        """
+        return list(zip(self.labels,
+                        self.position[self._head:self._tail].tolist(),
+                        self.ids))
+
+    def count_leaving(self, road_length):
+        """
+        Returns the number of vehicles at the front of the lane that are past
+        the end of the road
+        """
+        beyond = self.position[self._head:self._tail] > road_length
+        if beyond.all():
+            return len(beyond)
+        return int(np.argmin(beyond))
+
+    def count_at_or_after(self, position):
+        """
+        Returns the number of vehicles, from the front of the lane, at or
+        after position
+        """
+        return int(np.count_nonzero(
+            self.position[self._head:self._tail] >= position))
+
+    def passed(self, position):
+        """
+        Returns the positions in the lane of the vehicles that moved from
+        before position to at or after it in the last step
+        """
+        s = slice(self._head, self._tail)
+        return np.flatnonzero((self.prev_position[s] < position) &
+                              (self.position[s] >= position)).tolist()
+
+    def _calc_terms(self):
+        """
+        Returns the parts of the IDM acceleration of every vehicle in the lane
+        that do not depend on its gap, as IDM._acceleration_terms
+        """
+        s = slice(self._head, self._tail)
+        position = self.position[s]
+        velocity = self.velocity[s]
+        lead_velocity = np.empty_like(velocity)
+        lead_velocity[0] = velocity[0]
+        lead_velocity[1:] = velocity[:-1]
+
+        desired_velocity = self.desired_velocity[s]
+        speed_limits = self._road.get_speed_limits(self.lane, position)
+        if speed_limits is not None:
+            desired_velocity = np.where(np.isnan(speed_limits),
+                                        desired_velocity,
+                                        np.fmin(speed_limits,
+                                                desired_velocity))
+        headway = self._road.get_safetime_headways(self.lane, position)
+
+        c = ((headway * velocity) +
+             ((velocity * (velocity - lead_velocity)) /
+              self.comfort_factor[s]))
+        desired_gap = self.minimum_distance[s] + np.maximum(0, c)
+        return np.float_power(velocity / desired_velocity, 4), desired_gap
+
+    def _calc_step(self, terms, gap, first=0):
+        """
+        Vectorised equivalent of IDM.calc_acceleration, calc_velocity and
+        calc_position (and TruckPlatoon for platoon followers), using the
+        given gaps, for the vehicles in the lane from first back. Platoon
+        followers take their leader's step from the new_ arrays, so the
+        vehicles in front of first must have theirs calculated already.
+        Returns the new acceleration, velocity and position.
+        """
+        s = slice(self._head + first, self._tail)
+        position = self.position[s]
+        velocity = self.velocity[s]
+        free_road, desired_gap = terms
+        acceleration = self.max_acceleration[s] * (
+            1 - free_road[first:] -
+            np.float_power(desired_gap[first:] / gap[first:], 2))
+
+        time_step = self.time_step
+        raw_velocity = velocity + (acceleration * time_step)
+        new_velocity = np.maximum(0, raw_velocity)
+        new_position = (position + (velocity * time_step) +
+                        (0.5 * acceleration * math.pow(time_step, 2)))
+        stopping = raw_velocity < 0
+        if stopping.any():
+            new_position = np.where(
+                stopping,
+                position - (0.5 * (np.float_power(velocity, 2) /
+                                   acceleration)),
+                new_position)
+
+        if not self.followers:
+            return acceleration, new_velocity, new_position
+
+        # Platoon followers copy the leader, and are positioned behind the
+        # vehicle in front of them at their following distance
+        for i in np.flatnonzero(self.follower[s]).tolist():
+            j = self._head + first + i - 1
+            if i:
+                lead = (acceleration[i - 1], new_velocity[i - 1],
+                        new_position[i - 1])
+            else:
+                lead = (self.new_acceleration[j], self.new_velocity[j],
+                        self.new_position[j])
+            acceleration[i] = lead[0]
+            new_velocity[i] = lead[1]
+            new_position[i] = lead[2] - self.length[j] - \
+                self.follow_distance[j + 1]
+
+        return acceleration, new_velocity, new_position
+
+    def _calc_gaps(self, new_position, first=0):
+        """
+        Returns the gap of each vehicle from first back to the current
+        position of the vehicle in front of it, given the new positions
+        """
+        gaps = np.empty_like(new_position)
+        start = self._head + first
+        if first:
+            gaps[0:] = (self.position[start - 1:self._tail - 1] -
+                        new_position - self.length[start - 1:self._tail - 1])
+        else:
+            gaps[0] = self.no_lead_gap
+            gaps[1:] = (self.position[self._head:self._tail - 1] -
+                        new_position[1:] -
+                        self.length[self._head:self._tail - 1])
+        return gaps
+
+    def _store_new(self, terms, first=0):
+        s = slice(self._head + first, self._tail)
+        step = self._calc_step(terms, self.gap[self._head:self._tail], first)
+        (self.new_acceleration[s], self.new_velocity[s],
+         self.new_position[s]) = step
+        self.new_gap[s] = self._calc_gaps(step[2], first)
+        self._calculated = len(self)
+
+    def calc_new_params(self):
+        """
+        Equivalent of Vehicle.calc_new_params for the vehicles in the lane
+        that have joined it since update_gaps last calculated them
+        """
+        if self._calculated < len(self):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                self._store_new(self._calc_terms(), self._calculated)
+
+    def update_new_params(self):
+        """
+        Equivalent of Vehicle.update_new_params for every vehicle in the lane
+        """
+        if not len(self):
+            return
+        assert(self._calculated == len(self))
+        s = slice(self._head, self._tail)
+        self.prev_position[s] = self.position[s]
+        self.prev_velocity[s] = self.velocity[s]
+        self.prev_acceleration[s] = self.acceleration[s]
+        self.prev_gap[s] = self.gap[s]
+        self.acceleration[s] = self.new_acceleration[s]
+        self.velocity[s] = self.new_velocity[s]
+        self.position[s] = self.new_position[s]
+        self.gap[s] = self.new_gap[s]
+        self._calculated = 0
+
+        assert((self.velocity[s] >= 0).all())
+        assert((self.position[s] >= 0).all())
+        assert((self.position[self._head:self._tail - 1] -
+                self.length[self._head:self._tail - 1] >=
+                self.position[self._head + 1:self._tail]).all())
+
+    def update_gaps(self):
+        """
+        Equivalent of Vehicle.update_gap for every vehicle in the lane: updates
+        the gaps, then calculates the parameters for the next step with them.
+        The front vehicle has no lead vehicle, so its gap is left as it is.
+        As with IDM.calc_gap_and_step, the parts of the acceleration that do
+        not depend on the gap are shared between the two calculations.
+        """
+        if not len(self):
+            return
+        with np.errstate(divide='ignore', invalid='ignore'):
+            terms = self._calc_terms()
+            if len(self) > 1:
+                _, _, new_position = self._calc_step(
+                    terms, self.gap[self._head:self._tail])
+                self.gap[self._head + 1:self._tail] = \
+                    self._calc_gaps(new_position)[1:]
+            self._store_new(terms)
+        if self.followers:
+            # Followers are positioned from their platoon leader, so their step
+            # does not depend on their own gap. Their gap comes from the step
+            # using their leader's updated gap, which is the one just
+            # calculated for the next step.
+            s = slice(self._head, self._tail)
+            self.gap[s] = np.where(self.follower[s], self.new_gap[s],
+                                   self.gap[s])
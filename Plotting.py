@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Renders the graphs of a run from the output files it wrote.
+
+Plotting is a separate stage from the run: it reads the macroscopic output of
+each detector and the vehicle samples the garage wrote to garage.npz, so the
+graphs of a run can be rendered again, or for the first time if the run was
+made with NO_PLOTS set, from its output directory:
+
+    ./Plotting.py output/NAME/SEED --dpi 100
+
+Each graph is rendered by matplotlib's Agg backend in a pool of worker
+processes, at 16x9 inches and 300 dpi unless a lower draft dpi is given.
+"""
+import argparse
+import glob
+import os
+from multiprocessing import Pool, current_process
+
+import numpy as np
+
+import Detectors
+from DetectorOutput import read_output
+
+DPI = 300
+
+# Detector classes by the name their output is written under
+DETECTOR_KINDS = {
+    'Point Detector': Detectors.PointDetector,
+    'Space Detector': Detectors.SpaceDetector,
+    'Bridge Detector': Detectors.RoadDetector,
+}
+
+
+def _start_plotter():
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import rcParams
+    rcParams['axes.titlepad'] = 40
+    rcParams['font.size'] = 16
+
+
+def _plot_detector(path, kind, dpi):
+    import matplotlib.pyplot as plt
+    name = os.path.basename(path).rsplit('_macro.', 1)[0]
+    data_points = read_output(path, kind.macro_columns())
+    timestamps = data_points.pop('timestamp')
+    if not timestamps:
+        return 0
+
+    for plot in data_points:
+        f, axarr = plt.subplots(1)
+
+        axarr.plot(timestamps, data_points[plot])
+        axarr.set_xlabel('Time (s)')
+        axarr.set_ylabel(kind.plot_labels[plot])
+        axarr.grid(False)
+
+        plt.subplots_adjust(top=0.85)
+        plt.tight_layout()
+        f.set_size_inches(16, 9)
+        plt.savefig('{}/{}-{}.png'.format(os.path.dirname(path), name, plot),
+                    dpi=dpi, bbox_inches='tight', pad_inches=0.15)
+        plt.close(f)
+    return len(data_points)
+
+
+def _plot_garage(path, dpi):
+    import matplotlib.pyplot as plt
+    samples = np.load(path)
+
+    f, axarr = plt.subplots(3, 2, squeeze=False)
+
+    for (row, column), key, label in (
+            ((0, 0), 'car_velocities', 'Desired Car Velocity (m/s)'),
+            ((0, 1), 'car_gaps', 'Desired Car Minimum Gap (m)'),
+            ((1, 0), 'truck_velocities', 'Desired Truck Velocity (m/s)'),
+            ((1, 1), 'truck_gaps', 'Desired Truck Minimum Gap (m)'),
+            ((2, 0), 'truck_weights', 'Truck Wights (m)')):
+        if len(samples[key]):
+            axarr[row, column].hist(samples[key], density=True, ec="k")
+            axarr[row, column].set_xlabel(label)
+            axarr[row, column].set_ylabel('Density')
+
+    f.suptitle('Data from Vehicle Generation', fontsize=12, y=0.99)
+    plt.subplots_adjust(top=0.85)
+    plt.tight_layout()
+    f.set_size_inches(16, 9)
+    plt.savefig('{}/garage.png'.format(os.path.dirname(path)), dpi=dpi)
+    plt.close(f)
+    return 1
+
+
+def _plot(job):
+    function, args = job
+    return function(*args)
+
+
+def find_plots(run_path, dpi=DPI):
+    """
+    Returns the graphs to render for the output of a run, as a list of
+    (function, args)
+    """
+    jobs = []
+    pattern = os.path.join(glob.escape(run_path), 'detectors', '*',
+                           '*_macro.*')
+    for path in sorted(glob.glob(pattern)):
+        name = os.path.basename(path).rsplit('_macro.', 1)[0]
+        kind = DETECTOR_KINDS.get(name.split(':')[0])
+        if kind:
+            jobs.append((_plot_detector, (path, kind, dpi)))
+    garage = os.path.join(run_path, 'garage.npz')
+    if os.path.isfile(garage):
+        jobs.append((_plot_garage, (garage, dpi)))
+    return jobs
+
+
+def plot_run(run_path, dpi=DPI, workers=0):
+    """
+    Renders the graphs for the output of a run, across workers processes (0
+    for one per CPU core), and returns how many were rendered
+    """
+    jobs = find_plots(run_path, dpi)
+    workers = min(workers or os.cpu_count(), len(jobs))
+    # Pool workers cannot start processes of their own
+    if workers <= 1 or current_process().daemon:
+        _start_plotter()
+        return sum(_plot(job) for job in jobs)
+    with Pool(workers, initializer=_start_plotter) as pool:
+        return sum(pool.map(_plot, jobs, chunksize=1))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Render the graphs of a simulation run from its output')
+    parser.add_argument('runs', nargs='+',
+                        help='Output directories of runs, output/NAME/SEED')
+    parser.add_argument('--dpi', type=int, default=DPI,
+                        help='Resolution to render at, lower for drafts')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Rendering processes, 0 for one per CPU core')
+    args = parser.parse_args()
+
+    for run in args.runs:
+        print('Rendered {} graphs for "{}"'.format(
+            plot_run(run, args.dpi, args.workers), run))
@@ -0,0 +1,326 @@
+"""
+Binary replay format for recorded simulation runs.
+
+A replay file is made up of:
+    * A header: magic, format version, number of lanes and road length
+    * A sequence of chunks, each holding up to a fixed number of frames as a
+      zlib compressed block. A chunk carries any strings (vehicle labels)
+      first used within it, so the string table can be built up while
+      streaming through the file.
+    * An index of the chunks (file offset, time of the first frame and number
+      of the first frame) and the complete string table, followed by a
+      trailer pointing at the index, so a reader can seek straight to any
+      point in the run. Files from runs that did not finish have no index,
+      and are read by walking through the chunks instead.
+
+Within a chunk the frames are stored as columns: the frame times (float64),
+the number of vehicles in each lane for each frame (uint32), then for every
+vehicle its ID (uint32), the string table entry of its label (uint32) and
+its position (float32).
+"""
+import bisect
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b'TSREPLAY'
+VERSION = 3
+
+_HEADER = struct.Struct('<8sHHd')
+_CHUNK_HEADER = struct.Struct('<4sIIdI')
+_STRING_LENGTH = struct.Struct('<H')
+_INDEX_HEADER = struct.Struct('<4sI')
+_INDEX_ENTRY = struct.Struct('<QdQ')
+_TRAILER = struct.Struct('<Q4s')
+
+
+def _pack_strings(strings):
+    encoded = [s.encode('utf-8') for s in strings]
+    return b''.join(_STRING_LENGTH.pack(len(s)) + s for s in encoded)
+
+
+def _unpack_strings(data, count, offset=0):
+    strings = []
+    for _ in range(count):
+        (length,) = _STRING_LENGTH.unpack_from(data, offset)
+        offset += _STRING_LENGTH.size
+        strings.append(data[offset:offset + length].decode('utf-8'))
+        offset += length
+    return strings, offset
+
+
+class ReplayWriter(object):
+    def __init__(self, path, lanes, road_length, frames_per_chunk=600):
+        self.lanes = lanes
+        self.frames_per_chunk = frames_per_chunk
+        self._file = open(path, 'wb')
+        self._file.write(_HEADER.pack(MAGIC, VERSION, lanes, road_length))
+        self._strings = {}
+        self._new_strings = []
+        self._frames = 0
+        self._index = []
+        self._reset_chunk()
+
+    def _reset_chunk(self):
+        self._times = []
+        self._counts = []
+        self._ids = []
+        self._labels = []
+        self._positions = []
+
+    def _string(self, value):
+        value = str(value)
+        index = self._strings.get(value)
+        if index is None:
+            index = len(self._strings)
+            self._strings[value] = index
+            self._new_strings.append(value)
+        return index
+
+    def add_frame(self, simulated_time, vehicle_data):
+        """
+        Records one frame, with vehicle_data being the (label, position, id)
+        tuples for the vehicles in each lane as built by Road.update
+        """
+        self._times.append(simulated_time)
+        for lane in vehicle_data:
+            self._counts.append(len(lane))
+            for label, position, _id in lane:
+                self._labels.append(self._string(label))
+                self._positions.append(position)
+                self._ids.append(_id)
+        if len(self._times) >= self.frames_per_chunk:
+            self._write_chunk()
+
+    def _write_chunk(self):
+        if not self._times:
+            return
+        payload = zlib.compress(b''.join((
+            _pack_strings(self._new_strings),
+            np.array(self._times, dtype='<f8').tobytes(),
+            np.array(self._counts, dtype='<u4').tobytes(),
+            np.array(self._ids, dtype='<u4').tobytes(),
+            np.array(self._labels, dtype='<u4').tobytes(),
+            np.array(self._positions, dtype='<f4').tobytes())))
+
+        self._index.append((self._file.tell(), self._times[0], self._frames))
+        self._file.write(_CHUNK_HEADER.pack(b'CHNK', len(payload),
+                                            len(self._times), self._times[0],
+                                            len(self._new_strings)))
+        self._file.write(payload)
+        self._frames += len(self._times)
+        self._new_strings = []
+        self._reset_chunk()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._write_chunk()
+        index_offset = self._file.tell()
+        self._file.write(_INDEX_HEADER.pack(b'INDX', len(self._index)))
+        for offset, start_time, first_frame in self._index:
+            self._file.write(_INDEX_ENTRY.pack(offset, start_time,
+                                               first_frame))
+        strings = zlib.compress(_pack_strings(list(self._strings)))
+        self._file.write(struct.pack('<II', len(self._strings), len(strings)))
+        self._file.write(strings)
+        self._file.write(_TRAILER.pack(index_offset, b'END!'))
+        self._file.close()
+
+
+class ReplayReader(object):
+    """
+    Streams frames back out of a replay file. Frames are returned in the same
+    form that Road.update passes to the display: a list per lane of
+    (label, position, id) tuples.
+    """
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        magic, version, self.lanes, self.road_length = _HEADER.unpack(
+            self._file.read(_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError('{} is not a replay file'.format(path))
+        if version != VERSION:
+            raise ValueError('Unsupported replay version: {}'.format(version))
+        self._strings = []
+        self._loaded_strings = 0
+        self.chunk_offsets = []
+        self.chunk_times = []
+        self.chunk_frames = []
+        self._chunk = None
+        self._chunk_data = None
+        self._read_index()
+
+    def _read_index(self):
+        self._file.seek(0, 2)
+        size = self._file.tell()
+        if size >= _HEADER.size + _TRAILER.size:
+            self._file.seek(size - _TRAILER.size)
+            index_offset, end = _TRAILER.unpack(
+                self._file.read(_TRAILER.size))
+            if end == b'END!':
+                self._file.seek(index_offset)
+                _, count = _INDEX_HEADER.unpack(
+                    self._file.read(_INDEX_HEADER.size))
+                for _ in range(count):
+                    offset, start_time, first_frame = _INDEX_ENTRY.unpack(
+                        self._file.read(_INDEX_ENTRY.size))
+                    self.chunk_offsets.append(offset)
+                    self.chunk_times.append(start_time)
+                    self.chunk_frames.append(first_frame)
+                num_strings, length = struct.unpack('<II',
+                                                    self._file.read(8))
+                self._strings, _ = _unpack_strings(
+                    zlib.decompress(self._file.read(length)), num_strings)
+                self._loaded_strings = count
+                self.num_frames = self._count_frames()
+                return
+
+        # No index, the run most likely did not finish, so find the chunks
+        # by walking through the file
+        offset = _HEADER.size
+        frames = 0
+        while offset + _CHUNK_HEADER.size <= size:
+            self._file.seek(offset)
+            tag, length, num_frames, start_time, _ = _CHUNK_HEADER.unpack(
+                self._file.read(_CHUNK_HEADER.size))
+            if tag != b'CHNK' or offset + _CHUNK_HEADER.size + length > size:
+                break
+            self.chunk_offsets.append(offset)
+            self.chunk_times.append(start_time)
+            self.chunk_frames.append(frames)
+            frames += num_frames
+            offset += _CHUNK_HEADER.size + length
+        self.num_frames = frames
+
+    def _count_frames(self):
+        if not self.chunk_offsets:
+            return 0
+        self._file.seek(self.chunk_offsets[-1])
+        _, _, num_frames, _, _ = _CHUNK_HEADER.unpack(
+            self._file.read(_CHUNK_HEADER.size))
+        return self.chunk_frames[-1] + num_frames
+
+    def __len__(self):
+        return self.num_frames
+
+    def _load_strings_until(self, chunk):
+        # Without an index the string table is built from the chunks in
+        # order, so make sure every chunk before this one has contributed
+        # its strings
+        while self._loaded_strings < chunk:
+            self._read_chunk(self._loaded_strings)
+
+    def _read_chunk(self, chunk):
+        self._file.seek(self.chunk_offsets[chunk])
+        _, length, num_frames, _, num_strings = _CHUNK_HEADER.unpack(
+            self._file.read(_CHUNK_HEADER.size))
+        payload = zlib.decompress(self._file.read(length))
+
+        strings, offset = _unpack_strings(payload, num_strings)
+        if chunk == self._loaded_strings:
+            self._strings.extend(strings)
+            self._loaded_strings += 1
+
+        times = np.frombuffer(payload, '<f8', num_frames, offset)
+        offset += times.nbytes
+        counts = np.frombuffer(payload, '<u4', num_frames * self.lanes,
+                               offset)
+        offset += counts.nbytes
+        total = int(counts.sum())
+        ids = np.frombuffer(payload, '<u4', total, offset)
+        offset += ids.nbytes
+        labels = np.frombuffer(payload, '<u4', total, offset)
+        offset += labels.nbytes
+        positions = np.frombuffer(payload, '<f4', total, offset)
+        return (times, counts.reshape(num_frames, self.lanes), ids, labels,
+                positions)
+
+    def read_chunk(self, chunk):
+        """
+        Returns the raw columns for a chunk: frame times, vehicles per lane
+        for each frame, then the ID, label and position arrays. Labels index
+        into the string table, see get_string.
+        """
+        self._load_strings_until(chunk)
+        return self._read_chunk(chunk)
+
+    def get_string(self, index):
+        return self._strings[index]
+
+    def find_chunk(self, simulated_time):
+        return max(0, bisect.bisect_right(self.chunk_times,
+                                          simulated_time) - 1)
+
+    def _load_chunk(self, chunk):
+        if self._chunk != chunk:
+            times, counts, ids, labels, positions = self.read_chunk(chunk)
+            # Where each lane of each frame starts in the vehicle arrays
+            starts = np.zeros(counts.size + 1, dtype=int)
+            np.cumsum(counts.ravel(), out=starts[1:])
+            self._chunk_data = (times, starts.tolist(), ids, labels,
+                                positions)
+            self._chunk = chunk
+        return self._chunk_data
+
+    def find_frame(self, simulated_time):
+        """
+        Returns the number of the first frame at or after simulated_time, or
+        the last frame if the run ends before then
+        """
+        chunk = self.find_chunk(simulated_time)
+        times = self._load_chunk(chunk)[0]
+        frame = self.chunk_frames[chunk] + int(
+            np.searchsorted(times, simulated_time))
+        return min(frame, self.num_frames - 1)
+
+    def get_frame(self, frame):
+        """
+        Returns (simulated_time, vehicle_data) for a single frame, only
+        decompressing the chunk it is in if that is not already loaded
+        """
+        if not 0 <= frame < self.num_frames:
+            raise IndexError('Frame {} is out of range'.format(frame))
+        chunk = bisect.bisect_right(self.chunk_frames, frame) - 1
+        times, starts, ids, labels, positions = self._load_chunk(chunk)
+        frame -= self.chunk_frames[chunk]
+        strings = self._strings
+        vehicle_data = []
+        for lane in range(self.lanes):
+            start = starts[(frame * self.lanes) + lane]
+            end = starts[(frame * self.lanes) + lane + 1]
+            vehicle_data.append(list(zip(
+                [strings[i] for i in labels[start:end].tolist()],
+                positions[start:end].tolist(),
+                ids[start:end].tolist())))
+        return float(times[frame]), vehicle_data
+
+    def frames(self, start_time=None):
+        """
+        Generator of (simulated_time, vehicle_data) for every frame, starting
+        from the first frame at or after start_time if given
+        """
+        first_chunk = 0
+        if start_time is not None and self.chunk_offsets:
+            first_chunk = self.find_chunk(start_time)
+        for chunk in range(first_chunk, len(self.chunk_offsets)):
+            times, counts, ids, labels, positions = self.read_chunk(chunk)
+            ids = ids.tolist()
+            labels = labels.tolist()
+            positions = positions.tolist()
+            strings = self._strings
+            i = 0
+            for frame, simulated_time in enumerate(times.tolist()):
+                vehicle_data = []
+                for count in counts[frame].tolist():
+                    vehicle_data.append([(strings[labels[j]], positions[j],
+                                          ids[j])
+                                         for j in range(i, i + count)])
+                    i += count
+                if start_time is not None and simulated_time < start_time:
+                    continue
+                yield simulated_time, vehicle_data
+
+    def close(self):
+        self._file.close()
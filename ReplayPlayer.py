@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import argparse
+import time
+
+import Display
+from Display import pygame
+from Replay import ReplayReader
+
+# Simulated seconds to jump by when seeking with the arrow keys
+SEEK_STEP = 60
+
+# Maximum number of frames to render per second of wall time
+MAX_FPS = 60
+
+
+def play(reader, display, speed, start_time):
+    """
+    Plays a recorded run through the display. Playback follows the wall clock
+    at the given speed (simulated seconds per real second), skipping over any
+    frames the display cannot render in time to keep up.
+
+    Controls: space to pause, left/right arrows to seek, up/down arrows to
+    double or halve the playback speed, escape to quit. On long roads the
+    mouse wheel zooms in and out, and dragging scrolls along the road.
+    """
+    first_time = reader.get_frame(0)[0]
+    end_time = reader.get_frame(len(reader) - 1)[0]
+    clock = pygame.time.Clock()
+
+    frame = reader.find_frame(start_time)
+    playback_start = reader.get_frame(frame)[0]
+    wall_start = time.time()
+    paused = False
+    last_frame = None
+
+    while True:
+        seek_to = None
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    return
+                elif event.key == pygame.K_SPACE:
+                    paused = not paused
+                    seek_to = reader.get_frame(frame)[0]
+                elif event.key == pygame.K_RIGHT:
+                    seek_to = reader.get_frame(frame)[0] + SEEK_STEP
+                elif event.key == pygame.K_LEFT:
+                    seek_to = reader.get_frame(frame)[0] - SEEK_STEP
+                elif event.key == pygame.K_UP:
+                    speed *= 2
+                    seek_to = reader.get_frame(frame)[0]
+                elif event.key == pygame.K_DOWN:
+                    speed /= 2
+                    seek_to = reader.get_frame(frame)[0]
+            elif display.handle_event(event):
+                # Redraw the current frame for the new view
+                last_frame = None
+
+        if seek_to is not None:
+            seek_to = min(max(seek_to, first_time), end_time)
+            frame = reader.find_frame(seek_to)
+            playback_start = seek_to
+            wall_start = time.time()
+        elif not paused:
+            target_time = playback_start + ((time.time() - wall_start) * speed)
+            if target_time > end_time:
+                return
+            frame = reader.find_frame(target_time)
+
+        if frame != last_frame:
+            simulated_time, vehicle_data = reader.get_frame(frame)
+            display.simulated_time = simulated_time
+            display.remaining_time = end_time - simulated_time
+            display.paint(vehicle_data)
+            last_frame = frame
+
+        clock.tick(MAX_FPS)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Play back a recorded simulation run')
+    parser.add_argument('replay', help='Replay file to play, from replays/')
+    parser.add_argument('--speed', type=float, default=1,
+                        help='Simulated seconds to play per second')
+    parser.add_argument('--start', type=float, default=0,
+                        help='Simulated time to start playing from (s)')
+    args = parser.parse_args()
+
+    replay = ReplayReader(args.replay)
+    if not len(replay):
+        print('Replay {} has no frames to play'.format(args.replay))
+    else:
+        print('Playing {} frames from {}'.format(len(replay), args.replay))
+        display = Display.Display(1600, 900, replay.road_length,
+                                  replay.lanes // 2)
+        start = time.time()
+        play(replay, display, args.speed, args.start)
+        print('Replay finished after {} seconds.'.format(
+            int(time.time() - start)))
+        display.cleanup()
+    replay.close()
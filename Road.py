@@ -1,19 +1,16 @@
+import bisect
+import numpy as np
 import os
 import random
 
-import Consts
 from Detectors import PointDetector, SpaceDetector, RoadDetector
+from LaneState import LaneState
+from Replay import ReplayWriter
+from Trajectory import TrajectoryRecorder
+from Utils import VehicleUUIDs
 import Vehicle
 
 
-def flatten(s):
-    if s == []:
-        return s
-    if isinstance(s[0], list):
-        return flatten(s[0]) + flatten(s[1:])
-    return s[:1] + flatten(s[1:])
-
-
 class SafetimeHeadwayZone(object):
     def __init__(self, start, end, time):
         self.start = start
@@ -28,42 +25,148 @@ class SpeedLimitedZone(object):
         self.speed = speed
 
 
+class ZoneIndex(object):
+    """
+    Sorted breakpoints of the zones in a lane, so the zone containing a
+    position can be found with a bisect rather than by checking every zone.
+    Each interval between breakpoints maps to the first zone in the list that
+    covers it, which is the same zone a linear scan would find.
+    """
+    def __init__(self, zones, attribute):
+        self.breakpoints = sorted(set([zone.start for zone in zones] +
+                                      [zone.end for zone in zones]))
+        self.zones = []
+        for start, end in zip(self.breakpoints, self.breakpoints[1:]):
+            self.zones.append(next((zone for zone in zones
+                                    if zone.start <= start and
+                                    end <= zone.end), None))
+
+        # Arrays for looking up many positions at once, with a final entry
+        # of NaN to use for positions not in any zone
+        self._breakpoints = np.array(self.breakpoints, dtype=float)
+        self._starts = np.array([zone.start if zone else np.nan
+                                 for zone in self.zones] + [np.nan])
+        self._ends = np.array([zone.end if zone else np.nan
+                               for zone in self.zones] + [np.nan])
+        self._values = np.array([getattr(zone, attribute) if zone else np.nan
+                                 for zone in self.zones] + [np.nan],
+                                dtype=float)
+
+    def find(self, position):
+        i = bisect.bisect_right(self.breakpoints, position) - 1
+        if 0 <= i < len(self.zones):
+            return self.zones[i]
+        return None
+
+    def find_all(self, positions):
+        """
+        Returns arrays of the start, end and value of the zone for each
+        position, which are NaN for positions not in any zone
+        """
+        i = np.searchsorted(self._breakpoints, positions, side='right') - 1
+        i[(i < 0) | (i >= len(self.zones))] = len(self.zones)
+        return self._starts[i], self._ends[i], self._values[i]
+
+
+class PointDetectorIndex(object):
+    """
+    The point detectors in a lane sorted by position, so the detectors each
+    vehicle passed in a step can be found with a bisect on its previous and
+    new positions, rather than every detector checking every vehicle.
+    """
+    def __init__(self, detectors):
+        self.detectors = sorted(detectors,
+                                key=lambda detector: detector.position)
+        self.positions = [detector.position for detector in self.detectors]
+
+    def find_passed(self, vehicles):
+        """
+        Returns a list for each detector of the vehicles that passed it, i.e.
+        moved from before it to at or after it. vehicles must be in lane
+        order, from the front of the lane to the back.
+        """
+        passed = [[] for _ in self.detectors]
+        if not self.detectors:
+            return passed
+        positions = self.positions
+        first = positions[0]
+        for vehicle in vehicles:
+            position = vehicle.position
+            if position < first:
+                # This and every vehicle behind it is before every detector
+                break
+            for i in range(bisect.bisect_right(positions,
+                                               vehicle.prev_position),
+                           bisect.bisect_right(positions, position)):
+                passed[i].append(vehicle)
+        return passed
+
+
 class Road(object):
-    def __init__(self, seed, length, lanes, safetime_headway):
-        self.length = length
-        self.lanes = lanes
-        self.safetime_headway = safetime_headway
+    def __init__(self, config):
+        seed = config.simulation_seed
+        self.config = config
+        self.length = config.road_length
+        self.lanes = config.bridge_lanes
+        self.safetime_headway = config.safetime_headway
+        self.multi_lane = config.multi_lane
         self.vehicles = []
         self.headway_zones = []
         self.speed_restricted_zones = []
         self.point_detectors = []
         self.space_detectors = []
         self.lane_queues = []
+        self._headway_index = []
+        self._speed_limit_index = []
+        self._point_detector_index = []
+        # Number of vehicles at the front of each lane that already have their
+        # new parameters for the next update
+        self._calculated = [0] * (self.lanes * 2)
         for i in range(self.lanes * 2):
+            self._headway_index.append(ZoneIndex([], 'time'))
+            self._speed_limit_index.append(ZoneIndex([], 'speed'))
+            self._point_detector_index.append(PointDetectorIndex([]))
             self.headway_zones.append([])
             self.vehicles.append([])
             self.speed_restricted_zones.append([])
             self.point_detectors.append([])
             self.space_detectors.append([])
             self.lane_queues.append([])
+        self.lane_states = None
+        if config.vectorised_model:
+            self.lane_states = [LaneState(self, i)
+                                for i in range(self.lanes * 2)]
         self._random = random.Random(seed)
         self._calls = 0
         self._cars = 0
         self._trucks = 0
-        if Consts.DEBUG_MODE:
+        if config.debug_mode:
             os.makedirs('debug/road', exist_ok=True)
             self._lane_files = [open('debug/road/lane_{}.txt'.format(lane),
                                      'w') for lane in range(self.lanes * 2)]
         os.makedirs('replays', exist_ok=True)
-        self._replay_file = open('replays/replay-{}.sim'.format(seed), 'w')
-        self.road_detector = RoadDetector(Consts.ROAD_DETECTOR_INTERVAL)
+        self._replay = ReplayWriter(
+            'replays/replay-{}.rpl'.format(config.run_file_name),
+            self.lanes * 2, self.length)
+        self._trajectories = None
+        if config.record_trajectories or config.debug_mode:
+            os.makedirs('trajectories', exist_ok=True)
+            self._trajectories = TrajectoryRecorder(
+                'trajectories/trajectories-{}.trj'.format(
+                    config.run_file_name))
+        # Only needed when detectors write out UUIDs rather than vehicle IDs
+        self.uuids = None
+        if config.export_uuids:
+            self.uuids = VehicleUUIDs(seed)
+        self.road_detector = RoadDetector(config,
+                                          config.road_detector_interval)
 
     # New vehicles #
 
     def add_vehicle(self, vehicle, force_lane=None):
         self._calls += 1
         if type(vehicle) is list:
-            if not Consts.MULTI_LANE:
+            if not self.multi_lane:
                 lane = 0
             else:
                 if force_lane:
@@ -78,7 +181,7 @@ class Road(object):
                     self._add_vehicle(vehicle.pop(0), lead_vehicle, lane)
                     self.lane_queues[lane] = vehicle
                     return True, lane, len(vehicle)
-                elif Consts.MULTI_LANE and not force_lane:
+                elif self.multi_lane and not force_lane:
                     # Could not add to this lane, so go through all lanes and
                     # find the first place we can add this new vehicle to
                     for lane, _ in enumerate(self.vehicles):
@@ -91,7 +194,7 @@ class Road(object):
                 else:
                     return False, lane, len(vehicle)
         else:
-            if not Consts.MULTI_LANE:
+            if not self.multi_lane:
                 lane = 0
             else:
                 if force_lane:
@@ -102,7 +205,7 @@ class Road(object):
             if self._can_add_to_lane(lane, lead_vehicle, vehicle):
                 self._add_vehicle(vehicle, lead_vehicle, lane)
                 return True, lane, 1
-            elif Consts.MULTI_LANE and not force_lane:
+            elif self.multi_lane and not force_lane:
                 # Could not add to this lane, so go through all lanes and find
                 # the first place we can add this new vehicle to
                 for lane, _ in enumerate(self.vehicles):
@@ -115,12 +218,30 @@ class Road(object):
             else:
                 return False, lane, 1
 
+    def add_vehicle_to_lane(self, vehicle, lane):
+        """
+        Adds a vehicle, or a platoon as a list of trucks, to the given lane
+        only. Returns whether it was added and the number of vehicles, as
+        add_vehicle does
+        """
+        self._calls += 1
+        first = vehicle[0] if type(vehicle) is list else vehicle
+        lead_vehicle = self.vehicles[lane][-1] if self.vehicles[lane] else None
+        if not self._can_add_to_lane(lane, lead_vehicle, first):
+            return False, len(vehicle) if type(vehicle) is list else 1
+        if type(vehicle) is list:
+            self._add_vehicle(vehicle.pop(0), lead_vehicle, lane)
+            self.lane_queues[lane] = vehicle
+            return True, len(vehicle)
+        self._add_vehicle(vehicle, lead_vehicle, lane)
+        return True, 1
+
     def _can_add_to_lane(self, lane, lead_vehicle, vehicle):
         if self.lane_queues[lane]:
             return False
         if lead_vehicle:
             current_gap = lead_vehicle.position - lead_vehicle.length
-            if current_gap >= Consts.MINIMUM_INJECTION_GAP:
+            if current_gap >= self.config.minimum_injection_gap:
                 return True
             else:
                 return False
@@ -131,21 +252,25 @@ class Road(object):
         vehicle.set_lane(lane)
         vehicle.add_to_road(self, lead_vehicle)
         self.vehicles[lane].append(vehicle)
+        if self.lane_states:
+            self.lane_states[lane].append(vehicle)
         if type(vehicle) == Vehicle.Car:
             self._cars += 1
         else:
             self._trucks += 1
-        if Consts.DEBUG_MODE:
+        if self.config.debug_mode:
             self._lane_files[lane].write('{}\n'.format(vehicle._id))
 
     def _add_platooned_truck(self, vehicle, lead_vehicle, lane):
         self._add_vehicle(vehicle, lead_vehicle, lane)
         vehicle.position = vehicle.lead_vehicle.position - vehicle.lead_vehicle.length - vehicle.follow_distance
+        if self.lane_states:
+            self.lane_states[lane].load_last(vehicle)
 
     # Safetime Headway Zones #
 
     def add_safetime_headway_zone_all_lanes(self, start, end, time):
-        r = self.lanes * 2 if Consts.MULTI_LANE else 1
+        r = self.lanes * 2 if self.multi_lane else 1
         for i in range(r):
             lane = i if i < self.lanes else (i * -1) + (self.lanes - 1)
             if lane < 0:
@@ -155,7 +280,7 @@ class Road(object):
                 self.add_safetime_headway_zone(start, end, time, lane)
 
     def add_safetime_headway_zone(self, start, end, time, lane):
-        if not Consts.MULTI_LANE and lane > 0:
+        if not self.multi_lane and lane > 0:
             print('Single lane traffic only, ignoring safetime headway for '
                   'lane {}'.format(lane))
             return
@@ -171,21 +296,28 @@ class Road(object):
         else:
             self.headway_zones[lane].append(SafetimeHeadwayZone(start, end,
                                                                 time))
+        self._headway_index[lane] = ZoneIndex(self.headway_zones[lane], 'time')
 
     def get_safetime_headway(self, lane, position):
-        if self.headway_zones[lane]:
-            for zone in self.headway_zones[lane]:
-                if zone.end > position >= zone.start:
-                    p = ((position - zone.start) / (zone.end - zone.start))
-                    return zone.time * p
-            return self.safetime_headway
+        zone = self._headway_index[lane].find(position)
+        if zone:
+            p = ((position - zone.start) / (zone.end - zone.start))
+            return zone.time * p
         else:
             return self.safetime_headway
 
+    def get_safetime_headways(self, lane, positions):
+        if not self.headway_zones[lane]:
+            return np.full(len(positions), self.safetime_headway, dtype=float)
+        starts, ends, times = self._headway_index[lane].find_all(positions)
+        with np.errstate(invalid='ignore'):
+            p = ((positions - starts) / (ends - starts))
+        return np.where(np.isnan(times), self.safetime_headway, times * p)
+
     # Speed Limited Zones #
 
     def add_speed_limited_zone_all_lanes(self, start, end, speed_limit):
-        r = self.lanes * 2 if Consts.MULTI_LANE else 1
+        r = self.lanes * 2 if self.multi_lane else 1
         for i in range(r):
             lane = i if i < self.lanes else (i * -1) + (self.lanes - 1)
             if lane < 0:
@@ -196,7 +328,7 @@ class Road(object):
                 self.add_speed_limited_zone(start, end, speed_limit, lane)
 
     def add_speed_limited_zone(self, start, end, speed_limit, lane):
-        if not Consts.MULTI_LANE and lane > 0:
+        if not self.multi_lane and lane > 0:
             print('Single lane traffic only, ignoring speed limit for '
                   'lane {}'.format(lane))
             return
@@ -212,20 +344,24 @@ class Road(object):
         else:
             self.speed_restricted_zones[lane].append(
                 SpeedLimitedZone(start, end, speed_limit))
+        self._speed_limit_index[lane] = ZoneIndex(
+            self.speed_restricted_zones[lane], 'speed')
 
     def get_speed_limit(self, lane, position):
-        if self.speed_restricted_zones[lane]:
-            for zone in self.speed_restricted_zones[lane]:
-                if zone.end > position >= zone.start:
-                    return zone.speed
-            return None
-        else:
+        zone = self._speed_limit_index[lane].find(position)
+        return zone.speed if zone else None
+
+    def get_speed_limits(self, lane, positions):
+        if not self.speed_restricted_zones[lane]:
             return None
+        _, _, speed_limits = self._speed_limit_index[lane].find_all(positions)
+        speed_limits[speed_limits == 0] = np.nan
+        return speed_limits
 
     # Point Detectors #
 
     def add_point_detector_all_lanes(self, position, time_interval):
-        r = self.lanes * 2 if Consts.MULTI_LANE else 1
+        r = self.lanes * 2 if self.multi_lane else 1
         for i in range(r):
             lane = i if i < self.lanes else (i * -1) + (self.lanes - 1)
             if lane < 0:
@@ -235,7 +371,7 @@ class Road(object):
                 self.add_point_detector(lane, position, time_interval)
 
     def add_point_detector(self, lane, position, time_interval):
-        if not Consts.MULTI_LANE and lane > 0:
+        if not self.multi_lane and lane > 0:
             print('Single lane traffic only, ignoring point detector for '
                   'lane {}'.format(lane))
             return
@@ -246,16 +382,20 @@ class Road(object):
                     can_add_detector = False
                     break
             if can_add_detector:
-                self.point_detectors[lane].append(PointDetector(lane, position,
-                                                                time_interval))
+                self.point_detectors[lane].append(
+                    PointDetector(self.config, lane, position, time_interval,
+                                  self.uuids))
         else:
-            self.point_detectors[lane].append(PointDetector(lane, position,
-                                                            time_interval))
+            self.point_detectors[lane].append(
+                PointDetector(self.config, lane, position, time_interval,
+                              self.uuids))
+        self._point_detector_index[lane] = PointDetectorIndex(
+            self.point_detectors[lane])
 
     # Space Detectors #
 
     def add_space_detector_all_lanes(self, start, end, time_interval):
-        r = self.lanes * 2 if Consts.MULTI_LANE else 1
+        r = self.lanes * 2 if self.multi_lane else 1
         for i in range(r):
             lane = i if i < self.lanes else (i * -1) + (self.lanes - 1)
             if lane < 0:
@@ -265,7 +405,7 @@ class Road(object):
                 self.add_space_detector(lane, start, end, time_interval)
 
     def add_space_detector(self, lane, start, end, time_interval):
-        if not Consts.MULTI_LANE and lane > 0:
+        if not self.multi_lane and lane > 0:
             print('Single lane traffic only, ignoring space detector for '
                   'lane {}'.format(lane))
             return
@@ -277,10 +417,12 @@ class Road(object):
                     break
             if can_add_detector:
                 self.space_detectors[lane].append(
-                    SpaceDetector(lane, start, end, time_interval))
+                    SpaceDetector(self.config, lane, start, end,
+                                  time_interval, self.uuids))
         else:
             self.space_detectors[lane].append(
-                SpaceDetector(lane, start, end, time_interval))
+                SpaceDetector(self.config, lane, start, end,
+                              time_interval, self.uuids))
 
     # Configuration Settings
 
@@ -337,17 +479,29 @@ class Road(object):
 
     # Simulation update #
 
-    def update(self, time_step, simulated_time, queue):
-        vehicle_data = [[] for _ in range(self.lanes * 2)]
-        # Step 1: Parallel calculate new parameters for all vehicles
-        for lane in self.vehicles:
-            for vehicle in lane:
+    def update(self, time_step, simulated_time):
+        """
+        Moves the simulation on by a step, returning the label, position and
+        ID of each vehicle in each lane for the display
+        """
+        if self.lane_states:
+            return self._update_lane_states(time_step, simulated_time)
+
+        vehicle_data = []
+        # Step 1: Parallel calculate new parameters for all vehicles. Vehicles
+        # that were on the road at the end of the last update had theirs
+        # calculated along with their gap then, leaving only new arrivals
+        for i, lane in enumerate(self.vehicles):
+            for vehicle in lane[self._calculated[i]:]:
                 vehicle.calc_new_params()
 
         # Step 2: Parallel update new parameters for all vehicles
         for lane in self.vehicles:
             for vehicle in lane:
-                vehicle.update_new_params(simulated_time)
+                vehicle.update_new_params()
+        if self._trajectories:
+            for i, lane in enumerate(self.vehicles):
+                self._trajectories.add_lane(simulated_time, i, lane)
 
         # Step 3: Add next platoon truck for each platoon if possible:
         for i, _ in enumerate(self.lane_queues):
@@ -358,32 +512,31 @@ class Road(object):
                     self._add_platooned_truck(self.lane_queues[i].pop(0), lead,
                                               i)
 
-        # Step 4: Remove any vehicle at the end of the road
-        vehicles_to_remove = [[] for _ in range(self.lanes * 2)]
+        # Step 4: Remove any vehicle at the end of the road. Lanes are ordered
+        # from the front, so these are always at the start of the lane
+        for i, lane in enumerate(self.vehicles):
+            leaving = 0
+            while leaving < len(lane) and lane[leaving].position > self.length:
+                leaving += 1
+            if leaving:
+                del lane[:leaving]
+                # Every other vehicle keeps the same lead vehicle
+                if lane:
+                    lane[0].set_lead_vehicle(None)
+            vehicle_data.append([(vehicle._label, vehicle.position,
+                                  vehicle._id) for vehicle in lane])
+
+        # Step 5: Update gaps to the lead vehicles for all remaining vehicles
         for i, lane in enumerate(self.vehicles):
             for vehicle in lane:
-                if vehicle.position > self.length:
-                    vehicles_to_remove[i].append(vehicle)
-                else:
-                    vehicle_data[i].append((vehicle._label, vehicle.position,
-                                            vehicle._id))
-        for i, lane in enumerate(vehicles_to_remove):
-            for vehicle in lane:
-                vehicle.finalise()
-                self.vehicles[i].remove(vehicle)
-
-        # Step 5: Update lead vehicles for all remaining vehicles
-        for lane in self.vehicles:
-            for i, vehicle in enumerate(lane):
-                if i == 0:
-                    vehicle.set_lead_vehicle(None)
-                else:
-                    vehicle.set_lead_vehicle(lane[i - 1])
+                vehicle.update_gap()
+            self._calculated[i] = len(lane)
 
-        # Step 6: Update point detectors
-        for i, lane in enumerate(self.point_detectors):
-            for detector in lane:
-                detector.tick(time_step, simulated_time, self.vehicles[i])
+        # Step 6: Update point detectors with the vehicles that passed them
+        for i, index in enumerate(self._point_detector_index):
+            for detector, vehicles in zip(
+                    index.detectors, index.find_passed(self.vehicles[i])):
+                detector.tick(time_step, simulated_time, vehicles)
 
         # Step 7: Update space detectors
         for i, lane in enumerate(self.space_detectors):
@@ -391,14 +544,94 @@ class Road(object):
                 detector.tick(time_step, simulated_time, self.vehicles[i])
 
         # Step 8: Update road detector
-        self.road_detector.tick(time_step, simulated_time,
-                                flatten(self.vehicles))
+        self.road_detector.tick(time_step, simulated_time, self.vehicles)
+
+        self._replay.add_frame(simulated_time, vehicle_data)
+        return vehicle_data
+
+    def _update_lane_states(self, time_step, simulated_time):
+        """
+        The same steps as update, for a road keeping the state of each lane
+        in a LaneState. Vehicle objects are only brought up to date for the
+        detectors, trajectories and new vehicles that read them.
+        """
+        states = self.lane_states
+
+        # Steps 1 and 2: Calculate and update new parameters for every lane
+        for state in states:
+            state.calc_new_params()
+            state.update_new_params()
+        if self._trajectories:
+            for i, lane in enumerate(self.vehicles):
+                states[i].sync_all(lane)
+                self._trajectories.add_lane(simulated_time, i, lane)
+
+        # Step 3: Add next platoon truck for each platoon if possible
+        for i, queue in enumerate(self.lane_queues):
+            if queue:
+                lead = self.vehicles[i][-1]
+                assert(lead is not None and type(lead) is Vehicle.PlatoonedTruck)
+                states[i].sync_last(self.vehicles[i])
+                if lead.position - lead.length >= queue[0].follow_distance:
+                    self._add_platooned_truck(queue.pop(0), lead, i)
+
+        # Step 4: Remove any vehicle at the end of the road
+        vehicle_data = []
+        for i, lane in enumerate(self.vehicles):
+            leaving = states[i].count_leaving(self.length)
+            if leaving:
+                states[i].sync(lane, range(leaving))
+                del lane[:leaving]
+                states[i].drop_front(leaving)
+                if lane:
+                    lane[0].set_lead_vehicle(None)
+            vehicle_data.append(states[i].frame())
+
+        # Step 5: Update gaps to the lead vehicles for all remaining vehicles
+        for state in states:
+            state.update_gaps()
+
+        # Step 6: Update point detectors with the vehicles that passed them
+        for i, index in enumerate(self._point_detector_index):
+            lane = self.vehicles[i]
+            for detector in index.detectors:
+                passed = states[i].passed(detector.position)
+                states[i].sync(lane, passed)
+                detector.tick(time_step, simulated_time,
+                              [lane[j] for j in passed])
+
+        # Step 7: Update space detectors with the vehicles in their zone,
+        # along with any that just left it
+        for i, detectors in enumerate(self.space_detectors):
+            lane = self.vehicles[i]
+            for detector in detectors:
+                start = states[i].count_at_or_after(detector.end)
+                end = states[i].count_at_or_after(detector.start)
+                states[i].sync(lane, states[i].passed(detector.end))
+                states[i].sync(lane, range(start, end))
+                detector.tick(time_step, simulated_time, lane[start:end])
+
+        # Step 8: Update road detector, which only reads the vehicles on the
+        # steps it records on
+        if self.road_detector.records_macro(time_step):
+            for i, lane in enumerate(self.vehicles):
+                states[i].sync_all(lane)
+        self.road_detector.tick(time_step, simulated_time, self.vehicles)
+
+        # New vehicles join the back of each lane, behind the last vehicle
+        for i, lane in enumerate(self.vehicles):
+            states[i].sync_last(lane)
 
-        if queue:
-            queue.put(vehicle_data)
+        self._replay.add_frame(simulated_time, vehicle_data)
+        return vehicle_data
 
-        self._replay_file.write('Simulation Step: {}\n'.format(simulated_time))
-        self._replay_file.write('{}\n'.format(vehicle_data))
+    def finalise(self):
+        self._replay.close()
+        if self._trajectories:
+            self._trajectories.close()
+        if self.config.debug_mode:
+            for _file in self._lane_files:
+                _file.close()
 
     def write_detector_output(self):
         for lane in self.point_detectors:
@@ -408,12 +641,3 @@ class Road(object):
             for detector in lane:
                 detector.write_results()
         self.road_detector.write_results()
-
-    def plot_detector_output(self):
-        for lane in self.point_detectors:
-            for detector in lane:
-                detector.plot()
-        for lane in self.space_detectors:
-            for detector in lane:
-                detector.plot()
-        self.road_detector.plot()
@@ -40,9 +40,9 @@ Motivation needed to complete this project, go Charmander!
 '''
 
 import csv
-from decimal import *
+from decimal import Decimal
 import json
-from multiprocessing import Process, Queue, Pipe
+from multiprocessing import Pool, Process
 import os
 import shutil
 import simpy
@@ -51,34 +51,36 @@ import time
 
 import Road
 import Consts
-import Display
+import Demand
+from DisplayChannel import DisplayChannel
+import Plotting
 import VehicleGarage
 
+# Display and FrameExport (and with them pygame) are imported where they are
+# used, so headless runs do not pay for importing them
+
 
 class Simulation(object):
-    def __init__(self, env, finish_event, queue, conn, configuration):
+    def __init__(self, env, finish_event, channel, config, configuration):
         self.env = env
         self.finish_event = finish_event
-        self.queue = queue
-        self.conn = conn
+        self.channel = channel
         self.simulated_time = 0
-        self.action = env.process(self.update(Consts.SIMULATION_FREQUENCY,
-                                              Consts.TIME_STEP))
-        self.road = Road.Road(Consts.SIMULATION_SEED,
-                              Consts.ROAD_LENGTH,
-                              Consts.BRIDGE_LANES,
-                              Consts.SAFETIME_HEADWAY)
-        if configuration:
-            self.road.configure(configuration)
 
-        if Consts.PLATOON_ADJUSTMENT:
+        if config.platoon_adjustment:
             print('Adjusting car and truck percentage to account for platoons')
-            print('Config car percentage : {} | Config truck percentage: {}'.format(Consts.CAR_PCT, Consts.TRUCK_PCT))
-            avg_platoon_length = (Consts.MAX_PLATOON_LENGTH + Consts.MIN_PLATOON_LENGTH) / 2
-            car_pct, truck_pct = Simulation.adjust_truck_percentage(Consts.TRUCK_PCT, Consts.TRUCK_PCT, Consts.PLATOON_CHANCE, avg_platoon_length)
-            Consts.CAR_PCT = car_pct
-            Consts.TRUCK_PCT = truck_pct
+            print('Config car percentage : {} | Config truck percentage: {}'.format(config.car_pct, config.truck_pct))
+            avg_platoon_length = (config.max_platoon_length + config.min_platoon_length) / 2
+            car_pct, truck_pct = Simulation.adjust_truck_percentage(config.truck_pct, config.truck_pct, config.platoon_chance, avg_platoon_length)
+            config = config.replace(car_pct=car_pct, truck_pct=truck_pct)
             print('Adjusted car percentage : {} | Adjusted truck percentage: {}'.format(car_pct, truck_pct))
+        self.config = config
+
+        self.action = env.process(self.update(config.simulation_frequency,
+                                              config.time_step))
+        self.road = Road.Road(config)
+        if configuration:
+            self.road.configure(configuration)
 
         # self.road.add_safetime_headway_zone_all_lanes(245, 255, 10)
         # self.road.add_speed_limited_zone_all_lanes(250, 450, 10)
@@ -87,41 +89,72 @@ class Simulation(object):
         # self.road.add_space_detector_all_lanes(100, 200, 10)
         # self.road.add_space_detector_all_lanes(250, 450, 5)
 
-        self.garage = VehicleGarage.Garage(Consts.SIMULATION_SEED,
-                                           Consts.SIMULATION_SHORT_SEED,
-                                           Consts.CAR_PCT, Consts.TRUCK_PCT,
-                                           Consts.CAR_LENGTH,
-                                           Consts.TRUCK_LENGTH,
-                                           Consts.PLATOON_CHANCE,
-                                           Consts.MIN_PLATOON_LENGTH,
-                                           Consts.MAX_PLATOON_LENGTH,
-                                           Consts.MIN_PLATOON_GAP,
-                                           Consts.MAX_PLATOON_GAP)
-        self.garage.configure_car_velocities(Consts.CAR_SPEED,
-                                             Consts.CAR_SPEED_VARIANCE,
-                                             Consts.CAR_SPEED_DISTRIBUTION)
-        self.garage.configure_car_gaps(Consts.CAR_MINIMUM_GAP,
-                                       Consts.CAR_GAP_VARIANCE,
-                                       Consts.CAR_GAP_DISTRIBUTION)
-        self.garage.configure_truck_velocities(Consts.TRUCK_SPEED,
-                                               Consts.TRUCK_SPEED_VARIANCE,
-                                               Consts.TRUCK_SPEED_DISTRIBUTION)
-        self.garage.configure_truck_gaps(Consts.TRUCK_MINIMUM_GAP,
-                                         Consts.TRUCK_GAP_VARIANCE,
-                                         Consts.TRUCK_GAP_DISTRIBUTION)
-        self.garage.configure_truck_weights(Consts.TRUCK_UNLOADED_WEIGHT,
-                                            Consts.TRUCK_LOADED_WEIGHT,
-                                            Consts.TRUCK_UNLOADED_WEIGHT_VARIANCE,
-                                            Consts.TRUCK_LOADED_WEIGHT_VARIANCE)
-        self._vehicle_timer = Decimal((60 * 60) / Consts.INFLOW_RATE)
-        self._vehicle_count = Decimal(0)
-        self._next_vehicle_in = Decimal(0)
+        self.garage = VehicleGarage.Garage(config)
+        self.garage.configure_car_velocities(config.car_speed,
+                                             config.car_speed_variance,
+                                             config.car_speed_distribution)
+        self.garage.configure_car_gaps(config.car_minimum_gap,
+                                       config.car_gap_variance,
+                                       config.car_gap_distribution)
+        self.garage.configure_truck_velocities(config.truck_speed,
+                                               config.truck_speed_variance,
+                                               config.truck_speed_distribution)
+        self.garage.configure_truck_gaps(config.truck_minimum_gap,
+                                         config.truck_gap_variance,
+                                         config.truck_gap_distribution)
+        self.garage.configure_truck_weights(config.truck_unloaded_weight,
+                                            config.truck_loaded_weight,
+                                            config.truck_unloaded_weight_variance,
+                                            config.truck_loaded_weight_variance)
+
+        # A demand section gives each lane its own arrivals, otherwise
+        # vehicles arrive at the inflow rate and the road picks their lane
+        demand = configuration.get('demand') if configuration else None
+        self._arrivals = None
+        self._lane_arrivals = []
+        if demand:
+            self._lane_arrivals = Demand.make_lane_demands(config, demand)
+            self._lane_queued_vehicles = {lane: None for lane, _ in
+                                          self._lane_arrivals}
+        else:
+            self._arrivals = Demand.make_demand(config)
+        self.frames = None
+        if config.frame_export_interval:
+            path = 'frames/frames-{}'.format(config.run_file_name)
+            if config.frame_export_format == 'raw':
+                path += '.frm'
+            from FrameExport import FrameExporter
+            self.frames = FrameExporter(path, config.road_length,
+                                        config.bridge_lanes,
+                                        config.frame_export_format)
+            self._frame_ticks = max(1, int(round(
+                config.frame_export_interval / config.time_step)))
+        self._tick = 0
+        self._vehicle_count = 0
         self._vehicle_failures = 0
-        self._vehicles_per_hour = 0
-        self.last_freq = 0
         self.last_t = 0
         self.queued_vehicles = []
 
+    def _add_lane_arrivals(self):
+        for lane, arrivals in self._lane_arrivals:
+            if self._tick >= arrivals.next_tick:
+                new_vehicle = self._lane_queued_vehicles[lane]
+                if new_vehicle is None:
+                    new_vehicle = self.garage.new_vehicle()
+                status, num_vehicles = self.road.add_vehicle_to_lane(
+                    new_vehicle, lane)
+                if status:
+                    self._vehicle_count += num_vehicles
+                    self._lane_queued_vehicles[lane] = None
+                else:
+                    self._vehicle_failures += num_vehicles
+                    self._lane_queued_vehicles[lane] = new_vehicle
+                arrivals.advance()
+
+    def vehicles_per_hour(self):
+        return int((Decimal(self._vehicle_count) /
+                    Decimal(self.simulated_time)) * 3600)
+
     @staticmethod
     def adjust_truck_percentage(orig_truck, truck_pct, plat_pct,
                                 plat_len):
@@ -136,10 +169,14 @@ class Simulation(object):
             return 100 - int(truck_pct), int(truck_pct)
 
     def update(self, frequency, time_step):
-        self.last_t = (Consts.SIMULATION_LENGTH - self.simulated_time) * (frequency / Consts.TIME_STEP)
+        simulation_length = self.config.simulation_length
+        self.last_t = (simulation_length - self.simulated_time) * (frequency / time_step)
         while True:
+            self._tick += 1
             self.simulated_time += time_step
-            if self._next_vehicle_in <= time_step:
+            if self._lane_arrivals:
+                self._add_lane_arrivals()
+            elif self._tick >= self._arrivals.next_tick:
                 lane = None
                 if self.queued_vehicles:
                     lane, new_vehicle = self.queued_vehicles.pop(0)
@@ -151,76 +188,72 @@ class Simulation(object):
                 else:
                     self._vehicle_failures += num_vehicles
                     self.queued_vehicles.append((lane, new_vehicle))
-                self._next_vehicle_in = self._vehicle_timer
-            else:
-                self._next_vehicle_in -= Decimal(time_step)
+                self._arrivals.advance()
 
             assert(len(self.queued_vehicles) <= 1)
 
-            self._vehicles_per_hour = int((self._vehicle_count / Decimal(self.simulated_time)) * 3600)
+            vehicle_data = self.road.update(time_step, self.simulated_time)
+            if self.frames and self._tick % self._frame_ticks == 0:
+                self.frames.add_frame(self.simulated_time, vehicle_data)
 
-            self.road.update(time_step, self.simulated_time, self.queue)
-
-            if self.simulated_time >= Consts.SIMULATION_LENGTH:
+            if self.simulated_time >= simulation_length:
                 self.finish_event.succeed()
 
-            if self.conn and Consts.FORCE_DISPLAY_FREQ:
-                self.last_freq = frequency
-                new_frequency = frequency
-                while self.conn.poll():
-                    # Never go faster than the desired update frequency
-                    new_frequency = max(self.conn.recv(),
-                                        Consts.SIMULATION_FREQUENCY)
-
-                if (abs(((self.last_freq + new_frequency) / 2) - frequency) / frequency) * 100 > 10:
-                    frequency = new_frequency
-
-            elif frequency != Consts.SIMULATION_FREQUENCY:
-                frequency = Consts.SIMULATION_FREQUENCY
-
-            if self.conn:
-                self.conn.send(((Consts.SIMULATION_LENGTH - self.simulated_time) * (frequency / Consts.TIME_STEP), self.simulated_time))
-            else:
-                t = (Consts.SIMULATION_LENGTH - self.simulated_time) * (
-                            frequency / Consts.TIME_STEP)
-                if self.last_t - t > 1:
-                    self.last_t = t
-                    sys.stdout.write("\r\033[K")
-                    sys.stdout.write("\rTime Remaining: {:.5f}s".format(t))
-                    sys.stdout.flush()
+            t = (simulation_length - self.simulated_time) * (
+                        frequency / time_step)
+            if self.channel:
+                self.channel.publish(self.simulated_time, t, vehicle_data)
+            elif self.last_t - t > 1:
+                self.last_t = t
+                sys.stdout.write("\r\033[K")
+                sys.stdout.write("\rTime Remaining: {:.5f}s".format(t))
+                sys.stdout.flush()
 
             yield self.env.timeout(frequency)
 
 
-def simulation_process(queue, conn, configuration, res, conf):
-    print('Starting simulation with seed: {}'.format(Consts.SIMULATION_SEED))
-    environment = simpy.RealtimeEnvironment(strict=False)
+def simulation_process(channel, config, configuration, res, conf,
+                       realtime=None):
+    print('Starting simulation with seed: {}'.format(config.simulation_seed))
+    # Without a display there is nothing to keep in step with the wall clock,
+    # so FAST runs on virtual time and completes as quickly as possible
+    if realtime is None:
+        realtime = not (os.getenv("HEADLESS") and os.getenv("FAST"))
+    if realtime:
+        environment = simpy.RealtimeEnvironment(strict=False)
+    else:
+        environment = simpy.Environment()
     finish_event = environment.event()
-    simulation = Simulation(environment, finish_event, queue, conn, configuration)
-    total_sim_time = Consts.SIMULATION_LENGTH * (
-            Consts.SIMULATION_FREQUENCY / Consts.TIME_STEP)
-
-    print('Estimated simulation run time: {} seconds'.format(total_sim_time))
-    if Consts.FORCE_DISPLAY_FREQ:
-        print('[WARNING] Forcing simulation to sync with display. '
-              'Simulation may take longer than estimated')
+    simulation = Simulation(environment, finish_event, channel, config,
+                            configuration)
+    config = simulation.config
+    total_sim_time = config.simulation_length * (
+            config.simulation_frequency / config.time_step)
+
+    if realtime:
+        print('Estimated simulation run time: {} seconds'.format(total_sim_time))
+    else:
+        print('Running simulation on virtual time, not bound to the wall clock')
 
     start_time = time.time()
-    environment.sync()
+    if realtime:
+        environment.sync()
     environment.run(until=finish_event)
     end_time = time.time()
+    simulation.road.finalise()
+    if simulation.frames:
+        simulation.frames.close()
+        print('Exported {} frames to "{}"'.format(simulation.frames.frames,
+                                                  simulation.frames.path))
     if os.getenv("HEADLESS"):
         print('\r')
     print('Simulation finished after {} seconds.'.format(int(end_time - start_time)))
-    if queue:
-        queue.put(False)
-    if conn:
-        while conn.poll():
-            conn.recv()
+    if channel:
+        channel.finish()
 
     print('\tSimulated {} seconds and {} vehicles, {} veh/h'.
           format(int(simulation.simulated_time), simulation._vehicle_count,
-                 simulation._vehicles_per_hour))
+                 simulation.vehicles_per_hour()))
 
     print('\t[Bridge] {} calls, {} cars, {} trucks, {} inflow failures'.
           format(simulation.road._calls, simulation.road._cars,
@@ -236,120 +269,190 @@ def simulation_process(queue, conn, configuration, res, conf):
 
     res.append({
         'configuration_file': conf,
-        'seed': Consts.SIMULATION_SEED,
+        'seed': config.simulation_seed,
         'time': int(simulation.simulated_time),
         'vehicles': simulation._vehicle_count,
-        'flow': simulation._vehicles_per_hour,
+        'flow': simulation.vehicles_per_hour(),
         'cars': simulation.garage._cars,
         'trucks': simulation.garage._trucks,
         'truck_platoons': simulation.garage._truck_platoons,
-        'car_pct': Consts.CAR_PCT,
-        'truck_pct': Consts.TRUCK_PCT,
+        'car_pct': config.car_pct,
+        'truck_pct': config.truck_pct,
         'actual_car_pct': pct_car,
         'actual_truck_pct': pct_truck,
-        'platoon_pct': Consts.PLATOON_CHANCE,
+        'platoon_pct': config.platoon_chance,
         'average_weight': simulation.road.road_detector.average_weight()
     })
 
     print('Writing detector output...')
     simulation.road.write_detector_output()
-    print('Rendering detector graphs...')
-    simulation.road.plot_detector_output()
-    print('Rendering vehicle garage graphs...')
-    simulation.garage.plot()
+    simulation.garage.write_samples()
+    if os.getenv("NO_PLOTS"):
+        print('Skipping graphs, render them later with: ./Plotting.py "{}"'.
+              format(simulation.garage.path))
+    else:
+        print('Rendering graphs...')
+        graphs = Plotting.plot_run(simulation.garage.path,
+                                   int(os.getenv("PLOT_DPI", Plotting.DPI)))
+        print('Rendered {} graphs'.format(graphs))
     print('Creating copy of the configuration file...')
-    shutil.copy(conf, 'output/{}/{}'.format(Consts.BASE_OUTPUT_DIR, Consts.SIMULATION_SEED))
-    print('Finished generating output to "output/{}/{}"'.format(Consts.BASE_OUTPUT_DIR, Consts.SIMULATION_SEED))
+    shutil.copy(conf, simulation.garage.path)
+    print('Finished generating output to "{}"'.format(simulation.garage.path))
 
 
-def display_process(queue, conn):
-    display = Display.Display(1600, 900, Consts.ROAD_LENGTH,
-                              Consts.BRIDGE_LANES)
-    running = True
+def display_process(channel, config):
+    import Display
+    from Display import pygame
+    display = Display.Display(1600, 900, config.road_length,
+                              config.bridge_lanes)
+    clock = pygame.time.Clock()
+    frame = 0
     start = time.time()
-    while running:
-        vehicle_data = queue.get()
-        if type(vehicle_data) is list:
-            display.paint(vehicle_data, conn)
-        elif vehicle_data is False:
-            running = False
-            while conn.poll():
-                conn.recv()
+    while not channel.finished:
+        # Draw whatever frame is newest, frames published since the last one
+        # was drawn are dropped
+        data = channel.read(frame)
+        if data:
+            (frame, display.simulated_time, display.remaining_time,
+             vehicle_data) = data
+            display.paint(vehicle_data)
+        else:
+            pygame.event.pump()
+        clock.tick(channel.max_fps)
     end = time.time()
     print('Display finished after {} seconds.'.format(int(end - start)))
     display.cleanup()
+    channel.close()
+
+
+def run_configs(config, configuration, conf, results):
+    """
+    Runs every run of a configuration, one after another in this process
+    """
+    seeds = Consts.generate_seeds(config.simulation_seed,
+                                  config.simulation_short_seed,
+                                  config.num_runs)
+    for i, (seed, short_seed) in enumerate(seeds):
+        run_config = config.replace(simulation_seed=seed,
+                                    simulation_short_seed=short_seed)
+
+        print("\nStarting run {} of {}".format(i + 1, config.num_runs))
+
+        if os.getenv("HEADLESS") is None:
+            processes = []
+            channel = DisplayChannel.for_config(run_config,
+                                                run_config.display_fps)
+            disp = Process(target=display_process, args=(channel,
+                                                         run_config))
+            sim = Process(target=simulation_process, args=(channel,
+                                                           run_config,
+                                                           configuration,
+                                                           results, conf))
+
+            processes.append(sim)
+            processes.append(disp)
+
+            for process in processes:
+                process.start()
+
+            for process in processes:
+                process.join()
+            channel.close()
+            channel.unlink()
+        else:
+            simulation_process(None, run_config, configuration, results,
+                               conf)
+
+
+def batch_run(task):
+    conf, config, configuration = task
+    os.environ['HEADLESS'] = '1'
+    res = []
+    # Batch runs are always headless, so never wait on the wall clock
+    simulation_process(None, config, configuration, res, conf,
+                       realtime=False)
+    return res
+
+
+def run_batch(configs, workers, base_output_dir):
+    tasks = []
+    run_names = set()
+    for conf in configs:
+        if not os.path.isfile(conf):
+            print('Argument was not a file. Not sure what to do here, '
+                  'so skipping argument: {}!'.format(conf))
+            continue
+        f = open(conf)
+        configuration = json.loads(f.read())
+        f.close()
+        config = Consts.SimulationConfig.from_json(
+            configuration, base_output_dir=base_output_dir)
+        seeds = Consts.generate_seeds(config.simulation_seed,
+                                      config.simulation_short_seed,
+                                      config.num_runs)
+        for seed, short_seed in seeds:
+            # Runs sharing a seed would otherwise all write to the same
+            # output folder, replay and trajectory files at once, so each
+            # gets its own name before any of them start
+            run_name = str(seed)
+            counter = 0
+            while run_name in run_names or os.path.isdir(
+                    'output/{}/{}'.format(base_output_dir, run_name)):
+                run_name = '{}:{}'.format(seed, counter)
+                counter += 1
+            run_names.add(run_name)
+            tasks.append((conf, config.replace(
+                simulation_seed=seed, simulation_short_seed=short_seed,
+                run_name=run_name), configuration))
+
+    workers = workers or os.cpu_count()
+    print('Starting {} simulations across {} worker processes'.format(
+        len(tasks), workers))
+    results = []
+    with Pool(workers) as pool:
+        for res in pool.imap(batch_run, tasks):
+            results.extend(res)
+    return results
 
 
 if __name__ == '__main__':
-    def run_simulation():
-        Consts.configure_random()
-
-        if Consts.MULTI_LANE:
-            Consts.INFLOW_RATE = Consts.INFLOW_RATE * Consts.BRIDGE_LANES * 2
-
-        for i in range(Consts.NUM_RUNS):
-            if i != 0:
-                Consts.generate_seed()
-
-            print("\nStarting run {} of {}".format(i + 1, Consts.NUM_RUNS))
-
-            if os.getenv("HEADLESS") is None:
-                processes = []
-                vehicle_queue = Queue()
-                conns = Pipe(True)
-                disp = Process(target=display_process, args=(vehicle_queue,
-                                                             conns[1],))
-                sim = Process(target=simulation_process, args=(vehicle_queue,
-                                                               conns[0],
-                                                               config,
-                                                               results, conf))
-
-                processes.append(sim)
-                processes.append(disp)
-
-                for process in processes:
-                    process.start()
-
-                for process in processes:
-                    process.join()
-            else:
-                Consts.FORCE_DISPLAY_FREQ = False
-                simulation_process(None, None, config, results, conf)
-
     if os.path.isdir('debug'):
         print('Removing old debug files\n')
         shutil.rmtree('debug')
 
-    config = None
     results = []
-    conf = None
+    base_output_dir = Consts.BASE_OUTPUT_DIR
 
     if len(sys.argv) > 1:
-        Consts.BASE_OUTPUT_DIR = sys.argv[1]
-        if len(sys.argv) >= 2:
+        base_output_dir = sys.argv[1]
+        if os.getenv("WORKERS") is not None:
+            results = run_batch(sys.argv[2:], int(os.getenv("WORKERS")),
+                                base_output_dir)
+        elif len(sys.argv) > 2:
             for arg in sys.argv[2:]:
                 if os.path.isfile(arg):
-                    conf = arg
                     f = open(arg)
-                    config = json.loads(f.read())
+                    configuration = json.loads(f.read())
                     f.close()
                     print('\nStarting simulation with config: {}'.format(arg))
-                    Consts.load_from_json(config)
-                    run_simulation()
+                    config = Consts.SimulationConfig.from_json(
+                        configuration, base_output_dir=base_output_dir)
+                    run_configs(config, configuration, arg, results)
                 else:
                     print('Argument was not a file. Not sure what to do here, '
                           'so skipping argument: {}!'.format(arg))
                     continue
-            else:
-                run_simulation()
+        else:
+            run_configs(Consts.SimulationConfig(
+                base_output_dir=base_output_dir), None, None, results)
     else:
-        run_simulation()
+        run_configs(Consts.SimulationConfig(), None, None, results)
 
     counter = 0
-    os.makedirs('output/global/{}/'.format(Consts.BASE_OUTPUT_DIR), exist_ok=True)
-    while os.path.isfile('output/global/{}/simulation_{}.csv'.format(Consts.BASE_OUTPUT_DIR, counter)):
+    os.makedirs('output/global/{}/'.format(base_output_dir), exist_ok=True)
+    while os.path.isfile('output/global/{}/simulation_{}.csv'.format(base_output_dir, counter)):
         counter += 1
-    path = 'output/global/{}/simulation_{}.csv'.format(Consts.BASE_OUTPUT_DIR, counter)
+    path = 'output/global/{}/simulation_{}.csv'.format(base_output_dir, counter)
 
     _file = open(path, 'w')
     csvwriter = csv.writer(_file)
@@ -0,0 +1,144 @@
+"""
+Columnar store of the state of every vehicle at every step of a run.
+
+While the run is going, rows are buffered into preallocated NumPy chunks of
+chunk_rows rows, and each full chunk is appended to a .part file next to the
+output. Closing the recorder rewrites the chunks as one file with each column
+stored contiguously:
+    * A header: magic, format version and number of rows
+    * Each of COLUMNS in turn, starting on a 64 byte boundary
+
+Every column can then be memory mapped straight from the file, see
+TrajectoryReader, so hours of trajectories can be analysed without loading
+them all into memory.
+"""
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b'TSTRAJ\x00\x00'
+VERSION = 1
+
+COLUMNS = (
+    ('time', '<f8'),
+    ('vehicle', '<u4'),
+    ('lane', '<i2'),
+    ('position', '<f4'),
+    ('velocity', '<f4'),
+    ('acceleration', '<f4'),
+    ('gap', '<f4'),
+)
+
+_HEADER = struct.Struct('<8sHQ')
+_ALIGNMENT = 64
+
+
+def _column_offsets(rows):
+    offsets = []
+    offset = _HEADER.size
+    for _, dtype in COLUMNS:
+        offset += -offset % _ALIGNMENT
+        offsets.append(offset)
+        offset += rows * np.dtype(dtype).itemsize
+    return offsets
+
+
+class TrajectoryRecorder(object):
+    def __init__(self, path, chunk_rows=65536):
+        self.path = path
+        self.rows = 0
+        self._part_path = path + '.part'
+        self._part = open(self._part_path, 'wb')
+        self._chunks = []
+        self._chunk = {name: np.empty(chunk_rows, dtype=dtype)
+                       for name, dtype in COLUMNS}
+        self._chunk_rows = chunk_rows
+        self._used = 0
+
+    def add_lane(self, simulated_time, lane, vehicles):
+        """
+        Records the current state of each of the vehicles in a lane
+        """
+        start = 0
+        while start < len(vehicles):
+            if self._used == self._chunk_rows:
+                self._write_chunk()
+            count = min(len(vehicles) - start, self._chunk_rows - self._used)
+            block = vehicles[start:start + count]
+            rows = slice(self._used, self._used + count)
+            chunk = self._chunk
+            chunk['time'][rows] = simulated_time
+            chunk['vehicle'][rows] = [vehicle._id for vehicle in block]
+            chunk['lane'][rows] = lane
+            chunk['position'][rows] = [vehicle.position for vehicle in block]
+            chunk['velocity'][rows] = [vehicle.velocity for vehicle in block]
+            chunk['acceleration'][rows] = [vehicle.acceleration
+                                           for vehicle in block]
+            chunk['gap'][rows] = [vehicle.gap for vehicle in block]
+            self._used += count
+            start += count
+
+    def _write_chunk(self):
+        if not self._used:
+            return
+        self._chunks.append((self._part.tell(), self._used))
+        for name, _ in COLUMNS:
+            self._part.write(self._chunk[name][:self._used].tobytes())
+        self.rows += self._used
+        self._used = 0
+
+    def close(self):
+        if self._part.closed:
+            return
+        self._write_chunk()
+        self._part.close()
+
+        # Gather each column from every chunk into one contiguous block
+        offsets = _column_offsets(self.rows)
+        with open(self._part_path, 'rb') as part, open(self.path, 'wb') as out:
+            out.write(_HEADER.pack(MAGIC, VERSION, self.rows))
+            for (name, dtype), offset in zip(COLUMNS, offsets):
+                itemsize = np.dtype(dtype).itemsize
+                out.write(b'\x00' * (offset - out.tell()))
+                for chunk_offset, rows in self._chunks:
+                    column_offset = chunk_offset
+                    for other, other_dtype in COLUMNS:
+                        if other == name:
+                            break
+                        column_offset += rows * np.dtype(other_dtype).itemsize
+                    part.seek(column_offset)
+                    out.write(part.read(rows * itemsize))
+        os.remove(self._part_path)
+
+
+class TrajectoryReader(object):
+    """
+    Memory maps the columns of a trajectory file, e.g. reader['position'] is
+    the position of every vehicle at every step, with reader['time'] and
+    reader['vehicle'] saying which step and vehicle each row is for
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as _file:
+            magic, version, self.rows = _HEADER.unpack(
+                _file.read(_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError('{} is not a trajectory file'.format(path))
+        if version != VERSION:
+            raise ValueError('Unsupported trajectory version: {}'.format(
+                version))
+        self.columns = {}
+        for (name, dtype), offset in zip(COLUMNS,
+                                         _column_offsets(self.rows)):
+            if self.rows:
+                self.columns[name] = np.memmap(path, dtype=dtype, mode='r',
+                                               offset=offset,
+                                               shape=(self.rows,))
+            else:
+                self.columns[name] = np.empty(0, dtype=dtype)
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, name):
+        return self.columns[name]
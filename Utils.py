@@ -1,15 +1,82 @@
-from scipy.stats import *
+import random
+import uuid
 
+import numpy as np
 
-class MixtureModel(rv_continuous):
-    def __init__(self, submodels, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+
+class Uniform(object):
+    """
+    Uniform distribution from loc to loc + scale, drawing the same samples
+    from random_state as scipy.stats.uniform, so scipy.stats only has to be
+    imported for the distributions that need it
+    """
+    def __init__(self, loc, scale):
+        if scale < 0:
+            raise ValueError('The scale of a uniform distribution cannot be '
+                             'negative')
+        self.loc = loc
+        self.scale = scale
+        self.random_state = None
+
+    def rvs(self, size):
+        if self.scale == 0:
+            return self.loc * np.ones(size)
+        return (self.random_state.uniform(0.0, 1.0, size) *
+                self.scale) + self.loc
+
+
+class MixtureModel(object):
+    def __init__(self, submodels):
         self.submodels = submodels
+        self.random_state = None
+
+    def choose_submodels(self, size):
+        return self.random_state.randint(len(self.submodels), size=size)
 
     def rvs(self, size):
-        submodel_choices = self._random_state.randint(len(self.submodels), size=size)
-        submodel_samples = [submodel.rvs(size=size) for submodel in self.submodels]
-        rvs = []
-        for i in submodel_choices:
-            rvs.append(self._random_state.choice(submodel_samples[i]))
-        return rvs
+        # Every submodel is sampled for every value so that each of their
+        # random streams moves on by the same amount whichever is chosen
+        submodel_choices = self.choose_submodels(size)
+        submodel_samples = [submodel.rvs(size=size)
+                            for submodel in self.submodels]
+        return np.choose(submodel_choices, submodel_samples)
+
+
+class SampleBuffer(object):
+    """
+    Hands out samples one at a time, drawing them in blocks of block_size
+    whenever the buffer runs out. sample(size) must return size values, and
+    with the numpy and scipy generators a block of n gives the same values as
+    n separate draws, so buffering does not change a seeded run.
+    """
+    def __init__(self, sample, block_size=1024):
+        self._sample = sample
+        self._block_size = block_size
+        self._samples = []
+        self._index = 0
+
+    def next(self):
+        if self._index == len(self._samples):
+            self._samples = self._sample(self._block_size).tolist()
+            self._index = 0
+        value = self._samples[self._index]
+        self._index += 1
+        return value
+
+
+class VehicleUUIDs(object):
+    """
+    Maps the integer vehicle IDs handed out by the garage to UUIDs, for
+    exporting results. The nth vehicle gets the nth UUID from a generator
+    seeded with the simulation seed, the same UUIDs vehicles used to be
+    given when they were created.
+    """
+    def __init__(self, seed):
+        self._random = random.Random(seed)
+        self._uuids = []
+
+    def get(self, _id):
+        while len(self._uuids) <= _id:
+            self._uuids.append(str(uuid.UUID(
+                int=self._random.getrandbits(128), version=4)))
+        return self._uuids[_id]
@@ -1,8 +1,3 @@
-import os
-
-import Consts
-
-
 class Vehicle(object):
     def __init__(self, _id, desired_velocity, max_acceleration,
                  max_deceleration, minimum_distance, length, model, weight):
@@ -40,15 +35,23 @@ class Vehicle(object):
         self._new_position = None
         self._new_gap = None
 
-        self._file = None
+        # Results the driver model can reuse until the vehicle's state changes
+        self._step_cache = None
 
     def calc_new_params(self):
-        self._new_acceleration = self.model.calc_acceleration(self)
-        self._new_velocity = self.model.calc_velocity(self)
-        self._new_position = self.model.calc_position(self)
-        self._new_gap = self.model.calc_gap(self)
-
-    def update_new_params(self, simulated_time):
+        (self._new_acceleration, self._new_velocity, self._new_position,
+         self._new_gap) = self.model.calc_step(self)
+
+    def update_gap(self):
+        """
+        Updates the gap to the lead vehicle after a step, and calculates the
+        new parameters for the next step using it
+        """
+        self.gap, (self._new_acceleration, self._new_velocity,
+                   self._new_position, self._new_gap) = \
+            self.model.calc_gap_and_step(self)
+
+    def update_new_params(self):
         # Update previous positions
         self.prev_velocity = self.velocity
         self.prev_acceleration = self.acceleration
@@ -60,23 +63,20 @@ class Vehicle(object):
         self.acceleration = self._new_acceleration
         self.position = self._new_position
         self.gap = self._new_gap
+        self._step_cache = None
 
         assert(self.velocity >= 0)
         assert(self.position >= 0)
         if self.lead_vehicle:
             assert(self.lead_vehicle.position - self.lead_vehicle.length >= self.position)
 
-        if Consts.DEBUG_MODE:
-            self._file.write('{},{},{},{}\n'.format(simulated_time,
-                                                    self.velocity,
-                                                    self.position, self.gap))
-
     def set_desired_speed(self, desired_velocity):
         self.desired_velocity = desired_velocity
 
     def set_lead_vehicle(self, vehicle):
         self.lead_vehicle = vehicle
         self.gap = self.model.calc_gap(self)
+        self._step_cache = None
 
     def add_to_road(self, road, lead_vehicle):
         self._road = road
@@ -86,12 +86,8 @@ class Vehicle(object):
             self.velocity = min(self.get_desired_velocity(),
                                 (self.gap / self.get_safetime_headway()))
         else:
-            self.gap = Consts.ROAD_LENGTH + 100
+            self.gap = road.length + 100
             self.velocity = self.desired_velocity
-        if Consts.DEBUG_MODE:
-            os.makedirs('debug/lane_{}'.format(self.lane), exist_ok=True)
-            self._file = open('debug/lane_{}/{}.txt'.format(self.lane,
-                                                            self._id), 'w')
 
     def set_lane(self, lane):
         self.lane = lane
@@ -103,10 +99,6 @@ class Vehicle(object):
         road_limit = self._road.get_speed_limit(self.lane, self.position)
         return min(road_limit, self.desired_velocity) if road_limit else self.desired_velocity
 
-    def finalise(self):
-        if Consts.DEBUG_MODE:
-            self._file.close()
-
     def __str__(self):
         return '{}({}, {}, {}, {})'.format(self._label, self._id,
                                            self.desired_velocity,
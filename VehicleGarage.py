@@ -1,33 +1,41 @@
-from faker import Faker
 import numpy as np
 import os
 import random
-import scipy.stats as stats
 
-import Consts
 from DriverModel import IDM, TruckPlatoon
-from Utils import MixtureModel
+from Utils import MixtureModel, SampleBuffer, Uniform
 from Vehicle import Car, Truck, PlatoonedTruck
 
 
+def _truncnorm(a, b, loc, scale):
+    # scipy.stats takes a noticeable part of a short run to import, so it is
+    # only imported once a truncated normal distribution is needed
+    import scipy.stats as stats
+    return stats.truncnorm(a, b, loc=loc, scale=scale)
+
+
 class Garage(object):
-    def __init__(self, seed, short_seed, car_pct, truck_pct, car_length,
-                 truck_length, platoon_chance, min_platoon_length,
-                 max_platoon_length, min_platoon_gap, max_platoon_gap):
+    def __init__(self, config):
+        seed = config.simulation_seed
         self._seed = seed
-        self._short_seed = short_seed
-        
-        self._car_pct = car_pct
+        self._short_seed = config.simulation_short_seed
+        self._debug = config.debug_mode
+
+        # One instance of each driver model shared by every vehicle
+        self._idm = IDM(config)
+        self._truck_platoon = TruckPlatoon(config)
+
+        self._car_pct = config.car_pct
         self._car_velocities = None
         self._car_gaps = None
-        self._car_length = car_length
+        self._car_length = config.car_length
         self._generated_car_velocities = []
         self._generated_car_gaps = []
 
-        self._truck_pct = truck_pct
+        self._truck_pct = config.truck_pct
         self._truck_velocities = None
         self._truck_gaps = None
-        self._truck_length = truck_length
+        self._truck_length = config.truck_length
         self._generated_truck_velocities = []
         self._generated_truck_gaps = []
         self._truck_unloaded_weights = None
@@ -35,32 +43,35 @@ class Garage(object):
         self._truck_weights = None
         self._generated_truck_weights = []
 
-        self._platoon_pct = platoon_chance
-        self._min_platoon_length = min_platoon_length
-        self._max_platoon_length = max_platoon_length
+        self._platoon_pct = config.platoon_chance
+        self._min_platoon_length = config.min_platoon_length
+        self._max_platoon_length = config.max_platoon_length
         self._platoon_lengths = random.Random(seed)
-        self._min_platoon_gap = min_platoon_gap
-        self._max_platoon_gap = max_platoon_gap
+        self._min_platoon_gap = config.min_platoon_gap
+        self._max_platoon_gap = config.max_platoon_gap
         self._platoon_gaps = random.Random(seed)
         self._platoon_loading = random.Random(seed)
 
         self._random = random.Random(seed)
-        self._uuid_generator = Faker()
-        self._uuid_generator.seed_instance(seed)
+        self._next_id = 0
         self._cars = 0
         self._trucks = 0
         self._truck_platoons = 0
-        if Consts.DEBUG_MODE:
+        if self._debug:
             self._debug_file = open('debug/garage.txt', 'w')
 
+        base_output_dir = config.base_output_dir
         path = 'output/{}/{}{}'
-        if os.path.isdir(path.format(Consts.BASE_OUTPUT_DIR, self._seed, '')):
+        if config.run_name is not None:
+            self.path = 'output/{}/{}'.format(base_output_dir,
+                                              config.run_name)
+        elif os.path.isdir(path.format(base_output_dir, self._seed, '')):
             counter = 0
-            while os.path.isdir(path.format(Consts.BASE_OUTPUT_DIR, self._seed, ':{}'.format(counter))):
+            while os.path.isdir(path.format(base_output_dir, self._seed, ':{}'.format(counter))):
                 counter += 1
-            self.path = path.format(Consts.BASE_OUTPUT_DIR, self._seed, ':{}'.format(counter))
+            self.path = path.format(base_output_dir, self._seed, ':{}'.format(counter))
         else:
-            self.path = path.format(Consts.BASE_OUTPUT_DIR, self._seed, '')
+            self.path = path.format(base_output_dir, self._seed, '')
             
     def configure_car_velocities(self, car_speed, car_speed_variance, car_speed_dist):
         car_min_speed = (1 - (car_speed_variance / 100))
@@ -68,12 +79,12 @@ class Garage(object):
         if car_speed_variance > 0 and car_speed_dist == 0:
             car_std_speed = ((car_speed * car_max_speed) - (
                         car_speed * car_min_speed)) / 4
-            self._car_velocities = stats.truncnorm(
+            self._car_velocities = _truncnorm(
                 ((car_speed * car_min_speed) - car_speed) / car_std_speed,
                 ((car_speed * car_max_speed) - car_speed) / car_std_speed,
                 loc=car_speed, scale=car_std_speed)
         elif car_speed_variance == 0 or car_speed_dist == 1:
-            self._car_velocities = stats.uniform(
+            self._car_velocities = Uniform(
                 loc=(car_speed * car_min_speed),
                 scale=(car_speed * car_max_speed) - car_speed)
         else:
@@ -81,6 +92,7 @@ class Garage(object):
                                'given settings!')
         self._car_velocities.random_state = np.random.RandomState(
             seed=self._short_seed)
+        self._car_velocities_buffer = SampleBuffer(self._car_velocities.rvs)
     
     def configure_car_gaps(self, car_gap, car_gap_variance, car_gap_dist):
         car_min_gap = (1 - (car_gap_variance / 100))
@@ -88,13 +100,13 @@ class Garage(object):
         if car_gap_variance > 0 and car_gap_dist == 0:
             car_std_gap = ((car_gap * car_max_gap) - (
                         car_gap * car_min_gap)) / 4
-            self._car_gaps = stats.truncnorm(
+            self._car_gaps = _truncnorm(
                 ((car_gap * car_min_gap) - car_gap) / car_std_gap,
                 ((car_gap * car_max_gap) - car_gap) / car_std_gap,
                 loc=car_gap, scale=car_std_gap
             )
         elif car_gap_variance == 0 or car_gap_dist == 1:
-            self._car_gaps = stats.uniform(
+            self._car_gaps = Uniform(
                 loc=(car_gap * car_min_gap),
                 scale=(car_gap * car_max_gap) - car_gap)
         else:
@@ -102,18 +114,19 @@ class Garage(object):
                                'given settings!')
         self._car_gaps.random_state = np.random.RandomState(
             seed=self._short_seed)
+        self._car_gaps_buffer = SampleBuffer(self._car_gaps.rvs)
 
     def configure_truck_velocities(self, truck_speed, truck_speed_variance, truck_speed_dist):
         truck_min_speed = (1 - (truck_speed_variance / 100))
         truck_max_speed = (1 + (truck_speed_variance / 100))
         if truck_speed_variance > 0 and truck_speed_dist == 0:
             truck_std_speed = ((truck_speed * truck_max_speed) - (truck_speed * truck_min_speed)) / 4
-            self._truck_velocities = stats.truncnorm(
+            self._truck_velocities = _truncnorm(
                 ((truck_speed * truck_min_speed) - truck_speed) / truck_std_speed,
                 ((truck_speed * truck_max_speed) - truck_speed) / truck_std_speed,
                 loc=truck_speed, scale=truck_std_speed)
         elif truck_speed_variance == 0 or truck_speed_dist == 1:
-            self._truck_velocities = stats.uniform(
+            self._truck_velocities = Uniform(
                 loc=(truck_speed * truck_min_speed),
                 scale=(truck_speed * truck_max_speed) - truck_speed)
         else:
@@ -121,6 +134,7 @@ class Garage(object):
                                'given settings!')
         self._truck_velocities.random_state = np.random.RandomState(
             seed=self._short_seed)
+        self._truck_velocities_buffer = SampleBuffer(self._truck_velocities.rvs)
 
     def configure_truck_gaps(self, truck_gap, truck_gap_variance, truck_gap_dist):
         truck_min_gap = (1 - (truck_gap_variance / 100))
@@ -128,13 +142,13 @@ class Garage(object):
         if truck_gap_variance > 0 and truck_gap_dist == 0:
             truck_std_gap = ((truck_gap * truck_max_gap) - (
                         truck_gap * truck_min_gap)) / 4
-            self._truck_gaps = stats.truncnorm(
+            self._truck_gaps = _truncnorm(
                 ((truck_gap * truck_min_gap) - truck_gap) / truck_std_gap,
                 ((truck_gap * truck_max_gap) - truck_gap) / truck_std_gap,
                 loc=truck_gap, scale=truck_std_gap
             )
         elif truck_gap_variance == 0 or truck_gap_dist == 1:
-            self._truck_gaps = stats.uniform(
+            self._truck_gaps = Uniform(
                 loc=(truck_gap * truck_min_gap),
                 scale=(truck_gap * truck_max_gap) - truck_gap)
         else:
@@ -142,6 +156,7 @@ class Garage(object):
                                'the given settings!')
         self._truck_gaps.random_state = np.random.RandomState(
             seed=self._short_seed)
+        self._truck_gaps_buffer = SampleBuffer(self._truck_gaps.rvs)
 
     def configure_truck_weights(self, unloaded_weight, loaded_weight,
                                 unloaded_variance, loaded_variance):
@@ -153,13 +168,13 @@ class Garage(object):
 
         if unloaded_variance > 0:
             unloaded_std = ((unloaded_weight * unloaded_max) - (unloaded_weight * unloaded_min)) / 4
-            self._truck_unloaded_weights = stats.truncnorm(
+            self._truck_unloaded_weights = _truncnorm(
                 ((unloaded_weight * unloaded_min) - unloaded_weight) / unloaded_std,
                 ((unloaded_weight * unloaded_max) - unloaded_weight) / unloaded_std,
                 loc=unloaded_weight, scale=unloaded_std
             )
         else:
-            self._truck_unloaded_weights = stats.uniform(
+            self._truck_unloaded_weights = Uniform(
                 loc=(unloaded_weight * unloaded_min),
                 scale=(unloaded_weight * unloaded_max) - unloaded_weight
             )
@@ -168,13 +183,13 @@ class Garage(object):
 
         if loaded_variance > 0:
             loaded_std = ((loaded_weight * loaded_max) - (loaded_weight * loaded_min)) / 4
-            self._truck_loaded_weights = stats.truncnorm(
+            self._truck_loaded_weights = _truncnorm(
                 ((loaded_weight * loaded_min) - loaded_weight) / loaded_std,
                 ((loaded_weight * loaded_max) - loaded_weight) / loaded_std,
                 loc=loaded_weight, scale=loaded_std
             )
         else:
-            self._truck_loaded_weights = stats.uniform(
+            self._truck_loaded_weights = Uniform(
                 loc=(loaded_weight * loaded_min),
                 scale=(loaded_weight * loaded_max) - loaded_weight
             )
@@ -186,18 +201,32 @@ class Garage(object):
         self._truck_weights.random_state = np.random.RandomState(
             seed=self._short_seed)
 
+        # Trucks in platoons draw from the loaded and unloaded models directly,
+        # so these share one buffer each with the mixture
+        self._truck_unloaded_weights_buffer = SampleBuffer(
+            self._truck_unloaded_weights.rvs)
+        self._truck_loaded_weights_buffer = SampleBuffer(
+            self._truck_loaded_weights.rvs)
+        self._truck_weight_choices = SampleBuffer(
+            self._truck_weights.choose_submodels)
+
+    def _new_id(self):
+        _id = self._next_id
+        self._next_id += 1
+        return _id
+
     def new_vehicle(self):
         if self._random.randint(0, 100) < self._car_pct:
-            vel = float(self._car_velocities.rvs(1)[0])
-            gap = float(self._car_gaps.rvs(1)[0])
-            new_vehicle = Car(self._uuid_generator.uuid4(), vel, 0.73, 1.67,
-                              gap, self._car_length, IDM, 2000)
+            vel = self._car_velocities_buffer.next()
+            gap = self._car_gaps_buffer.next()
+            new_vehicle = Car(self._new_id(), vel, 0.73, 1.67,
+                              gap, self._car_length, self._idm, 2000)
             self._cars += 1
             self._generated_car_velocities.append(vel)
             self._generated_car_gaps.append(gap)
         else:
-            vel = float(self._truck_velocities.rvs(1)[0])
-            gap = float(self._truck_gaps.rvs(1)[0])
+            vel = self._truck_velocities_buffer.next()
+            gap = self._truck_gaps_buffer.next()
             if self._random.randint(0, 100) < self._platoon_pct:
                 new_vehicle = []
                 platoon_gap = self._platoon_gaps.uniform(self._min_platoon_gap,
@@ -207,64 +236,46 @@ class Garage(object):
                 platoon_full = bool(self._platoon_loading.getrandbits(1))
                 for i in range(platoon_length):
                     if platoon_full:
-                        weight = float(self._truck_loaded_weights.rvs(1)[0])
+                        weight = self._truck_loaded_weights_buffer.next()
                     else:
-                        weight = float(self._truck_unloaded_weights.rvs(1)[0])
+                        weight = self._truck_unloaded_weights_buffer.next()
                     new_vehicle.append(
-                        PlatoonedTruck(self._uuid_generator.uuid4(), vel,
+                        PlatoonedTruck(self._new_id(), vel,
                                        0.73, 1.67, gap, self._truck_length,
-                                       TruckPlatoon, weight, i == 0,
+                                       self._truck_platoon, weight, i == 0,
                                        platoon_gap))
                     self._trucks += 1
                 self._truck_platoons += 1
             else:
-                weight = float(self._truck_weights.rvs(1)[0])
-                new_vehicle = Truck(self._uuid_generator.uuid4(), vel, 0.73,
-                                    1.67, gap, self._truck_length, IDM, weight)
+                # Equivalent of self._truck_weights.rvs(1), which draws from
+                # every submodel and keeps the chosen one
+                weights = (self._truck_unloaded_weights_buffer.next(),
+                           self._truck_loaded_weights_buffer.next())
+                weight = weights[self._truck_weight_choices.next()]
+                new_vehicle = Truck(self._new_id(), vel, 0.73,
+                                    1.67, gap, self._truck_length, self._idm,
+                                    weight)
                 self._trucks += 1
                 self._generated_truck_velocities.append(vel)
                 self._generated_truck_gaps.append(gap)
                 self._generated_truck_weights.append(weight)
 
-        if Consts.DEBUG_MODE:
+        if self._debug:
             if type(new_vehicle) is not list:
                 self._debug_file.write('{}\n'.format(new_vehicle.__str__()))
             else:
                 self._debug_file.write('[{}]\n'.format(','.join(x.__str__() for x in new_vehicle)))
         return new_vehicle
 
-    def plot(self):
+    def write_samples(self):
+        """
+        Writes the desired velocities, minimum gaps and weights generated for
+        vehicles to garage.npz in the output directory, for plotting
+        """
         os.makedirs(self.path, exist_ok=True)
-        import matplotlib.pyplot as plt
-        from matplotlib import rcParams
-        rcParams['axes.titlepad'] = 40
-
-        f, axarr = plt.subplots(3, 2, squeeze=False)
-
-        if self._generated_car_velocities:
-            axarr[0, 0].hist(self._generated_car_velocities, density=True, ec="k")
-            axarr[0, 0].set_xlabel('Desired Car Velocity (m/s)')
-            axarr[0, 0].set_ylabel('Density')
-        if self._generated_car_gaps:
-            axarr[0, 1].hist(self._generated_car_gaps, density=True, ec="k")
-            axarr[0, 1].set_xlabel('Desired Car Minimum Gap (m)')
-            axarr[0, 1].set_ylabel('Density')
-        if self._generated_truck_velocities:
-            axarr[1, 0].hist(self._generated_truck_velocities, density=True, ec="k")
-            axarr[1, 0].set_xlabel('Desired Truck Velocity (m/s)')
-            axarr[1, 0].set_ylabel('Density')
-        if self._generated_truck_gaps:
-            axarr[1, 1].hist(self._generated_truck_gaps, density=True, ec="k")
-            axarr[1, 1].set_xlabel('Desired Truck Minimum Gap (m)')
-            axarr[1, 1].set_ylabel('Density')
-        if self._generated_truck_weights:
-            axarr[2, 0].hist(self._generated_truck_weights, density=True, ec="k")
-            axarr[2, 0].set_xlabel('Truck Wights (m)')
-            axarr[2, 0].set_ylabel('Density')
-
-        f.suptitle('Data from Vehicle Generation', fontsize=12, y=0.99)
-        plt.subplots_adjust(top=0.85)
-        plt.tight_layout()
-        f.set_size_inches(16, 9)
-        plt.savefig('{}/garage.png'.format(self.path), dpi=300)
-        plt.close(f)
+        np.savez('{}/garage.npz'.format(self.path),
+                 car_velocities=self._generated_car_velocities,
+                 car_gaps=self._generated_car_gaps,
+                 truck_velocities=self._generated_truck_velocities,
+                 truck_gaps=self._generated_truck_gaps,
+                 truck_weights=self._generated_truck_weights)
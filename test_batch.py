@@ -0,0 +1,105 @@
+"""
+Checks batch runs through the process pool keep the output of every run
+apart, even when runs share a seed.
+
+Run with: python -m pytest test_batch.py
+"""
+import filecmp
+import json
+import os
+
+import numpy as np
+import pytest
+
+import Consts
+from Replay import ReplayReader
+import Simulation
+
+SEED = 275992053216840883315296079762438811551
+
+CONFIGURATION = {
+    'Seed': SEED,
+    'Short Seed': 3221332006,
+    'Simulation Length': 60,
+    'Simulation Time Step': 0.1,
+    'Road Length': 1000,
+    'Multi Lane Traffic': False,
+    'Truck Percentage': 20,
+    'Car Percentage': 80,
+    'detectors': [
+        {'type': 'point', 'lane': 0, 'position': 500, 'interval': 30},
+    ],
+    'headways': [],
+    'speedlimits': [],
+}
+
+
+@pytest.fixture
+def configs(tmp_path, monkeypatch):
+    # Runs write their output relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('NO_PLOTS', '1')
+    paths = []
+    for name, inflow_rate in (('light', 600), ('heavy', 2400)):
+        path = '{}.json'.format(name)
+        with open(path, 'w') as f:
+            json.dump(dict(CONFIGURATION, **{'Inflow Rate': inflow_rate}), f)
+        paths.append(path)
+    return paths
+
+
+def _run_sequentially(conf, base_output_dir):
+    with open(conf) as f:
+        configuration = json.load(f)
+    config = Consts.SimulationConfig.from_json(
+        configuration, base_output_dir=base_output_dir)
+    res = []
+    Simulation.simulation_process(None, config, configuration, res, conf,
+                                  realtime=False)
+    return res
+
+
+def _assert_same_files(directory, reference):
+    comparison = filecmp.dircmp(directory, reference)
+    assert not comparison.left_only and not comparison.right_only
+    for subdirectory in comparison.subdirs:
+        _assert_same_files(os.path.join(directory, subdirectory),
+                           os.path.join(reference, subdirectory))
+    for name in comparison.common_files:
+        if name.endswith('.npz'):
+            with np.load(os.path.join(directory, name)) as a, \
+                    np.load(os.path.join(reference, name)) as b:
+                assert sorted(a.files) == sorted(b.files)
+                for key in a.files:
+                    assert np.array_equal(a[key], b[key]), key
+        else:
+            assert filecmp.cmp(os.path.join(directory, name),
+                               os.path.join(reference, name),
+                               shallow=False), name
+
+
+def test_same_seed_runs_keep_their_own_output(configs):
+    results = Simulation.run_batch(configs, 2, 'batch')
+    assert [res['configuration_file'] for res in results] == configs
+    assert results[0]['vehicles'] != results[1]['vehicles']
+
+    for conf, run_name in zip(configs, (str(SEED), '{}:0'.format(SEED))):
+        path = 'output/batch/{}'.format(run_name)
+        assert filecmp.cmp(conf, '{}/{}'.format(path, conf), shallow=False)
+
+        # Each run matches the same configuration run on its own
+        name = os.path.splitext(conf)[0]
+        _run_sequentially(conf, name)
+        _assert_same_files(path, 'output/{}/{}'.format(name, SEED))
+
+        replay = ReplayReader('replays/replay-{}.rpl'.format(run_name))
+        frames = list(replay.frames())
+        replay.close()
+        assert len(frames) == len(replay)
+        assert frames[-1][0] == pytest.approx(60)
+
+
+def test_batch_runs_skip_existing_output(configs):
+    os.makedirs('output/batch/{}'.format(SEED))
+    Simulation.run_batch(configs[:1], 1, 'batch')
+    assert os.path.isfile('output/batch/{}:0/garage.npz'.format(SEED))
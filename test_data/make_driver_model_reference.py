@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Regenerates test_data/driver_model_reference from the baseline commit, before
+any of the changes to the driver model, by running the configuration in
+test_driver_model.py on a git worktree of that commit.
+
+The baseline keeps its settings in Consts, names vehicles with Faker UUIDs
+and writes its microscopic detector output as JSON, so its output is
+converted to the current layout: the macroscopic CSVs are copied as they
+are, and the microscopic data is written as CSVs with the vehicles numbered
+in the order the garage made them, as the current garage numbers them.
+
+Needs the baseline's requirements, including faker.
+
+Run with: python3 test_data/make_driver_model_reference.py
+"""
+import csv
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from faker import Faker
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from test_driver_model import CONFIGURATION, REFERENCE
+
+BASELINE = '831e6b4'
+
+# Run in the baseline tree as its __main__ does in headless mode, with the
+# per lane inflow rate scaled up for multi lane traffic, but on virtual time
+# rather than a RealtimeEnvironment so that it does not take the full
+# simulation length
+RUN_BASELINE = '''
+import json
+import sys
+
+import simpy
+
+import Consts
+
+with open(sys.argv[1]) as f:
+    configuration = json.load(f)
+Consts.BASE_OUTPUT_DIR = 'baseline'
+Consts.load_from_json(configuration)
+Consts.configure_random()
+if Consts.MULTI_LANE:
+    Consts.INFLOW_RATE = Consts.INFLOW_RATE * Consts.BRIDGE_LANES * 2
+Consts.FORCE_DISPLAY_FREQ = False
+
+import Simulation
+
+environment = simpy.Environment()
+finish_event = environment.event()
+simulation = Simulation.Simulation(environment, finish_event, None, None,
+                                   configuration)
+environment.run(until=finish_event)
+simulation.road.write_detector_output()
+'''
+
+
+def run_baseline(directory):
+    """
+    Runs the configuration on the baseline commit, returning the directory
+    its detector output was written to
+    """
+    tree = os.path.join(directory, 'baseline')
+    subprocess.run(['git', 'worktree', 'add', '--detach', tree, BASELINE],
+                   cwd=ROOT, check=True)
+    try:
+        conf = os.path.join(directory, 'configuration.json')
+        with open(conf, 'w') as f:
+            json.dump(CONFIGURATION, f)
+        subprocess.run([sys.executable, '-c', RUN_BASELINE, conf],
+                       cwd=directory, check=True,
+                       env=dict(os.environ, PYTHONPATH=tree))
+    finally:
+        subprocess.run(['git', 'worktree', 'remove', '--force', tree],
+                       cwd=ROOT, check=True)
+    return os.path.join(directory, 'output', 'baseline',
+                        str(CONFIGURATION['Seed']), 'detectors')
+
+
+def convert(source, destination):
+    faker = Faker()
+    faker.seed_instance(CONFIGURATION['Seed'])
+    numbers = {}
+
+    def number(_id):
+        # UUIDs are made in the same order as the vehicles
+        while _id not in numbers:
+            numbers[faker.uuid4()] = len(numbers)
+        return numbers[_id]
+
+    shutil.rmtree(destination, ignore_errors=True)
+    for lane in os.listdir(source):
+        os.makedirs(os.path.join(destination, lane))
+        for name in os.listdir(os.path.join(source, lane)):
+            path = os.path.join(source, lane, name)
+            if name.endswith('_macro.csv'):
+                shutil.copy(path, os.path.join(destination, lane, name))
+                continue
+            with open(path) as f:
+                micro = json.load(f).get('micro')
+            if micro is None:
+                # The road detector has no microscopic output
+                continue
+            micro_name = '{}_micro.csv'.format(os.path.splitext(name)[0])
+            with open(os.path.join(destination, lane, micro_name), 'w',
+                      newline='') as f:
+                # Empty, as the current output is, when no vehicles were seen
+                if micro:
+                    writer = csv.writer(f)
+                    fields = list(next(iter(micro.values())))
+                    writer.writerow(['id'] + fields)
+                    for _id, values in micro.items():
+                        writer.writerow([number(_id)] +
+                                        [values[field] for field in fields])
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as directory:
+        convert(run_baseline(directory), REFERENCE)
+    print('Wrote reference detector output from {} to "{}"'.format(
+        BASELINE, REFERENCE))
@@ -0,0 +1,104 @@
+"""
+Checks the arrival schedules in Demand.
+
+Run with: python -m pytest test_demand.py
+"""
+from decimal import Decimal
+
+import pytest
+
+import Consts
+from Demand import ConstantDemand, PoissonArrivals, NEVER, make_lane_demands
+
+
+def _countdown_ticks(rate, time_step, steps):
+    # The ticks vehicles arrived on with the Decimal countdown the inflow used
+    # before arrivals were scheduled on ticks
+    vehicle_timer = Decimal((60 * 60) / rate)
+    next_vehicle_in = Decimal(0)
+    ticks = []
+    for tick in range(1, steps + 1):
+        if next_vehicle_in <= time_step:
+            ticks.append(tick)
+            next_vehicle_in = vehicle_timer
+        else:
+            next_vehicle_in -= Decimal(time_step)
+    return ticks
+
+
+def _schedule_ticks(demand, steps):
+    ticks = []
+    for tick in range(1, steps + 1):
+        while demand.next_tick <= tick:
+            ticks.append(tick)
+            demand.advance()
+    return ticks
+
+
+@pytest.mark.parametrize('rate', [100, 1700, 2000, 3600, 7000])
+@pytest.mark.parametrize('time_step', [0.1, 0.25, 0.5, 1])
+def test_constant_demand_matches_countdown(rate, time_step):
+    steps = int(3600 / time_step)
+    assert (_schedule_ticks(ConstantDemand(rate, time_step), steps) ==
+            _countdown_ticks(rate, time_step, steps))
+
+
+@pytest.mark.parametrize('rate', [300, 1800, 3000])
+def test_poisson_arrivals_mean_rate(rate):
+    hours = 20
+    time_step = 0.1
+    last_tick = int(hours * 3600 / time_step)
+    stream = PoissonArrivals(rate, time_step, 3221332006).generate(last_tick)
+    expected = rate * hours
+    # Within four standard deviations of the expected count
+    assert abs(len(stream) - expected) < 4 * expected ** 0.5
+
+
+def test_poisson_arrivals_are_ordered_and_end():
+    last_tick = 36000
+    stream = PoissonArrivals(1800, 0.1, 3221332006).generate(last_tick)
+    ticks = _schedule_ticks(stream, last_tick)
+    assert len(ticks) == len(stream)
+    assert ticks == sorted(ticks)
+    assert stream.next_tick == NEVER
+
+
+def test_poisson_arrivals_are_seeded():
+    def ticks(seed):
+        return _schedule_ticks(
+            PoissonArrivals(1800, 0.1, seed).generate(36000), 36000)
+    assert ticks(42) == ticks(42)
+    assert ticks(42) != ticks(43)
+
+
+def _lanes(demand, multi_lane=True):
+    config = Consts.SimulationConfig(multi_lane=multi_lane, bridge_lanes=2,
+                                     simulation_length=60,
+                                     simulation_short_seed=42)
+    return [lane for lane, _ in make_lane_demands(config, demand)]
+
+
+def test_lane_demands_select_lanes():
+    profile = [[0, 1800]]
+    assert _lanes([{'lane': 'all', 'profile': profile}]) == [0, 1, 2, 3]
+    assert _lanes([{'lane': 'forward', 'profile': profile}]) == [0, 1]
+    assert _lanes([{'lane': 'reverse', 'profile': profile}]) == [2, 3]
+    assert _lanes([{'lane': 3, 'profile': profile}]) == [3]
+    assert _lanes([{'lane': 3, 'profile': profile}], multi_lane=False) == []
+
+
+@pytest.mark.parametrize('lane, index', [(-1, 3), (-2, 2), (-4, 0)])
+def test_lane_demands_map_negative_lanes(lane, index):
+    # As Road indexes its lanes, counting back from the last lane
+    profile = [[0, 1800]]
+    assert _lanes([{'lane': lane, 'profile': profile}]) == [index]
+    assert _lanes([{'lane': lane, 'profile': profile},
+                   {'lane': index, 'profile': [[0, 900]]}]) == [index]
+    assert _lanes([{'lane': lane, 'profile': profile}],
+                  multi_lane=False) == []
+
+
+@pytest.mark.parametrize('lane', [4, -5, 1.0, '1', 'both', True])
+def test_lane_demands_reject_unknown_lanes(lane):
+    with pytest.raises(ValueError, match=repr(lane)):
+        _lanes([{'lane': lane, 'profile': [[0, 1800]]}])
@@ -0,0 +1,68 @@
+"""
+Checks rows written through each detector output sink come back out of
+read_output, once the sink is closed and while it is still being written.
+
+Run with: python -m pytest test_detector_output.py
+"""
+import uuid
+
+import pytest
+
+from DetectorOutput import FLUSH_ROWS, SINKS, open_sink, read_output
+
+FIELDS = (('timestamp', '<f8'), ('velocity', '<f8'), ('flow', '<i8'))
+
+
+def _make_rows(count, uuids):
+    rows = []
+    for i in range(count):
+        _id = str(uuid.UUID(int=i)) if uuids else i
+        rows.append((_id, i * 0.1, (i / 3) - 20, (i * 7) % 1800))
+    return rows
+
+
+def _columns(fields, rows):
+    return {name: [row[i] for row in rows]
+            for i, (name, _) in enumerate(fields)}
+
+
+@pytest.fixture(params=sorted(SINKS))
+def output_format(request):
+    return request.param
+
+
+@pytest.mark.parametrize('uuids', [False, True])
+@pytest.mark.parametrize('count', [0, 1, (2 * FLUSH_ROWS) + 17])
+def test_output_round_trip(tmp_path, output_format, uuids, count):
+    fields = (('id', 'U36' if uuids else '<i8'),) + FIELDS
+    rows = _make_rows(count, uuids)
+    sink = open_sink(output_format, str(tmp_path / 'detector' / 'micro'),
+                     fields)
+    for row in rows:
+        sink.write(row)
+    sink.close()
+    assert sink.rows == count
+    assert sink.path == str(tmp_path / 'detector' / 'micro.{}'.format(
+        output_format))
+    assert read_output(sink.path, fields) == _columns(fields, rows)
+
+
+def test_output_readable_while_writing(tmp_path, output_format):
+    # Rows are appended to the file in blocks of FLUSH_ROWS, so a run that
+    # stops part way keeps every block written so far
+    fields = (('id', '<i8'),) + FIELDS
+    rows = _make_rows(FLUSH_ROWS + 5, False)
+    sink = open_sink(output_format, str(tmp_path / 'macro'), fields)
+    for row in rows:
+        sink.write(row)
+    assert read_output(sink.path, fields) == _columns(fields,
+                                                      rows[:FLUSH_ROWS])
+    sink.close()
+    assert read_output(sink.path, fields) == _columns(fields, rows)
+
+
+def test_unknown_format(tmp_path):
+    with pytest.raises(ValueError, match='parquet'):
+        open_sink('parquet', str(tmp_path / 'micro'), FIELDS)
+    with pytest.raises(ValueError, match='parquet'):
+        read_output(str(tmp_path / 'micro.parquet'), FIELDS)
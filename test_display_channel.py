@@ -0,0 +1,48 @@
+"""
+Checks frames pass through the DisplayChannel shared memory block.
+
+Run with: python -m pytest test_display_channel.py
+"""
+import pytest
+
+import DisplayChannel as display_channel
+from DisplayChannel import DisplayChannel
+
+
+@pytest.fixture
+def channel():
+    # A high max_fps so that every publish writes a frame
+    channel = DisplayChannel(2, 4, 1e9)
+    yield channel
+    channel.close()
+    channel.unlink()
+
+
+def test_read_returns_newest_frame(channel):
+    assert channel.read() is None
+    channel.publish(1.0, 10.0, [[('Car', 5.0, 1)], []])
+    channel.publish(2.0, 9.0, [[('Car', 7.0, 1)], [('Truck', 3.0, 2)]])
+    frame, simulated_time, remaining_time, vehicle_data = channel.read()
+    assert (frame, simulated_time, remaining_time) == (2, 2.0, 9.0)
+    assert vehicle_data == [[('Car', 7.0, 1)], [('Truck', 3.0, 2)]]
+    assert channel.read(frame) is None
+
+
+def test_publish_warns_once_when_over_capacity(channel, capsys):
+    lane = [('Car', float(position), position) for position in range(3)]
+    channel.publish(1.0, 10.0, [lane, lane])
+    assert 'only has room for 4' in capsys.readouterr().out
+    channel.publish(2.0, 9.0, [lane, lane])
+    assert 'only has room for 4' not in capsys.readouterr().out
+    _, _, _, vehicle_data = channel.read()
+    assert vehicle_data == [lane, lane[:1]]
+
+
+def test_read_gives_up_on_frame_being_written(channel, monkeypatch):
+    channel.publish(1.0, 10.0, [[('Car', 5.0, 1)], []])
+    # Leave the sequence number odd, as if the writer stalled part way
+    # through the next frame
+    channel._sequence += 1
+    channel._write_header(2, 2.0, 9.0, False)
+    monkeypatch.setattr(display_channel, '_READ_ATTEMPTS', 5)
+    assert channel.read(1) is None
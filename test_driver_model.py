@@ -0,0 +1,175 @@
+"""
+Checks the fused DriverModel steps against the individual calculations, and
+the detector output of a short run against the output of the baseline model,
+which test_data/make_driver_model_reference.py regenerates.
+
+Run with: python -m pytest test_driver_model.py
+"""
+import filecmp
+import os
+
+import pytest
+import simpy
+
+import Consts
+from DriverModel import DriverModel, IDM, TruckPlatoon
+from Simulation import Simulation
+
+REFERENCE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'test_data', 'driver_model_reference')
+
+# A short two lane run with platoons, a speed limit and a safetime headway
+# zone, so that every branch of both models is used
+CONFIGURATION = {
+    'Seed': 275992053216840883315296079762438811551,
+    'Short Seed': 3221332006,
+    'Simulation Length': 180,
+    'Simulation Time Step': 0.1,
+    'Road Length': 1000,
+    'Multi Lane Traffic': True,
+    'Number of Lanes': 1,
+    'Inflow Rate': 1700,
+    'Truck Percentage': 30,
+    'Car Percentage': 70,
+    'Platoon Percentage': 50,
+    'Minimum Platoon Length': 2,
+    'Maximum Platoon Length': 5,
+    'Minimum Platoon Gap': 2,
+    'Maximum Platoon Gap': 5,
+    'Road Detector Aggregation Interval': 30,
+    'detectors': [
+        {'type': 'point', 'lane': 'all', 'position': 500, 'interval': 30},
+        {'type': 'point', 'lane': 'all', 'position': 1000, 'interval': 30},
+        {'type': 'space', 'lane': 'all', 'position_start': 200,
+         'position_end': 600, 'interval': 30},
+    ],
+    'headways': [
+        {'lane': 'all', 'position_start': 300, 'position_end': 500,
+         'headway': 2},
+    ],
+    'speedlimits': [
+        {'lane': 0, 'position_start': 400, 'position_end': 700,
+         'speedlimit': 15},
+    ],
+}
+
+
+def _make_simulation(base_output_dir, length=None, **settings):
+    config = Consts.SimulationConfig.from_json(
+        CONFIGURATION, base_output_dir=base_output_dir, **settings)
+    if length:
+        config = config.replace(simulation_length=length)
+    environment = simpy.Environment()
+    finish_event = environment.event()
+    simulation = Simulation(environment, finish_event, None, config,
+                            CONFIGURATION)
+    return environment, finish_event, simulation
+
+
+def _run(base_output_dir, **settings):
+    """
+    Runs the configuration to the end and writes its detector output,
+    returning the directory it was written to
+    """
+    environment, finish_event, simulation = _make_simulation(base_output_dir,
+                                                             **settings)
+    environment.run(until=finish_event)
+    simulation.road.finalise()
+    simulation.road.write_detector_output()
+    return '{}/detectors'.format(simulation.garage.path)
+
+
+def _separate_step(model, vehicle):
+    # The step as the individual calculations give it, with no cached results
+    # from previous calculations
+    vehicle._step_cache = None
+    acceleration = model.calc_acceleration(vehicle)
+    vehicle._step_cache = None
+    velocity = model.calc_velocity(vehicle)
+    vehicle._step_cache = None
+    position = model.calc_position(vehicle)
+    vehicle._step_cache = None
+    gap = model.calc_gap(vehicle)
+    return acceleration, velocity, position, gap
+
+
+def _clear_caches(simulation):
+    for lane in simulation.road.vehicles:
+        for vehicle in lane:
+            vehicle._step_cache = None
+
+
+@pytest.fixture
+def output_dir(tmp_path, monkeypatch):
+    # Runs write their output relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_calc_step_matches_separate_calculations(output_dir):
+    environment, finish_event, simulation = _make_simulation('fused', 60)
+    checked = {IDM: 0, TruckPlatoon: 0}
+    while not finish_event.triggered:
+        environment.run(until=environment.now +
+                        simulation.config.simulation_frequency * 10)
+        for lane in simulation.road.vehicles:
+            for vehicle in lane:
+                _clear_caches(simulation)
+                expected = _separate_step(vehicle.model, vehicle)
+                _clear_caches(simulation)
+                assert vehicle.model.calc_step(vehicle) == expected
+                checked[type(vehicle.model)] += 1
+        _clear_caches(simulation)
+    assert checked[IDM] and checked[TruckPlatoon]
+
+
+def test_calc_gap_and_step_matches_separate_calculations(output_dir):
+    environment, finish_event, simulation = _make_simulation('fused', 60)
+    checked = {IDM: 0, TruckPlatoon: 0}
+    while not finish_event.triggered:
+        environment.run(until=environment.now +
+                        simulation.config.simulation_frequency * 10)
+        for lane in simulation.road.vehicles:
+            for vehicle in lane:
+                gap = vehicle.gap
+                _clear_caches(simulation)
+                vehicle.gap = vehicle.model.calc_gap(vehicle)
+                expected = vehicle.gap, _separate_step(vehicle.model,
+                                                       vehicle)
+                vehicle.gap = gap
+                _clear_caches(simulation)
+                assert vehicle.model.calc_gap_and_step(vehicle) == expected
+                vehicle.gap = gap
+                checked[type(vehicle.model)] += 1
+        _clear_caches(simulation)
+    assert checked[IDM] and checked[TruckPlatoon]
+
+
+def _assert_same_output(directory, reference):
+    comparison = filecmp.dircmp(directory, reference)
+    assert not comparison.left_only and not comparison.right_only
+    for subdirectory in comparison.subdirs:
+        _assert_same_output(os.path.join(directory, subdirectory),
+                            os.path.join(reference, subdirectory))
+    for name in comparison.common_files:
+        assert filecmp.cmp(os.path.join(directory, name),
+                           os.path.join(reference, name), shallow=False), name
+
+
+def test_detector_output_matches_reference(output_dir):
+    _assert_same_output(_run('fused'), REFERENCE)
+
+
+def test_vectorised_detector_output_matches_reference(output_dir):
+    _assert_same_output(_run('vectorised', vectorised_model=True), REFERENCE)
+
+
+def test_detector_output_matches_separate_calculations(output_dir,
+                                                       monkeypatch):
+    fused = _run('fused')
+    for model in (IDM, TruckPlatoon):
+        monkeypatch.setattr(model, 'calc_step', DriverModel.calc_step)
+        monkeypatch.setattr(model, 'calc_gap_and_step',
+                            DriverModel.calc_gap_and_step)
+    _assert_same_output(_run('separate'), fused)
+
@@ -0,0 +1,110 @@
+"""
+Checks frames written by ReplayWriter come back out of ReplayReader, whether
+streamed, looked up by time or read one at a time, and for replays that are
+empty or were never closed.
+
+Run with: python -m pytest test_replay.py
+"""
+import os
+
+import pytest
+
+from Replay import ReplayReader, ReplayWriter
+
+LANES = 2
+ROAD_LENGTH = 1000.0
+FRAMES_PER_CHUNK = 4
+
+
+def _make_frames(count):
+    # Vehicles join the back of the first lane every other frame, so the
+    # number in each lane changes between frames, and the labels used change
+    # over the run, so later chunks bring new strings with them. Positions
+    # are stored as float32, so are kept to values it holds exactly.
+    frames = []
+    for frame in range(count):
+        vehicles = frame // 2 + 1
+        lane = [('Car {}'.format(frame // 5) if i % 2 else 'Truck',
+                 (frame - (2 * i)) * 12.5, i)
+                for i in range(vehicles)]
+        frames.append((frame * 0.1, [lane, lane[:frame % 3]]))
+    return frames
+
+
+def _write(path, frames):
+    writer = ReplayWriter(path, LANES, ROAD_LENGTH, FRAMES_PER_CHUNK)
+    for simulated_time, vehicle_data in frames:
+        writer.add_frame(simulated_time, vehicle_data)
+    return writer
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'replay.rpl')
+
+
+def test_frames_round_trip(path):
+    frames = _make_frames(11)
+    _write(path, frames).close()
+    reader = ReplayReader(path)
+    assert (reader.lanes, reader.road_length) == (LANES, ROAD_LENGTH)
+    assert len(reader) == 11
+    assert reader.chunk_frames == [0, 4, 8]
+    assert list(reader.frames()) == frames
+    assert list(reader.frames(0.45)) == frames[5:]
+    reader.close()
+
+
+def test_get_frame_across_chunks(path):
+    frames = _make_frames(11)
+    _write(path, frames).close()
+    reader = ReplayReader(path)
+    # Back and forth over the chunk boundaries, so chunks are loaded again
+    for frame in (3, 4, 0, 10, 7, 8, 3, 9, 5):
+        assert reader.get_frame(frame) == frames[frame]
+    with pytest.raises(IndexError):
+        reader.get_frame(11)
+    with pytest.raises(IndexError):
+        reader.get_frame(-1)
+    reader.close()
+
+
+@pytest.mark.parametrize('simulated_time, frame', [
+    (-1, 0), (0, 0), (0.35, 4), (0.4, 4), (0.41, 5), (0.75, 8), (1.0, 10),
+    (60, 10)])
+def test_find_frame(path, simulated_time, frame):
+    _write(path, _make_frames(11)).close()
+    reader = ReplayReader(path)
+    assert reader.find_frame(simulated_time) == frame
+    reader.close()
+
+
+def test_empty_replay(path):
+    _write(path, []).close()
+    reader = ReplayReader(path)
+    assert len(reader) == 0
+    assert reader.chunk_offsets == []
+    assert list(reader.frames()) == []
+    with pytest.raises(IndexError):
+        reader.get_frame(0)
+    reader.close()
+
+
+@pytest.mark.parametrize('cut', [0, 5])
+def test_replay_without_index(path, cut):
+    # A run that stopped before the writer was closed has the chunks written
+    # so far, possibly with the last one only partly written, and no index
+    frames = _make_frames(11)
+    writer = _write(path, frames)
+    writer._file.flush()
+    os.truncate(path, os.path.getsize(path) - cut)
+    reader = ReplayReader(path)
+    complete = 4 if cut else 8
+    assert len(reader) == complete
+    # Straight to the last chunk, so the strings of the chunks before it
+    # have to be read first
+    assert reader.get_frame(complete - 1) == frames[complete - 1]
+    assert reader.find_frame(0.5) == min(5, complete - 1)
+    assert list(reader.frames()) == frames[:complete]
+    reader.close()
+    writer._file.close()
@@ -0,0 +1,53 @@
+"""
+Checks headless runs with FAST set run on virtual time, and give the same
+output as runs paced against the wall clock.
+
+Run with: python -m pytest test_simulation.py
+"""
+import json
+
+import pytest
+import simpy
+
+import Consts
+import Simulation
+from test_batch import CONFIGURATION, _assert_same_files
+
+
+@pytest.fixture
+def conf(tmp_path, monkeypatch):
+    # Runs write their output relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('NO_PLOTS', '1')
+    monkeypatch.setenv('HEADLESS', '1')
+    monkeypatch.delenv('FAST', raising=False)
+    with open('config.json', 'w') as f:
+        # Short enough to run against the wall clock in a fraction of a second
+        json.dump(dict(CONFIGURATION, **{'Simulation Length': 30,
+                                         'Inflow Rate': 1800}), f)
+    return 'config.json'
+
+
+def _run(conf, base_output_dir):
+    with open(conf) as f:
+        configuration = json.load(f)
+    config = Consts.SimulationConfig.from_json(
+        configuration, base_output_dir=base_output_dir)
+    res = []
+    Simulation.simulation_process(None, config, configuration, res, conf)
+    return 'output/{}/{}'.format(base_output_dir, config.simulation_seed)
+
+
+def test_fast_runs_on_virtual_time(conf, monkeypatch):
+    def realtime_environment(*args, **kwargs):
+        raise AssertionError('FAST run used a RealtimeEnvironment')
+
+    monkeypatch.setattr(simpy, 'RealtimeEnvironment', realtime_environment)
+    monkeypatch.setenv('FAST', '1')
+    _run(conf, 'fast')
+
+
+def test_fast_output_matches_realtime(conf, monkeypatch):
+    realtime = _run(conf, 'realtime')
+    monkeypatch.setenv('FAST', '1')
+    _assert_same_files(_run(conf, 'fast'), realtime)
@@ -0,0 +1,72 @@
+"""
+Checks rows recorded by TrajectoryRecorder, spilled to the .part file in
+chunks and gathered into columns on close, come back out of TrajectoryReader.
+
+Run with: python -m pytest test_trajectory.py
+"""
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from Trajectory import COLUMNS, TrajectoryReader, TrajectoryRecorder
+
+
+def _make_steps(count):
+    # (simulated_time, lane, vehicles) for each lane at each step, with the
+    # lanes holding more vehicles than fit in a chunk so that they are split
+    # across chunks. Values are kept to ones float32 holds exactly.
+    steps = []
+    for step in range(count):
+        for lane, vehicles in ((0, 5), (-1, step % 3)):
+            steps.append((step * 0.1, lane, [SimpleNamespace(
+                _id=(10 * step) + i, position=(step + i) * 2.5,
+                velocity=i * 0.5, acceleration=-0.25 * i, gap=100.0 - i)
+                for i in range(vehicles)]))
+    return steps
+
+
+def _expected(steps):
+    rows = [(simulated_time, vehicle._id, lane, vehicle.position,
+             vehicle.velocity, vehicle.acceleration, vehicle.gap)
+            for simulated_time, lane, vehicles in steps
+            for vehicle in vehicles]
+    return {name: np.array([row[i] for row in rows], dtype=dtype)
+            for i, (name, dtype) in enumerate(COLUMNS)}
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'trajectories.trj')
+
+
+@pytest.mark.parametrize('count', [1, 7])
+def test_recorded_rows_round_trip(path, count):
+    steps = _make_steps(count)
+    recorder = TrajectoryRecorder(path, chunk_rows=3)
+    for simulated_time, lane, vehicles in steps:
+        recorder.add_lane(simulated_time, lane, vehicles)
+    assert os.path.isfile(path + '.part')
+    recorder.close()
+    assert not os.path.exists(path + '.part')
+
+    expected = _expected(steps)
+    reader = TrajectoryReader(path)
+    assert len(reader) == recorder.rows == len(expected['time'])
+    for name, dtype in COLUMNS:
+        column = reader[name]
+        assert column.dtype == np.dtype(dtype)
+        assert isinstance(column, np.memmap)
+        assert np.array_equal(column, expected[name]), name
+
+
+def test_run_with_no_rows(path):
+    recorder = TrajectoryRecorder(path)
+    recorder.add_lane(0.1, 0, [])
+    recorder.close()
+    reader = TrajectoryReader(path)
+    assert len(reader) == 0
+    for name, dtype in COLUMNS:
+        assert reader[name].shape == (0,)
+        assert reader[name].dtype == np.dtype(dtype)